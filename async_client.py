@@ -0,0 +1,593 @@
+import asyncio
+import _thread
+import json
+
+from client import InvalidMessage, TX_BATCH_TIMEOUT
+from metachain import metachain as mc, get_subchains
+from transaction import Transaction
+from transaction_pool import TransactionPool
+from block import Block
+from block_store import BlockStore
+from block_verifier import BlockVerifier
+from chain_header import ChainHeader, MAX_HEADERS_PER_MESSAGE
+from message_framing import MessageDecoder, encode_message, get_hello_message, create_codec
+from server import CLIENT_IDLE_TIMEOUT
+from sync_flow import DEFAULT_SYNC_WINDOW, get_credit_message
+from gossip import INV_TX, GOSSIP_FEATURE, get_inv_messages, get_inv_response, get_getdata_responses, peer_supports_gossip
+from tx_batch import get_tx_batch_message, split_tx_batches
+
+READ_SIZE = 64 * 1024
+
+CONNECT_TIMEOUT = 3
+
+# servers that have not answered a hello after this long don't support compression
+HELLO_TIMEOUT = 5
+
+# keepalive pings are only sent after the connection has been quiet for the current interval.
+# the interval doubles while pongs come back promptly and drops back to the minimum when they don't.
+KEEPALIVE_MIN_INTERVAL = 1
+# stays well under the server's idle timeout
+KEEPALIVE_MAX_INTERVAL = CLIENT_IDLE_TIMEOUT / 3
+# a ping unanswered for this long means the connection is dead
+KEEPALIVE_TIMEOUT = 10
+# a pong slower than this many smoothed round trips counts as a slow link
+KEEPALIVE_SLOW_FACTOR = 4
+
+# responses that end a streamed request
+STREAM_END_TYPES = ['syncdone']
+
+# sync by downloading and checking the header chain first, then fetching block bodies from several peers at once
+HEADERS_FIRST_SYNC = True
+# blocks fetched per get_blocks request during headers-first sync
+BODY_RANGE_SIZE = 100
+# at most this many peers (besides the server) are used to download bodies
+MAX_DOWNLOAD_PEERS = 8
+# a get_headers or get_blocks request unanswered for this long counts as failed
+SYNC_REQUEST_TIMEOUT = 30
+
+# peers are announced as 'http://host:port' or 'host:port' strings, or [host, port] pairs.
+# returns (host, port), or None for entries we can't use.
+def parse_peer_address(peer):
+    try:
+        if isinstance(peer, (list, tuple)):
+            host, port = peer
+        else:
+            host, port = str(peer).split('://')[-1].rstrip('/').rsplit(':', 1)
+
+        return (host, int(port))
+    except:
+        return None
+
+# one connection, with requests multiplexed over it.
+# requests carry an id that the server echoes on its responses, so several can be outstanding at once.
+# must be used from the thread running its event loop.
+class AsyncConnection:
+    def __init__(self, loop, on_message=None):
+        self.loop = loop
+        # called with messages that are not responses to a request
+        self.on_message = on_message
+
+        self.reader = None
+        self.writer = None
+        self._send_lock = asyncio.Lock()
+        self.decoder = MessageDecoder()
+        # compresses what we send, once compression has been negotiated
+        self.codec = None
+        # protocol features the server listed in its hello
+        self.server_features = None
+
+        self._next_request_id = 0
+        # request id -> future (single response) or queue (streamed responses)
+        self._pending = {}
+        self.last_received = 0
+
+    async def open(self, address, port):
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(address, port), CONNECT_TIMEOUT)
+        self.last_received = self.loop.time()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    async def send(self, obj):
+        # compressed messages must be encoded in the order they are sent
+        async with self._send_lock:
+            self.writer.write(encode_message(obj, codec=self.codec))
+            await self.writer.drain()
+
+    # offers compression to the server. against servers that don't answer, the connection stays plain json.
+    async def negotiate(self):
+        try:
+            obj, attachment = await self.request(get_hello_message([GOSSIP_FEATURE]), timeout=HELLO_TIMEOUT)
+        except asyncio.TimeoutError:
+            return
+
+        self.server_features = obj.get("features")
+
+        if obj.get("codec") is None:
+            return
+
+        codec = create_codec(obj["codec"])
+
+        # the server compresses after our hello_ack, so the decoder has to be ready before it goes out
+        async with self._send_lock:
+            self.decoder.codec = codec
+            self.codec = codec
+
+            self.writer.write(encode_message({
+                'type': 'hello_ack'
+            }, codec=codec))
+
+            await self.writer.drain()
+
+    def _new_request_id(self):
+        self._next_request_id += 1
+
+        return self._next_request_id
+
+    # sends a request and waits for its single (obj, attachment) response
+    async def request(self, obj, timeout=None):
+        request_id = self._new_request_id()
+        future = self.loop.create_future()
+        self._pending[request_id] = future
+
+        obj['id'] = request_id
+
+        try:
+            await self.send(obj)
+
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    # sends a request and yields its (request id, obj, attachment) responses until the stream-ending message
+    async def request_stream(self, obj):
+        request_id = self._new_request_id()
+        queue = asyncio.Queue()
+        self._pending[request_id] = queue
+
+        obj['id'] = request_id
+
+        try:
+            await self.send(obj)
+
+            while True:
+                response = await queue.get()
+
+                if response is None:
+                    raise ConnectionError("connection closed during request")
+
+                if response[0]["type"] in STREAM_END_TYPES:
+                    if 'error' in response[0]:
+                        raise Exception(response[0]['error'])
+
+                    return
+
+                yield (request_id,) + response
+        finally:
+            self._pending.pop(request_id, None)
+
+    # reads and dispatches messages until the connection closes; outstanding requests then fail
+    async def listen(self, onstatus=print):
+        try:
+            while True:
+                try:
+                    data = await self.reader.read(READ_SIZE)
+                except Exception as e:
+                    print("Error while listening for server messages: {}".format(e))
+                    break
+
+                if not data:
+                    break
+
+                self.last_received = self.loop.time()
+
+                for payload, attachment in self.decoder.feed(data):
+                    try:
+                        obj = None
+
+                        try:
+                            obj = json.loads(payload)
+                        except:
+                            raise InvalidMessage(payload)
+
+                        if not isinstance(obj, dict) or obj.get("type") is None:
+                            raise InvalidMessage(obj)
+
+                        pending = self._pending.get(obj.get("id"))
+
+                        if isinstance(pending, asyncio.Future):
+                            if not pending.done():
+                                pending.set_result((obj, attachment))
+                        elif pending is not None:
+                            pending.put_nowait((obj, attachment))
+                        elif self.on_message is not None:
+                            self.on_message(obj)
+
+                    except InvalidMessage as e:
+                        onstatus(str(e))
+        finally:
+            for request_id, pending in list(self._pending.items()):
+                if isinstance(pending, asyncio.Future):
+                    pending.cancel()
+                else:
+                    pending.put_nowait(None)
+
+            self._pending = {}
+            self.close()
+
+# an asyncio client for the server it connects to (and, while syncing, the server's peers).
+# exposes the same connect/disconnect/broadcast_transaction interface and handlers as Client,
+# with its event loop running on a background thread.
+class AsyncClient:
+    def __init__(self, handlers):
+        self.handlers = handlers
+
+        self.peers = []
+        self.is_connected = False
+        self.block_verifier = BlockVerifier()
+
+        self.loop = None
+        self.connection = None
+
+        self.keepalive_interval = KEEPALIVE_MIN_INTERVAL
+        # smoothed ping round-trip time, in seconds
+        self.rtt = None
+
+    def connect(self, server_address, server_port):
+        assert not self.is_connected
+
+        self.loop = asyncio.new_event_loop()
+        _thread.start_new_thread(self.loop.run_until_complete, (self.run(server_address, server_port),))
+
+    def disconnect(self):
+        assert self.is_connected
+
+        self.loop.call_soon_threadsafe(self.connection.close)
+
+    # may be called from any thread
+    def broadcast_transaction(self, tx, blockchain_identifier):
+        print("broadcast: {}".format(tx.serialize()))
+
+        future = asyncio.run_coroutine_threadsafe(self.connection.send({
+            'type': 'pushtx',
+            'tx': tx.serialize(),
+            'blockchain': str(blockchain_identifier)
+        }), self.loop)
+
+        try:
+            future.result(CONNECT_TIMEOUT)
+        except Exception as e:
+            print("Failed to broadcast tx: {}".format(e))
+            raise e
+
+    # see Client.broadcast_transactions. may be called from any thread except the loop's.
+    def broadcast_transactions(self, txs, blockchain_identifier, timeout=TX_BATCH_TIMEOUT):
+        future = asyncio.run_coroutine_threadsafe(self.push_transactions(txs, blockchain_identifier, timeout), self.loop)
+
+        return future.result()
+
+    # sends the batches of txs together and gathers the server's results for each transaction, in order
+    async def push_transactions(self, txs, blockchain_identifier, timeout=TX_BATCH_TIMEOUT):
+        responses = await asyncio.gather(*[
+            self.connection.request(get_tx_batch_message(batch, blockchain_identifier), timeout=timeout)
+            for batch in split_tx_batches(txs)
+        ])
+
+        results = []
+
+        for obj, attachment in responses:
+            if obj.get("type") != "pushtx_result" or not isinstance(obj.get("results"), list):
+                raise InvalidMessage(obj)
+
+            results.extend(obj["results"])
+
+        return results
+
+    # announces (transaction, source) pairs new to our pool to the server, unless they came from it.
+    # may be called from any thread.
+    def relay_transactions(self, items):
+        if not peer_supports_gossip(self.connection.server_features):
+            return
+
+        hashes = [tx.calc_hash() for tx, source in items if source is not self]
+
+        for message in get_inv_messages(INV_TX, hashes):
+            asyncio.run_coroutine_threadsafe(self.connection.send(message), self.loop)
+
+    async def run(self, server_address, server_port):
+        self.connection = AsyncConnection(self.loop, on_message=self.respond_to_message)
+
+        try:
+            await self.connection.open(server_address, server_port)
+        except Exception as e:
+            self.handlers['onfailure'](e)
+            return
+
+        self.is_connected = True
+
+        self.handlers['onconnect']()
+
+        background_tasks = [
+            self.loop.create_task(self.connection.negotiate()),
+            self.loop.create_task(self.keepalive()),
+            self.loop.create_task(self.sync_metachain())
+        ]
+
+        try:
+            await self.connection.listen(self.handlers['onstatus'])
+        finally:
+            for task in background_tasks:
+                task.cancel()
+
+            self.is_connected = False
+            self.block_verifier.shutdown()
+
+            self.handlers['ondisconnect']()
+
+    # messages that are not responses to a request
+    def respond_to_message(self, obj):
+        msg_type = obj["type"]
+
+        if msg_type == "recvtx":
+            tx_obj = Transaction.deserialize(obj["tx"])
+            TransactionPool.instance.queue_tx(tx_obj, source=self)
+
+        elif msg_type == "inv":
+            # retried getdata requests are sent from the pool's thread
+            getdata = get_inv_response(TransactionPool.instance, obj, self, lambda message: asyncio.run_coroutine_threadsafe(self.connection.send(message), self.loop))
+
+            if getdata is not None:
+                self.loop.create_task(self.connection.send(getdata))
+
+        elif msg_type == "getdata":
+            for message in get_getdata_responses(TransactionPool.instance, obj):
+                self.loop.create_task(self.connection.send(message))
+
+        elif msg_type == "updatepeers":
+            self.peers = obj["peers"]
+
+    async def keepalive(self):
+        while self.is_connected:
+            await asyncio.sleep(self.keepalive_interval)
+
+            # any traffic proves the connection is alive
+            if self.loop.time() - self.connection.last_received < self.keepalive_interval:
+                continue
+
+            started = self.loop.time()
+
+            try:
+                await self.connection.request({
+                    'type': 'ping'
+                }, timeout=KEEPALIVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.handlers['onstatus']("Server did not answer a ping within {}s; disconnecting".format(KEEPALIVE_TIMEOUT))
+                self.connection.close()
+                return
+
+            rtt = self.loop.time() - started
+
+            if self.rtt is not None and rtt > self.rtt * KEEPALIVE_SLOW_FACTOR:
+                self.keepalive_interval = KEEPALIVE_MIN_INTERVAL
+            else:
+                self.keepalive_interval = min(self.keepalive_interval * 2, KEEPALIVE_MAX_INTERVAL)
+
+            if self.rtt is None:
+                self.rtt = rtt
+            else:
+                self.rtt = 0.875 * self.rtt + 0.125 * rtt
+
+    def _decode_block_page(self, obj, attachment):
+        if obj["type"] == "recvblockpage_raw":
+            if attachment is None:
+                raise InvalidMessage("recvblockpage_raw without block data")
+
+            return [Block.from_bytes(record) for record in BlockStore.split_records(attachment)]
+
+        assert isinstance(obj.get("blockpage"), list), 'blockpage should be list'
+
+        return list(map(lambda block_json: Block.deserialize(block_json), obj["blockpage"]))
+
+    # blocks are verified (in parallel) and linked to the local chain tip before being added
+    def _add_block_page(self, obj, attachment):
+        blocks = self._decode_block_page(obj, attachment)
+
+        for block_obj in self.block_verifier.verify(blocks, mc.last_block):
+            mc.add_block(block_obj, save=True)
+
+        return len(blocks)
+
+    # pulls the blocks after last_block_hash; returns the number of blocks added
+    async def get_chain_metadata(self, blockchain_identifier, last_block_hash):
+        block_count = 0
+
+        async for request_id, obj, attachment in self.connection.request_stream({
+            'type': 'get_chain_metadata',
+            'identifier': str(blockchain_identifier),
+            'last_block_hash': last_block_hash,
+            'raw': True,
+            'window': DEFAULT_SYNC_WINDOW
+        }):
+            # pages are added in order; decoding and verification run off the event loop
+            page_block_count = await self.loop.run_in_executor(None, self._add_block_page, obj, attachment)
+            block_count += page_block_count
+
+            # hand the page's share of the window back so the server keeps streaming
+            if page_block_count != 0:
+                await self.connection.send(get_credit_message(request_id, page_block_count))
+
+        return block_count
+
+    def _read_headers(self, headers_json, prev):
+        headers = [ChainHeader.deserialize(header_json) for header_json in headers_json]
+
+        for header in headers:
+            header.verify(prev)
+            prev = header
+
+        return headers
+
+    # downloads the header chain after the local tip from the server, checking linkage and proof of work as it goes
+    async def fetch_headers(self, blockchain):
+        headers = []
+        prev = blockchain.last_block
+
+        while True:
+            obj, attachment = await self.connection.request({
+                'type': 'get_headers',
+                'identifier': str(blockchain.get_identifier()),
+                'last_block_hash': prev.block_hash,
+                'count': MAX_HEADERS_PER_MESSAGE
+            }, timeout=SYNC_REQUEST_TIMEOUT)
+
+            if 'error' in obj:
+                raise Exception(obj['error'])
+
+            if not isinstance(obj.get("headers"), list):
+                raise InvalidMessage(obj)
+
+            page = await self.loop.run_in_executor(None, self._read_headers, obj["headers"], prev)
+            headers.extend(page)
+
+            if len(page) < MAX_HEADERS_PER_MESSAGE:
+                return headers
+
+            prev = page[-1]
+
+    # bodies are only accepted if they match the headers they were requested for
+    def _check_bodies(self, obj, attachment, headers):
+        if 'error' in obj:
+            raise Exception(obj['error'])
+
+        blocks = self._decode_block_page(obj, attachment)
+
+        assert len(blocks) == len(headers), "expected {} blocks, received {}".format(len(headers), len(blocks))
+
+        for header, block in zip(headers, blocks):
+            errors = header.check_body(block)
+            assert len(errors) == 0, "block {} failed verification: {}".format(header.block_hash, errors)
+
+        return blocks
+
+    def _add_checked_blocks(self, blockchain, blocks):
+        for block in blocks:
+            blockchain.add_block(block, save=True)
+
+    async def _open_peer_connections(self):
+        connections = []
+
+        for peer in self.peers:
+            if len(connections) == MAX_DOWNLOAD_PEERS:
+                break
+
+            address = parse_peer_address(peer)
+
+            if address is None:
+                continue
+
+            connection = AsyncConnection(self.loop)
+
+            try:
+                await connection.open(*address)
+            except Exception as e:
+                print("Could not connect to peer {}: {}".format(peer, e))
+                continue
+
+            self.loop.create_task(connection.listen())
+            connections.append(connection)
+
+        return connections
+
+    # fetches the headers after the local tip, then the matching bodies in ranges spread over the server and its peers.
+    # ranges are added to the chain in order as they arrive. returns the number of blocks added.
+    async def sync_headers_first(self, blockchain):
+        headers = await self.fetch_headers(blockchain)
+
+        if len(headers) == 0:
+            return 0
+
+        self.handlers['onstatus']("Downloading {} blocks".format(len(headers)))
+
+        # the server's chain matches ours up to our tip, so header i is at height start_height + i there
+        start_height = blockchain.height + 1
+
+        ranges = asyncio.Queue()
+
+        for index in range(0, len(headers), BODY_RANGE_SIZE):
+            ranges.put_nowait((index, min(BODY_RANGE_SIZE, len(headers) - index)))
+
+        # header index -> downloaded and checked blocks of the range starting there
+        downloaded = {}
+        arrived = asyncio.Event()
+
+        async def download(connection):
+            try:
+                while True:
+                    index, count = await ranges.get()
+
+                    try:
+                        obj, attachment = await connection.request({
+                            'type': 'get_blocks',
+                            'identifier': str(blockchain.get_identifier()),
+                            'start_height': start_height + index,
+                            'count': count,
+                            'raw': True
+                        }, timeout=SYNC_REQUEST_TIMEOUT)
+
+                        blocks = await self.loop.run_in_executor(None, self._check_bodies, obj, attachment, headers[index:index + count])
+                    except Exception as e:
+                        # give the range to another connection and stop using this one
+                        ranges.put_nowait((index, count))
+                        print("Dropping a block download connection: {}".format(e))
+                        return
+
+                    downloaded[index] = blocks
+                    arrived.set()
+            finally:
+                arrived.set()
+
+        peer_connections = await self._open_peer_connections()
+        downloads = [self.loop.create_task(download(connection)) for connection in [self.connection] + peer_connections]
+
+        block_count = 0
+
+        try:
+            while block_count < len(headers):
+                if block_count in downloaded:
+                    blocks = downloaded.pop(block_count)
+                    await self.loop.run_in_executor(None, self._add_checked_blocks, blockchain, blocks)
+                    block_count += len(blocks)
+                    continue
+
+                if all([task.done() for task in downloads]):
+                    raise Exception("no peers left to download blocks from ({} of {} blocks added)".format(block_count, len(headers)))
+
+                arrived.clear()
+                await arrived.wait()
+        finally:
+            for task in downloads:
+                task.cancel()
+
+            for connection in peer_connections:
+                connection.close()
+
+        return block_count
+
+    async def sync_metachain(self):
+        print("Loading local metachain blocks...")
+        await self.loop.run_in_executor(None, mc.load_blocks, self.block_verifier)
+
+        get_subchains()
+
+        print("Syncing metachain from {}".format(mc.last_block.block_hash))
+
+        try:
+            if HEADERS_FIRST_SYNC:
+                block_count = await self.sync_headers_first(mc)
+            else:
+                block_count = await self.get_chain_metadata(mc.get_identifier(), mc.last_block.block_hash)
+
+            self.handlers['onstatus']("Metachain synced ({} new blocks)".format(block_count))
+        except Exception as e:
+            self.handlers['onstatus']("Metachain sync failed: {}".format(e))
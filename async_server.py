@@ -0,0 +1,527 @@
+import asyncio
+import _thread
+import json
+
+from client import InvalidMessage
+from object_identifier import ObjectIdentifier
+from blockchain import BlockchainSyncState
+from transaction import Transaction
+from transaction_pool import TransactionPool
+from metachain import metachain
+from message_framing import MessageDecoder, PreparedMessage, encode_message, tag_request_id, get_hello_reply, create_codec
+from server import Server, CLIENT_IDLE_TIMEOUT, PEER_SEND_QUEUE_SIZE
+from gossip import INV_TX, GOSSIP_FEATURE, get_inv_messages, get_inv_response, get_getdata_responses, get_broadcast_tx, select_fanout, peer_supports_gossip
+from tx_batch import get_tx_batch_response
+from sync_workers import SYNC_WORKERS, SYNC_QUEUE_SIZE, SyncBusy
+from sync_flow import AsyncSyncWindow, SyncStalled, PageSizer, MAX_SYNC_PAGE_SIZE, get_requested_window
+
+READ_SIZE = 64 * 1024
+
+LISTEN_BACKLOG = 1024
+
+class AsyncPeer:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info('peername')
+        self.decoder = MessageDecoder()
+        # held for a whole message, so frames (and sendfile'd attachments) never interleave
+        self.send_lock = asyncio.Lock()
+        # request id -> AsyncSyncWindow of each running sync stream
+        self.sync_windows = {}
+        # compresses what we send, once the peer has finished negotiating compression
+        self.codec = None
+        # broadcast messages, drained by the peer's sender task
+        self.send_queue = asyncio.Queue(PEER_SEND_QUEUE_SIZE)
+        # protocol features the peer listed in its hello
+        self.features = None
+
+    async def send(self, obj):
+        # compressed messages must be encoded in the order they are sent
+        async with self.send_lock:
+            self.writer.write(encode_message(obj, codec=self.codec))
+            await self.writer.drain()
+
+    async def send_queued(self):
+        while True:
+            message = await self.send_queue.get()
+            await self.send(message)
+
+    def close(self):
+        for window in self.sync_windows.values():
+            window.close()
+
+        self.writer.close()
+
+# a Server that handles every peer connection as a coroutine on a single asyncio event loop,
+# instead of a thread per client (and per sync request).
+# blocking disk and CPU work is pushed to the loop's default executor.
+class AsyncServer(Server):
+    def __init__(self, onstatus):
+        Server.__init__(self, onstatus)
+
+        self.loop = None
+        self._server = None
+        # keeps running sync tasks referenced until they finish
+        self._tasks = set()
+        # sync streams are served SYNC_WORKERS at a time, with at most SYNC_QUEUE_SIZE more waiting.
+        # created on the loop's thread, like everything asyncio in here.
+        self._sync_slots = None
+        self._sync_requests = 0
+        # resolves once the metachain has loaded; shared by every sync waiting for it
+        self._metachain_synced = None
+
+        self.command_handlers = {
+            'ping': self.on_ping,
+            'get_chain_metadata': self.on_get_chain_metadata,
+            'pushtx': self.on_pushtx,
+            'pushtx_batch': self.on_pushtx_batch,
+            'broadcast': self.on_broadcast,
+            'sync_credit': self.on_sync_credit,
+            'get_headers': self.on_get_headers,
+            'get_blocks': self.on_get_blocks,
+            'hello': self.on_hello,
+            'hello_ack': self.on_hello_ack,
+            'recvtx': self.on_recvtx,
+            'inv': self.on_inv,
+            'getdata': self.on_getdata
+        }
+
+    def start(self, address, port):
+        assert not self.is_running
+
+        try:
+            self.loop = asyncio.new_event_loop()
+            self._server = self.loop.run_until_complete(asyncio.start_server(self.handle_peer, address, port, reuse_address=True, backlog=LISTEN_BACKLOG))
+
+            # have to get this working with public-facing addresses.
+            self.inform_node_hub("http://{}:{}".format(address, port))
+
+            _thread.start_new_thread(self.loop.run_forever, ())
+            _thread.start_new_thread(self.load_metachain, ())
+
+            self.is_running = True
+
+            self.onstatus("Server is running")
+        except Exception as e:
+            self.onstatus("Failed to start server; Consider restarting the application. The error message was: {}".format(e))
+            self.is_running = False
+
+    def stop(self):
+        assert self.is_running
+        assert not self.loop is None
+
+        self.is_running = False
+        self.loop.call_soon_threadsafe(self._shutdown)
+        self.peers = []
+
+        self.onstatus("Server not running")
+
+    def _shutdown(self):
+        self._server.close()
+
+        for key, peer in list(self.clients.items()):
+            peer.close()
+
+        self.clients = {}
+        self.loop.stop()
+
+    # may be called from any thread (e.g. the transaction pool)
+    def send_to_client(self, peer, obj):
+        asyncio.run_coroutine_threadsafe(peer.send(obj), self.loop)
+
+    # queues obj for every peer (except exclude) without waiting on any of them. may be called from any thread.
+    # the message is serialized once; peers whose queue is full miss it.
+    def broadcast(self, obj, exclude=None):
+        if self.loop is None:
+            return
+
+        message = PreparedMessage(obj)
+
+        self.loop.call_soon_threadsafe(self._fan_out, message, exclude)
+
+    def _fan_out(self, message, exclude=None):
+        for key, peer in list(self.clients.items()):
+            if peer is not exclude:
+                self.queue_message(peer, message)
+
+    def queue_message(self, peer, message):
+        try:
+            peer.send_queue.put_nowait(message)
+        except asyncio.QueueFull:
+            print("Send queue of peer {} is full; dropping a message".format(peer.address))
+
+    # see Server.relay_transactions. may be called from any thread.
+    def relay_transactions(self, items):
+        if self.loop is None:
+            return
+
+        self.loop.call_soon_threadsafe(self._relay_transactions, items)
+
+    def _relay_transactions(self, items):
+        tx_messages = {}
+
+        for peer in select_fanout(list(self.clients.values())):
+            txs = [tx for tx, source in items if source is not peer]
+
+            if len(txs) == 0:
+                continue
+
+            if peer_supports_gossip(peer.features):
+                for message in get_inv_messages(INV_TX, [tx.calc_hash() for tx in txs]):
+                    self.queue_message(peer, PreparedMessage(message))
+
+                continue
+
+            for tx in txs:
+                if id(tx) not in tx_messages:
+                    tx_messages[id(tx)] = PreparedMessage({
+                        'type': 'recvtx',
+                        'tx': tx.serialize()
+                    })
+
+                self.queue_message(peer, tx_messages[id(tx)])
+
+    def _spawn(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+        return task
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+
+        # a peer going away mid-send is expected; don't let it surface as an unretrieved exception
+        if not task.cancelled() and task.exception() is not None:
+            print("Peer task failed: {}".format(task.exception()))
+
+    async def handle_peer(self, reader, writer):
+        peer = AsyncPeer(reader, writer)
+        key = "%s:%s" % peer.address[0:2]
+
+        self.clients[key] = peer
+        sender = self.loop.create_task(peer.send_queued())
+
+        try:
+            while self.is_running:
+                data = await asyncio.wait_for(reader.read(READ_SIZE), CLIENT_IDLE_TIMEOUT)
+
+                if not data:
+                    break
+
+                for payload, attachment in peer.decoder.feed(data):
+                    try:
+                        obj = None
+
+                        try:
+                            obj = json.loads(payload)
+                        except:
+                            raise InvalidMessage(payload)
+
+                        await self.respond_to_command_async(peer, obj)
+
+                    except InvalidMessage as e:
+                        self.onstatus(str(e))
+        except Exception as e:
+            pass
+        finally:
+            if self.clients.get(key) is peer:
+                del self.clients[key]
+
+            sender.cancel()
+            peer.close()
+
+    async def respond_to_command_async(self, peer, obj):
+        if not isinstance(obj, dict) or obj.get("type") not in self.command_handlers:
+            raise InvalidMessage(obj)
+
+        await self.command_handlers[obj["type"]](peer, obj)
+
+    async def on_ping(self, peer, obj):
+        await peer.send(tag_request_id({
+            'type': 'pong'
+        }, obj.get("id")))
+
+    # compressed frames from the peer are accepted once we have answered its hello
+    async def on_hello(self, peer, obj):
+        peer.features = obj.get("features")
+
+        reply = get_hello_reply(obj, [GOSSIP_FEATURE])
+
+        await peer.send(reply)
+
+        if reply['codec'] is not None:
+            peer.decoder.codec = create_codec(reply['codec'])
+
+    # the peer compresses from its hello_ack on; our side of the stream switches over with it
+    async def on_hello_ack(self, peer, obj):
+        if peer.decoder.codec is None:
+            raise InvalidMessage(obj)
+
+        async with peer.send_lock:
+            peer.codec = peer.decoder.codec
+
+    async def on_get_chain_metadata(self, peer, obj):
+        if obj.get("identifier") is None:
+            raise InvalidMessage(obj)
+
+        if obj.get("last_block_hash") is None:
+            raise InvalidMessage(obj)
+
+        identifier = None
+
+        try:
+            identifier = ObjectIdentifier.parse(obj["identifier"])
+        except:
+            raise InvalidMessage(obj)
+
+        raw = obj.get("raw", False) is True
+
+        try:
+            self._take_sync_request()
+        except SyncBusy as e:
+            await peer.send(self.get_sync_done_message(obj.get("id"), str(e)))
+            return
+
+        window = AsyncSyncWindow(get_requested_window(obj))
+        peer.sync_windows[obj.get("id")] = window
+
+        task = self._spawn(self.sync_blockchain_for_peer(peer, identifier, obj["last_block_hash"], raw, obj.get("id"), window))
+        task.add_done_callback(lambda task: self._sync_done(peer, obj.get("id"), window))
+
+    # counts a sync request against the limit of SYNC_WORKERS running and SYNC_QUEUE_SIZE waiting, raising SyncBusy
+    # if it has been reached. counted before the request's task gets to run, so a burst of requests can't all slip in;
+    # released when the task is done, which covers it being cancelled before it ever ran.
+    def _take_sync_request(self):
+        if self._sync_requests >= SYNC_WORKERS + SYNC_QUEUE_SIZE:
+            raise SyncBusy("too many sync requests are waiting; try again later")
+
+        self._sync_requests += 1
+
+    def _get_sync_slots(self):
+        if self._sync_slots is None:
+            self._sync_slots = asyncio.Semaphore(SYNC_WORKERS)
+
+        return self._sync_slots
+
+    # answers a get_headers or get_blocks request with send(*args), in a sync slot like a sync stream.
+    # requests over the limit are answered with an error instead.
+    async def serve_sync_request(self, peer, obj, send, *args):
+        try:
+            self._take_sync_request()
+        except SyncBusy as e:
+            await peer.send(self.get_sync_busy_reply(obj, e))
+            return
+
+        task = self._spawn(self._send_in_sync_slot(send, *args))
+        task.add_done_callback(self._sync_request_done)
+
+    async def _send_in_sync_slot(self, send, *args):
+        async with self._get_sync_slots():
+            await send(*args)
+
+    def _sync_request_done(self, task):
+        self._sync_requests -= 1
+
+    async def on_get_headers(self, peer, obj):
+        identifier = self.parse_chain_identifier(obj)
+
+        if obj.get("last_block_hash") is None:
+            raise InvalidMessage(obj)
+
+        await self.serve_sync_request(peer, obj, self.send_headers_to_peer, peer, identifier, obj["last_block_hash"], obj.get("count"), obj.get("id"))
+
+    async def send_headers_to_peer(self, peer, identifier, last_block_hash, count, request_id):
+        message = await self.loop.run_in_executor(None, self.get_headers_message, identifier, last_block_hash, count, request_id)
+
+        await peer.send(message)
+
+    async def on_get_blocks(self, peer, obj):
+        identifier = self.parse_chain_identifier(obj)
+
+        if not isinstance(obj.get("start_height"), int) or obj["start_height"] < 1:
+            raise InvalidMessage(obj)
+
+        if not isinstance(obj.get("count"), int) or obj["count"] < 1:
+            raise InvalidMessage(obj)
+
+        raw = obj.get("raw", False) is True
+
+        await self.serve_sync_request(peer, obj, self.send_blocks_to_peer, peer, identifier, obj["start_height"], obj["count"], raw, obj.get("id"))
+
+    # answers a get_blocks request with one page holding the blocks at start_height and after
+    async def send_blocks_to_peer(self, peer, identifier, start_height, count, raw, request_id):
+        blockchain = self.get_served_chain(identifier)
+        serialized_blocks = []
+
+        if blockchain is not None:
+            count = min(count, MAX_SYNC_PAGE_SIZE)
+
+            if raw:
+                await self.send_raw_block_page(peer, blockchain, start_height, count, request_id)
+                return
+
+            serialized_blocks = await self.loop.run_in_executor(None, self._serialize_block_page, blockchain, start_height - 1, count)
+
+        await peer.send(tag_request_id({
+            'type': 'recvblockpage',
+            'blockpage': serialized_blocks
+        }, request_id))
+
+    # the peer has finished with some blocks of a sync stream and can take that many more
+    async def on_sync_credit(self, peer, obj):
+        if not isinstance(obj.get("blocks"), int) or obj["blocks"] <= 0:
+            raise InvalidMessage(obj)
+
+        window = peer.sync_windows.get(obj.get("id"))
+
+        if window is not None:
+            window.grant(obj["blocks"])
+
+    async def on_pushtx(self, peer, obj):
+        if obj.get("tx") is None:
+            raise InvalidMessage(obj)
+
+        if obj.get("blockchain") is None:
+            raise InvalidMessage(obj)
+
+        tx = None
+
+        try:
+            tx = Transaction.deserialize(obj["tx"])
+        except Exception as e:
+            print("Error deserializing tx: {}".format(e))
+            raise InvalidMessage(obj)
+
+        TransactionPool.instance.queue_tx(tx, source=peer)
+
+    # deserializing and adding a large batch is CPU work, so it runs in the executor
+    async def on_pushtx_batch(self, peer, obj):
+        response = await self.loop.run_in_executor(None, get_tx_batch_response, TransactionPool.instance, obj, peer)
+
+        if response is None:
+            raise InvalidMessage(obj)
+
+        await peer.send(response)
+
+    # a transaction we asked for with getdata
+    async def on_recvtx(self, peer, obj):
+        tx = None
+
+        try:
+            tx = Transaction.deserialize(obj.get("tx"))
+        except Exception as e:
+            raise InvalidMessage(obj)
+
+        TransactionPool.instance.queue_tx(tx, source=peer)
+
+    async def on_inv(self, peer, obj):
+        # retried getdata requests are sent from the pool's thread
+        getdata = get_inv_response(TransactionPool.instance, obj, peer, lambda message: self.loop.call_soon_threadsafe(self.queue_message, peer, PreparedMessage(message)))
+
+        if getdata is not None:
+            await peer.send(getdata)
+
+    async def on_getdata(self, peer, obj):
+        for message in get_getdata_responses(TransactionPool.instance, obj):
+            await peer.send(message)
+
+    # only transactions are relayed, through the pool, so peers can't push other messages to every peer
+    async def on_broadcast(self, peer, obj):
+        tx = get_broadcast_tx(obj)
+
+        if tx is None:
+            raise InvalidMessage(obj)
+
+        TransactionPool.instance.queue_tx(tx, source=peer)
+
+    async def send_raw_block_page(self, peer, blockchain, start_height, count, request_id=None):
+        ranges = blockchain.get_record_ranges(start_height, count)
+        size = sum([end - start for segment, start, end in ranges])
+
+        async with peer.send_lock:
+            peer.writer.write(encode_message(tag_request_id({
+                'type': 'recvblockpage_raw'
+            }, request_id), attachment_size=size, codec=peer.codec))
+
+            for segment, start, end in ranges:
+                with open(blockchain.block_store.get_segment_path(segment), 'rb') as segment_file:
+                    # os.sendfile where the transport supports it, read-and-write otherwise
+                    await self.loop.sendfile(peer.writer.transport, segment_file, start, end - start)
+
+            await peer.writer.drain()
+
+    def _serialize_block_page(self, blockchain, start_index, count):
+        return self.block_cache.get_page(blockchain, start_index, count)
+
+    # releases what on_get_chain_metadata took for a sync request once its task is done
+    def _sync_done(self, peer, request_id, window):
+        self._sync_requests -= 1
+
+        if peer.sync_windows.get(request_id) is window:
+            del peer.sync_windows[request_id]
+
+    async def sync_blockchain_for_peer(self, peer, identifier, last_block_hash, raw, request_id=None, window=None):
+        if window is None:
+            window = AsyncSyncWindow(None)
+
+        async with self._get_sync_slots():
+            # queued while the peer went away
+            if window.closed:
+                return
+
+            await self._sync_blockchain_for_peer(peer, identifier, last_block_hash, raw, request_id, window)
+
+    # waits for load_metachain to finish. one executor thread waits on the chain's event for all syncs.
+    async def wait_until_metachain_synced(self):
+        if metachain.sync_state == BlockchainSyncState.SYNCED:
+            return
+
+        if self._metachain_synced is None or self._metachain_synced.done():
+            self._metachain_synced = self.loop.run_in_executor(None, metachain.wait_until_synced)
+
+        await asyncio.shield(self._metachain_synced)
+
+    async def _sync_blockchain_for_peer(self, peer, identifier, last_block_hash, raw, request_id, window):
+        self.onstatus("Sync requested for blockchain with identifier {}".format(identifier))
+
+        # TODO: sync other blockchains than the metachain
+        if identifier != metachain.get_identifier():
+            return
+
+        await self.wait_until_metachain_synced()
+
+        try:
+            start_index = self.get_sync_start_index(metachain, last_block_hash)
+        except Exception as e:
+            self.onstatus(str(e))
+            await peer.send(self.get_sync_done_message(request_id, str(e)))
+            return
+
+        # pages are streamed as fast as the peer's window allows, sized to the observed throughput
+        page_sizer = PageSizer()
+        page_start = start_index
+
+        try:
+            while page_start < len(metachain.block_index):
+                started = self.loop.time()
+                count = await window.take(min(page_sizer.page_size, len(metachain.block_index) - page_start))
+
+                if raw:
+                    await self.send_raw_block_page(peer, metachain, page_start + 1, count, request_id)
+                else:
+                    serialized_blocks = await self.loop.run_in_executor(None, self._serialize_block_page, metachain, page_start, count)
+
+                    await peer.send(tag_request_id({
+                        'type': 'recvblockpage',
+                        'blockpage': serialized_blocks
+                    }, request_id))
+
+                page_start += count
+                page_sizer.record(count, self.loop.time() - started)
+        except SyncStalled as e:
+            await peer.send(self.get_sync_done_message(request_id, str(e)))
+            return
+
+        await peer.send(self.get_sync_done_message(request_id))
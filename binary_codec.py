@@ -0,0 +1,89 @@
+# compact binary encoding helpers used for block storage.
+# integers are unsigned LEB128 varints; bytes and strings are varint length-prefixed.
+
+class BinaryWriter:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def getvalue(self):
+        return bytes(self.buffer)
+
+    def write_uint(self, value):
+        assert value >= 0, "value should be unsigned ({})".format(value)
+
+        while value >= 0x80:
+            self.buffer.append((value & 0x7f) | 0x80)
+            value >>= 7
+
+        self.buffer.append(value)
+
+    def write_bytes(self, data):
+        self.write_uint(len(data))
+        self.buffer += data
+
+    def write_str(self, value):
+        self.write_bytes(value.encode('utf-8'))
+
+    # hex digests are stored as raw bytes; anything else (e.g. the genesis block's
+    # prev_block_hash of '0') is stored as a string behind a marker byte.
+    def write_hash(self, value):
+        raw = None
+
+        try:
+            raw = bytes.fromhex(value)
+        except ValueError:
+            pass
+
+        if raw is not None and raw.hex() == value and len(raw) < 0xff:
+            self.buffer.append(len(raw))
+            self.buffer += raw
+        else:
+            self.buffer.append(0xff)
+            self.write_str(value)
+
+class BinaryReader:
+    def __init__(self, data, offset=0):
+        self.data = memoryview(data)
+        self.offset = offset
+
+    def at_end(self):
+        return self.offset >= len(self.data)
+
+    def read_uint(self):
+        result = 0
+        shift = 0
+
+        while True:
+            assert self.offset < len(self.data), "unexpected end of data while reading varint"
+
+            byte = self.data[self.offset]
+            self.offset += 1
+
+            result |= (byte & 0x7f) << shift
+
+            if byte & 0x80 == 0:
+                return result
+
+            shift += 7
+
+    def read_raw(self, length):
+        assert self.offset + length <= len(self.data), "unexpected end of data (need {} bytes)".format(length)
+
+        data = self.data[self.offset:self.offset + length]
+        self.offset += length
+
+        return data
+
+    def read_bytes(self):
+        return bytes(self.read_raw(self.read_uint()))
+
+    def read_str(self):
+        return str(self.read_raw(self.read_uint()), 'utf-8')
+
+    def read_hash(self):
+        length = self.read_raw(1)[0]
+
+        if length == 0xff:
+            return self.read_str()
+
+        return self.read_raw(length).hex()
\ No newline at end of file
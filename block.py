@@ -1,11 +1,37 @@
 import time
 import json
 import os
+import hashlib
+import multiprocessing
+from collections import deque
 
 from block_header import BlockHeader
 from transaction_set import TransactionSet
+from binary_codec import BinaryWriter, BinaryReader
 from utility_classes import Hashable
 
+# number of nonces a solver worker tries per task
+SOLVE_CHUNK_SIZE = 50000
+
+# per-process solver state, set up once by _init_solver_worker
+_solver_state = None
+
+def _init_solver_worker(prefix, suffix, target):
+    global _solver_state
+    _solver_state = (hashlib.sha256(prefix.encode('utf-8')), suffix.encode('utf-8'), target)
+
+def _solve_nonce_range(start, count):
+    prefix_hash, suffix, target = _solver_state
+
+    for nonce in range(start, start + count):
+        h = prefix_hash.copy()
+        h.update(str(nonce).encode('utf-8') + suffix)
+
+        if int.from_bytes(h.digest(), 'big') < target:
+            return (nonce, h.hexdigest())
+
+    return None
+
 class Block(Hashable):
     def __init__(self, block_header, timestamp, tx_set, prev_block_hash, nonce=None, block_hash=None):
         self.block_header = block_header
@@ -47,6 +73,50 @@ class Block(Hashable):
 
         return Block(block_header=block_header, timestamp=json_obj['timestamp'], tx_set=tx_set_obj, prev_block_hash=json_obj['prev_block_hash'], nonce=json_obj['nonce'], block_hash=json_obj['hash'])
             
+    def serialize_binary(self, writer):
+        self.block_header.serialize_binary(writer)
+        writer.write_uint(self.timestamp)
+        writer.write_hash(self.prev_block_hash)
+        writer.write_uint(self.nonce)
+        writer.write_hash(self.block_hash)
+        self.tx_set.serialize_binary(writer)
+
+    # the fields stored ahead of the transaction set, as (block_header, timestamp, prev_block_hash, nonce, block_hash).
+    # they can be read without decoding the transactions.
+    @classmethod
+    def deserialize_binary_header(kls, reader):
+        block_header = BlockHeader.deserialize_binary(reader)
+        timestamp = reader.read_uint()
+        prev_block_hash = reader.read_hash()
+        nonce = reader.read_uint()
+        block_hash = reader.read_hash()
+
+        return (block_header, timestamp, prev_block_hash, nonce, block_hash)
+
+    @classmethod
+    def deserialize_binary(kls, reader):
+        block_header, timestamp, prev_block_hash, nonce, block_hash = kls.deserialize_binary_header(reader)
+        tx_set_obj = TransactionSet.deserialize_binary(reader)
+
+        assert timestamp < int(time.time()), 'timestamp should be < now'
+
+        return Block(block_header=block_header, timestamp=timestamp, tx_set=tx_set_obj, prev_block_hash=prev_block_hash, nonce=nonce, block_hash=block_hash)
+
+    def to_bytes(self):
+        writer = BinaryWriter()
+        self.serialize_binary(writer)
+
+        return writer.getvalue()
+
+    @classmethod
+    def from_bytes(kls, data):
+        reader = BinaryReader(data)
+        block = kls.deserialize_binary(reader)
+
+        assert reader.at_end(), 'trailing data after block'
+
+        return block
+
     def check_preconditions(self):
         errors = []
 
@@ -55,6 +125,9 @@ class Block(Hashable):
         if self.timestamp > current_time:
             errors.append("Block timestamp is greater than the current time ({} should be <= {}). Clock out of sync?".format(self.timestamp, current_time))
 
+        # a repeated transaction would also leave the merkle root ambiguous
+        errors.extend(self.tx_set.check_duplicates())
+
         # check each transaction to ensure the timestamp is < block timestamp
         for tx in self.tx_set.transactions:
             if tx.timestamp > self.timestamp:
@@ -71,57 +144,95 @@ class Block(Hashable):
         if len(errors) == 0:
             recalculated_hash = self.calc_hash()
 
-            if recalculated_hash == self.block_hash:
+            if recalculated_hash == self.block_hash and self.meets_target():
                 return True
         else:
             print("The following preconditions failed while verifying the block: \n{}".format(list(map(lambda item: "\t * {}".format(item), errors))))
 
         return False
+
+    def meets_target(self):
+        return int(self.block_hash, 16) < self.block_header.get_target()
     
-    def solve(self):
+    def solve(self, workers=1):
         assert self.nonce is None, "nonce should be None for unsolved blocks."
         
-        self.nonce = -1
         self._cache = {}
-        last_hash = None
-        
-        while last_hash is None or not last_hash.startswith('00000'):
-            self.nonce += 1
-            last_hash = self.calc_hash()
+        prefix, suffix = self._hash_parts()
+        target = self.block_header.get_target()
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if workers > 1:
+            nonce, last_hash = self._solve_parallel(prefix, suffix, target, workers)
+        else:
+            _init_solver_worker(prefix, suffix, target)
+
+            start = 0
+            result = None
+
+            while result is None:
+                result = _solve_nonce_range(start, SOLVE_CHUNK_SIZE)
+                start += SOLVE_CHUNK_SIZE
 
+            nonce, last_hash = result
+
+        self.nonce = nonce
         self.block_hash = last_hash
         self._cache = {}
             
         print("block solved, hash = {}, nonce = {}".format(last_hash, self.nonce))
         
         return last_hash
-    
-    def calc_hash(self):
-        assert self.nonce is not None, "nonce should not be None to calculate hash"
-        assert self.nonce >= 0, "nonce should not be less than zero"
 
+    # splits the nonce space into chunks handed out to a worker pool.
+    # results are collected in chunk order, so the winning nonce is always the
+    # lowest one -- the same (nonce, hash) the serial path would find.
+    def _solve_parallel(self, prefix, suffix, target, workers):
+        pool = multiprocessing.Pool(workers, initializer=_init_solver_worker, initargs=(prefix, suffix, target))
+
+        try:
+            pending = deque()
+            next_start = 0
+
+            while True:
+                while len(pending) < workers * 2:
+                    pending.append(pool.apply_async(_solve_nonce_range, (next_start, SOLVE_CHUNK_SIZE)))
+                    next_start += SOLVE_CHUNK_SIZE
+
+                result = pending.popleft().get()
+
+                if result is not None:
+                    return result
+        finally:
+            # cancel the chunks still being worked on
+            pool.terminate()
+            pool.join()
+
+    # the block hash is hash(prefix + nonce + suffix); everything that does not
+    # depend on the nonce is computed once and cached.
+    def _hash_parts(self):
         if 'block_header_hash' not in self._cache:
-          block_header_hash = self.block_header.calc_hash()
-          print("block_header_hash = {}".format(block_header_hash))
-          self._cache['block_header_hash'] = block_header_hash
-        else:
-          block_header_hash = self._cache['block_header_hash']
+          self._cache['block_header_hash'] = self.block_header.calc_hash()
 
         if 'tx_hash' not in self._cache:
-          tx_hash = self.tx_set.calc_hash()
-          print("tx_hash = {}".format(tx_hash))
-          self._cache['tx_hash'] = tx_hash
-        else:
-          tx_hash = self._cache['tx_hash']
+          self._cache['tx_hash'] = self.tx_set.calc_hash()
 
         if 'timestamp_hash' not in self._cache:
-          timestamp_hash = self.hash_str(str(self.timestamp))
-          print("timestamp_hash = {}".format(timestamp_hash))
-          self._cache['timestamp_hash'] = timestamp_hash
-        else:
-          timestamp_hash = self._cache['timestamp_hash']
+          self._cache['timestamp_hash'] = self.hash_str(str(self.timestamp))
+
+        prefix = self._cache['block_header_hash'] + self._cache['tx_hash'] + self._cache['timestamp_hash']
+
+        return (prefix, self.prev_block_hash)
+    
+    def calc_hash(self):
+        assert self.nonce is not None, "nonce should not be None to calculate hash"
+        assert self.nonce >= 0, "nonce should not be less than zero"
+
+        prefix, suffix = self._hash_parts()
 
-        return self.hash_str(block_header_hash + tx_hash + timestamp_hash + str(self.nonce) + self.prev_block_hash)
+        return self.hash_str(prefix + str(self.nonce) + suffix)
         
     def get_block_filename(self, block_dir):
         return '{}/block-{}.json'.format(block_dir, self.timestamp)
@@ -0,0 +1,255 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from bytecode import Bytecode, PackedBytecode
+from bytecode_parser import BytecodeParser
+from instruction import Value, ValueType
+from vm import VM, CompiledBytecode, MAX_STACK_SIZE, DEFAULT_GAS_LIMIT
+
+# compiled contracts kept per process, keyed by bytecode hash
+COMPILED_CACHE_SIZE = 256
+
+# blocks with fewer transactions than this run in-process; shipping them to workers costs more than running them
+MIN_PARALLEL_TXS = 64
+
+# the outcome of one transaction's contract: the VM's final stack, or the error that stopped it,
+# and the gas it consumed either way
+class ExecutionResult:
+    def __init__(self, tx_hash, stack=None, error=None, gas_used=0):
+        self.tx_hash = tx_hash
+        self.stack = stack
+        self.error = error
+        self.gas_used = gas_used
+
+    @property
+    def ok(self):
+        return self.error is None
+
+# the state a transaction's contract reads or writes. transactions may declare it as a list of
+# 'state_keys' in their data; otherwise all transactions of the same contract are assumed to conflict.
+def get_state_keys(tx):
+    keys = tx.data.get('state_keys')
+
+    if isinstance(keys, list) and all(isinstance(key, str) for key in keys):
+        return keys
+
+    return [str(tx.contract_identifier)]
+
+# python type of a contract arg -> the ValueType it is pushed as. Value.create would make ints PTRs,
+# which math opcodes don't take.
+ARG_TYPES = {
+    bool: ValueType.BOOL,
+    int: ValueType.INT,
+    float: ValueType.FLOAT,
+    str: ValueType.STRING,
+    list: ValueType.ARRAY,
+    dict: ValueType.DICT
+}
+
+# the values a transaction hands its contract; they are pushed before the contract runs
+def get_contract_args(tx):
+    args = tx.data.get('args', [])
+
+    assert isinstance(args, list), "args should be list"
+    assert len(args) <= MAX_STACK_SIZE, "too many args ({})".format(len(args))
+
+    for arg in args:
+        assert type(arg) in ARG_TYPES, "unsupported arg type {}".format(type(arg).__name__)
+
+    return args
+
+# the gas a transaction's contract may use: data['gas_limit'] if set, at most DEFAULT_GAS_LIMIT
+def get_gas_limit(tx):
+    gas_limit = tx.data.get('gas_limit', DEFAULT_GAS_LIMIT)
+
+    assert isinstance(gas_limit, int) and not isinstance(gas_limit, bool) and gas_limit >= 0, "gas_limit should be a non-negative int"
+
+    return min(gas_limit, DEFAULT_GAS_LIMIT)
+
+# groups the indices of transactions by shared state keys. transactions in different groups are independent;
+# within a group they keep block order.
+def group_independent(txs):
+    # union-find over transaction indices, joined through the keys they share
+    parents = list(range(0, len(txs)))
+    key_owners = {}
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+
+        return index
+
+    for index, tx in enumerate(txs):
+        for key in get_state_keys(tx):
+            if key in key_owners:
+                parents[find(index)] = find(key_owners[key])
+            else:
+                key_owners[key] = index
+
+    groups = OrderedDict()
+
+    for index in range(0, len(txs)):
+        groups.setdefault(find(index), []).append(index)
+
+    return list(groups.values())
+
+# per-process state of the execution workers (and of in-process execution)
+_compiled_cache = OrderedDict()
+_compiled_cache_lock = threading.Lock()
+# the VM each thread reuses
+_local = threading.local()
+
+def _get_compiled(bytecode_hash, packed_data):
+    with _compiled_cache_lock:
+        compiled = _compiled_cache.get(bytecode_hash)
+
+        if compiled is not None:
+            _compiled_cache.move_to_end(bytecode_hash)
+            return compiled
+
+    bytecode = PackedBytecode(packed_data)
+    compiled = CompiledBytecode(bytecode, BytecodeParser.verify(bytecode))
+
+    with _compiled_cache_lock:
+        _compiled_cache[bytecode_hash] = compiled
+
+        if len(_compiled_cache) > COMPILED_CACHE_SIZE:
+            _compiled_cache.popitem(last=False)
+
+    return compiled
+
+# runs (index, bytecode hash, args, gas limit) items in order on this process's VM.
+# code maps bytecode hash -> packed bytecode. returns (index, stack, error, gas used) for each item.
+def execute_items(code, items):
+    vm = getattr(_local, 'vm', None)
+
+    if vm is None:
+        vm = VM(Bytecode([]))
+        _local.vm = vm
+
+    results = []
+
+    for index, bytecode_hash, args, gas_limit in items:
+        try:
+            vm.load(_get_compiled(bytecode_hash, code[bytecode_hash]))
+            vm.gas_limit = gas_limit
+
+            for arg in args:
+                vm.stack.append(Value(ARG_TYPES[type(arg)], arg))
+
+            vm.evaluate()
+
+            results.append((index, list(vm.stack), None, vm.gas_used))
+        except Exception as e:
+            results.append((index, None, str(e) or type(e).__name__, vm.gas_used))
+
+    return results
+
+# runs the contracts of every transaction in a TransactionSet.
+# independent transactions (see group_independent) are spread over a process pool; each worker
+# reuses one VM and keeps compiled bytecode cached by hash across blocks.
+class BlockExecutor:
+    # contracts maps contract identifier (as a string) -> Contract
+    def __init__(self, contracts, workers=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        self.contracts = contracts
+        self.workers = workers
+        self._executor = None
+        # contract identifier -> (contract, bytecode hash, packed bytecode) of contracts seen so far
+        self._packed = {}
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def _get_packed(self, identifier, contract):
+        entry = self._packed.get(identifier)
+
+        if entry is None or entry[0] is not contract:
+            bytecode = contract.bytecode
+
+            if not isinstance(bytecode, PackedBytecode):
+                bytecode = PackedBytecode.pack(bytecode)
+
+            entry = (contract, bytecode.calc_hash(), bytes(bytecode.data))
+            self._packed[identifier] = entry
+
+        return entry[1], entry[2]
+
+    # returns an ExecutionResult per transaction of tx_set, in block order
+    def execute(self, tx_set):
+        return self.execute_transactions(tx_set.transactions)
+
+    def execute_transactions(self, txs):
+        results = [ExecutionResult(tx.calc_hash()) for tx in txs]
+
+        # bytecode hash -> packed bytecode, for what this block uses
+        code = {}
+        # index -> (index, bytecode hash, args, gas limit)
+        items = {}
+
+        for index, tx in enumerate(txs):
+            identifier = str(tx.contract_identifier)
+            contract = self.contracts.get(identifier)
+
+            if contract is None:
+                results[index].error = "no contract {}".format(tx.contract_identifier)
+                continue
+
+            try:
+                args = get_contract_args(tx)
+                gas_limit = get_gas_limit(tx)
+            except AssertionError as e:
+                results[index].error = str(e)
+                continue
+
+            bytecode_hash, packed_data = self._get_packed(identifier, contract)
+            code[bytecode_hash] = packed_data
+            items[index] = (index, bytecode_hash, args, gas_limit)
+
+        if self.workers <= 1 or len(items) < MIN_PARALLEL_TXS:
+            outcomes = execute_items(code, [items[index] for index in sorted(items)])
+        else:
+            outcomes = []
+
+            for future in [self._get_executor().submit(execute_items, code, chunk) for chunk in self._split(txs, items)]:
+                outcomes.extend(future.result())
+
+        for index, stack, error, gas_used in outcomes:
+            results[index].stack = stack
+            results[index].error = error
+            results[index].gas_used = gas_used
+
+        return results
+
+    # the items as up to one chunk per worker, each a set of whole independent groups in block order,
+    # balanced by putting the largest groups on the least loaded chunk first
+    def _split(self, txs, items):
+        groups = [[items[index] for index in group if index in items] for group in group_independent(txs)]
+        chunks = [[] for i in range(0, min(self.workers, len(groups)))]
+
+        for group in sorted(groups, key=len, reverse=True):
+            min(chunks, key=len).extend(group)
+
+        for chunk in chunks:
+            chunk.sort(key=lambda item: item[0])
+
+        return [chunk for chunk in chunks if len(chunk) != 0]
@@ -2,17 +2,38 @@ import json
 
 from utility_classes import Hashable, Serializable
 
+# the easiest possible target: any hash is accepted
+MAX_TARGET = 2 ** 256 - 1
+
+# blocks from before targets were carried in the header were mined against a
+# '00000' hex prefix, i.e. hash < 16 ** 59
+LEGACY_TARGET = 16 ** 59
+
 class BlockHeader(Hashable, Serializable):
-    def __init__(self, version):
+    def __init__(self, version, target=None):
         self.version = version
+        # a block hash, read as a 256-bit integer, must be below the target
+        self.target = target
         #self.block_index = block_index
 
+    def get_target(self):
+        if self.target is None:
+            return LEGACY_TARGET
+
+        return self.target
+
     def serialize(self):
-        return {
+        obj = {
             'version': str(self.version)
             #'block_index': self.block_index
         }
 
+        # omitted for legacy headers so their hashes stay the same
+        if self.target is not None:
+            obj['target'] = '{:x}'.format(self.target)
+
+        return obj
+
     @classmethod
     def deserialize(kls, obj):
         assert isinstance(obj, dict), 'block_header should be dict'
@@ -23,8 +44,42 @@ class BlockHeader(Hashable, Serializable):
         #assert 'block_index' in obj, 'block_index should be in block_header'
         #assert isinstance(obj['block_index'], int), 'block_index should be int'
 
+        target = None
+
+        if 'target' in obj:
+            assert isinstance(obj['target'], str), 'target should be hex str'
+
+            try:
+                target = int(obj['target'], 16)
+            except ValueError:
+                raise AssertionError('target should be hex str')
+
+            assert 0 < target <= MAX_TARGET, 'target out of range'
+
         # TODO parse version string...
-        return BlockHeader(obj['version'])
+        return BlockHeader(obj['version'], target=target)
+
+    def serialize_binary(self, writer):
+        writer.write_str(str(self.version))
+
+        # an empty target marks a legacy header
+        if self.target is None:
+            writer.write_bytes(b'')
+        else:
+            writer.write_bytes(self.target.to_bytes((self.target.bit_length() + 7) // 8, 'big'))
+
+    @classmethod
+    def deserialize_binary(kls, reader):
+        version = reader.read_str()
+        target_bytes = reader.read_bytes()
+
+        target = None
+
+        if len(target_bytes) != 0:
+            target = int.from_bytes(target_bytes, 'big')
+            assert 0 < target <= MAX_TARGET, 'target out of range'
+
+        return BlockHeader(version, target=target)
 
     def calc_hash(self):
         return self.hash_str(json.dumps(self.serialize()))
\ No newline at end of file
@@ -0,0 +1,100 @@
+import os
+import struct
+
+from block_store import BlockLocation
+
+# fixed-size index records: height, raw block hash, segment, offset, length, raw merkle root of the block's transactions.
+# the merkle root lets headers be served without decoding transactions (see ChainHeader.from_record).
+INDEX_RECORD = struct.Struct('>I32sIQI32s')
+
+# the merkle root of an empty transaction set is '', stored as zeros
+EMPTY_TX_ROOT = bytes(32)
+
+def pack_tx_root(tx_root):
+    if tx_root == '':
+        return EMPTY_TX_ROOT
+
+    return bytes.fromhex(tx_root)
+
+def unpack_tx_root(raw_tx_root):
+    if raw_tx_root == EMPTY_TX_ROOT:
+        return ''
+
+    return raw_tx_root.hex()
+
+# persistent block index mapping block hash -> (height, location, tx root) and height -> block hash.
+# the file is append-only; it is read into memory once so lookups are O(1).
+class BlockIndex:
+    def __init__(self, index_path):
+        self.index_path = index_path
+
+        self._by_hash = {}
+        # block hashes ordered by height; the genesis block (height 0) is not stored
+        self._hashes = []
+
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+
+        with open(self.index_path, 'rb') as infile:
+            data = infile.read()
+
+        # a partially written trailing record is cut off, so the next add() starts on a record boundary
+        usable_size = len(data) - (len(data) % INDEX_RECORD.size)
+
+        if usable_size != len(data):
+            print("Truncated record at the end of {}; removing the {} trailing bytes.".format(self.index_path, len(data) - usable_size))
+
+            with open(self.index_path, 'r+b') as outfile:
+                outfile.truncate(usable_size)
+
+        for offset in range(0, usable_size, INDEX_RECORD.size):
+            height, raw_hash, segment, block_offset, length, raw_tx_root = INDEX_RECORD.unpack_from(data, offset)
+
+            assert height == len(self._hashes) + 1, "block index is out of order at height {}; delete {} to rebuild it".format(height, self.index_path)
+
+            self._add(height, raw_hash.hex(), BlockLocation(segment, block_offset, length), unpack_tx_root(raw_tx_root))
+
+    def _add(self, height, block_hash, location, tx_root):
+        self._by_hash[block_hash] = (height, location, tx_root)
+        self._hashes.append(block_hash)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, block_hash):
+        return block_hash in self._by_hash
+
+    def add(self, height, block_hash, location, tx_root):
+        assert height == len(self._hashes) + 1, "blocks must be indexed in order (expected height {}, got {})".format(len(self._hashes) + 1, height)
+
+        with open(self.index_path, 'ab') as outfile:
+            outfile.write(INDEX_RECORD.pack(height, bytes.fromhex(block_hash), location.segment, location.offset, location.length, pack_tx_root(tx_root)))
+
+        self._add(height, block_hash, location, tx_root)
+
+    def get_height(self, block_hash):
+        if block_hash not in self._by_hash:
+            return None
+
+        return self._by_hash[block_hash][0]
+
+    def get_location(self, block_hash):
+        if block_hash not in self._by_hash:
+            return None
+
+        return self._by_hash[block_hash][1]
+
+    def get_tx_root(self, block_hash):
+        if block_hash not in self._by_hash:
+            return None
+
+        return self._by_hash[block_hash][2]
+
+    def get_hash(self, height):
+        if height < 1 or height > len(self._hashes):
+            return None
+
+        return self._hashes[height - 1]
\ No newline at end of file
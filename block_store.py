@@ -0,0 +1,187 @@
+import os
+import re
+import mmap
+import struct
+from collections import namedtuple
+
+from block import Block
+
+# segments are rolled over once they grow past this size
+MAX_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# every record in a segment is a 4-byte big-endian payload length followed by the binary-encoded block
+RECORD_HEADER = struct.Struct('>I')
+
+# offset is the start of the record (its length header) within the segment file
+BlockLocation = namedtuple('BlockLocation', ['segment', 'offset', 'length'])
+
+# append-only storage of binary-encoded blocks in numbered segment files
+class BlockStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+
+        self.segments = []
+
+        for f in os.listdir(store_dir):
+            m = re.search('^segment-(\d+).dat$', f)
+
+            if m is not None:
+                self.segments.append(int(m.group(1)))
+
+        self.segments.sort()
+
+        # size of the last segment, tracked here so appends don't need to stat the file
+        self._segment_size = 0
+
+        if len(self.segments) != 0:
+            self._segment_size = self._recover_segment(self.segments[-1])
+
+        # read-only memory maps of segment files, keyed by segment number
+        self._maps = {}
+
+    # cuts a record left half-written (e.g. by a crash) off the end of a segment, so appends start
+    # right after the last whole record. returns the segment's size.
+    def _recover_segment(self, segment):
+        segment_path = self.get_segment_path(segment)
+
+        with open(segment_path, 'r+b') as segment_file:
+            segment_size = os.fstat(segment_file.fileno()).st_size
+            offset = 0
+
+            while offset + RECORD_HEADER.size <= segment_size:
+                segment_file.seek(offset)
+                length, = RECORD_HEADER.unpack(segment_file.read(RECORD_HEADER.size))
+
+                if offset + RECORD_HEADER.size + length > segment_size:
+                    break
+
+                offset += RECORD_HEADER.size + length
+
+            if offset != segment_size:
+                print("Truncated block record in {} at offset {}; removing the {} trailing bytes.".format(segment_path, offset, segment_size - offset))
+                segment_file.truncate(offset)
+
+        return offset
+
+    def get_segment_path(self, segment):
+        return '{}/segment-{:06d}.dat'.format(self.store_dir, segment)
+
+    def append(self, block):
+        data = block.to_bytes()
+
+        if len(self.segments) == 0:
+            self.segments.append(0)
+
+        if self._segment_size > 0 and self._segment_size + RECORD_HEADER.size + len(data) > MAX_SEGMENT_SIZE:
+            self.segments.append(self.segments[-1] + 1)
+            self._segment_size = 0
+
+        segment = self.segments[-1]
+
+        with open(self.get_segment_path(segment), 'ab') as outfile:
+            offset = outfile.tell()
+            outfile.write(RECORD_HEADER.pack(len(data)) + data)
+
+        self._segment_size = offset + RECORD_HEADER.size + len(data)
+
+        return BlockLocation(segment, offset, len(data))
+
+    # returns a zero-copy view of bytes [start, end) of a segment.
+    # the tail segment keeps growing, so its map is recreated when a read goes past the mapped size.
+    def get_segment_view(self, segment, start, end):
+        segment_map = self._maps.get(segment)
+
+        if segment_map is None or len(segment_map) < end:
+            with open(self.get_segment_path(segment), 'rb') as infile:
+                segment_map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+            # an old map is closed once no views into it remain
+            self._maps[segment] = segment_map
+
+        assert end <= len(segment_map), "read past the end of segment {} ({} > {})".format(segment, end, len(segment_map))
+
+        return memoryview(segment_map)[start:end]
+
+    def read_raw(self, location):
+        start = location.offset + RECORD_HEADER.size
+
+        return self.get_segment_view(location.segment, start, start + location.length)
+
+    def read_block(self, location):
+        return Block.from_bytes(self.read_raw(location))
+
+    # the stored records (length header and payload) for a run of locations, as
+    # (segment, start, end) byte ranges. consecutive records in a segment are contiguous,
+    # so a page of blocks usually maps to a single range.
+    def get_record_ranges(self, locations):
+        ranges = []
+
+        for location in locations:
+            end = location.offset + RECORD_HEADER.size + location.length
+
+            if len(ranges) != 0 and ranges[-1][0] == location.segment and ranges[-1][2] == location.offset:
+                ranges[-1] = (location.segment, ranges[-1][1], end)
+            else:
+                ranges.append((location.segment, location.offset, end))
+
+        return ranges
+
+    # walk the record headers of every segment in order, optionally starting after a known location
+    def iter_locations(self, after=None):
+        for segment in self.segments:
+            if after is not None and segment < after.segment:
+                continue
+
+            segment_path = self.get_segment_path(segment)
+
+            if not os.path.exists(segment_path):
+                continue
+
+            segment_size = os.path.getsize(segment_path)
+
+            if segment_size == 0:
+                continue
+
+            view = self.get_segment_view(segment, 0, segment_size)
+            offset = 0
+
+            if after is not None and segment == after.segment:
+                offset = after.offset + RECORD_HEADER.size + after.length
+
+            while offset + RECORD_HEADER.size <= segment_size:
+                length, = RECORD_HEADER.unpack_from(view, offset)
+
+                if offset + RECORD_HEADER.size + length > segment_size:
+                    print("Truncated block record in {} at offset {}; ignoring the rest of the segment.".format(segment_path, offset))
+                    break
+
+                yield BlockLocation(segment, offset, length)
+
+                offset += RECORD_HEADER.size + length
+
+            view.release()
+
+    # splits a buffer of back-to-back records (as served by get_record_ranges) into block payloads
+    @classmethod
+    def split_records(kls, data):
+        data = memoryview(data)
+        offset = 0
+
+        while offset < len(data):
+            assert offset + RECORD_HEADER.size <= len(data), "truncated record header"
+
+            length, = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+
+            assert offset + length <= len(data), "truncated record"
+
+            yield data[offset:offset + length]
+
+            offset += length
+
+    def iter_blocks(self):
+        for location in self.iter_locations():
+            yield self.read_block(location)
\ No newline at end of file
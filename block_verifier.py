@@ -0,0 +1,117 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# how many blocks may be in flight in the worker pool at once
+VERIFY_WINDOW_PER_WORKER = 32
+
+# marks the end of the block stream, which may itself hold None for a block that failed to load
+_EXHAUSTED = object()
+
+# the self-contained, CPU-heavy part of verifying a block: precondition checks and hash recomputation.
+# runs in a worker process and returns a list of errors.
+def check_block(block):
+    errors = block.check_preconditions()
+
+    if len(errors) == 0:
+        recalculated_hash = block.calc_hash()
+
+        if recalculated_hash != block.block_hash:
+            errors.append("Block hash {} does not match the recalculated hash {}".format(block.block_hash, recalculated_hash))
+        elif not block.meets_target():
+            errors.append("Block hash {} does not meet the block's target".format(block.block_hash))
+
+    return errors
+
+# verifies a stream of blocks using all cores.
+# check_block fans out to a process pool while linkage (prev hash, timestamp) is checked in order,
+# and blocks are handed back in their original order once both have passed.
+class BlockVerifier:
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        self.workers = workers
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def _check_linkage(self, block, prev_block):
+        assert block.block_hash is not None, "block_hash should not be None for a pre-calculated block"
+        assert block.prev_block_hash == prev_block.block_hash, "block {} prev_block_hash ({}) does not match the previous block ({})".format(block.block_hash, block.prev_block_hash, prev_block.block_hash)
+        assert block.timestamp > prev_block.timestamp, "block {} timestamp should be greater than previous block timestamp".format(block.block_hash)
+
+    # yields each block of `blocks` after it has been verified to follow prev_block.
+    # raises AssertionError at the first block that fails, or that is None (failed to load).
+    def verify(self, blocks, prev_block):
+        if self.workers <= 1:
+            for block in blocks:
+                assert block is not None, "block after {} failed to load".format(prev_block.block_hash)
+
+                self._check_linkage(block, prev_block)
+
+                errors = check_block(block)
+                assert len(errors) == 0, "block {} failed verification: {}".format(block.block_hash, errors)
+
+                prev_block = block
+                yield block
+
+            return
+
+        executor = self._get_executor()
+        window = self.workers * VERIFY_WINDOW_PER_WORKER
+        pending = deque()
+        blocks = iter(blocks)
+        exhausted = False
+
+        try:
+            while True:
+                while not exhausted and len(pending) < window:
+                    block = next(blocks, _EXHAUSTED)
+
+                    if block is _EXHAUSTED:
+                        exhausted = True
+                        break
+
+                    if block is None:
+                        # stop reading; raised once the blocks before it have been verified and yielded
+                        exhausted = True
+                        pending.append((None, None))
+                        break
+
+                    pending.append((block, executor.submit(check_block, block)))
+
+                if len(pending) == 0:
+                    return
+
+                block, future = pending.popleft()
+
+                assert block is not None, "block after {} failed to load".format(prev_block.block_hash)
+
+                self._check_linkage(block, prev_block)
+
+                errors = future.result()
+                assert len(errors) == 0, "block {} failed verification: {}".format(block.block_hash, errors)
+
+                prev_block = block
+                yield block
+        finally:
+            # drop work queued behind a failed (or abandoned) block
+            for block, future in pending:
+                if future is not None:
+                    future.cancel()
@@ -1,12 +1,31 @@
 import os
 import re
 import json
+import threading
 from enum import Enum
 
 from object_identifier import ObjectIdentifier
 from block import Block
+from block_store import BlockStore
+from block_index import BlockIndex
+from block_verifier import BlockVerifier
+from chain_snapshot import ChainSnapshot
+from chain_header import ChainHeader
+from block_header import MAX_TARGET
 from utility_classes import Identifiable
 
+# defaults for chains whose metadata does not configure difficulty retargeting
+DEFAULT_TARGET_BLOCK_TIME = 60 # seconds
+DEFAULT_RETARGET_INTERVAL = 10 # blocks
+
+# bounds how far a single retarget can move the target
+MAX_RETARGET_FACTOR = 4
+
+# a snapshot of the chain state is written every this many blocks
+SNAPSHOT_INTERVAL = 1000
+
+BLOCK_FILE_PATTERN = re.compile('^block-(\d+).json$')
+
 class BlockchainSyncState(Enum):
     UNSYNCED = 0
     SYNCED = 1
@@ -18,10 +37,34 @@ class Blockchain(Identifiable):
         self.genesis_block = genesis_block
         self.last_block = last_block
         self.metadata = metadata
+        # set while sync_state is SYNCED, so waiters don't have to poll
+        self._synced = threading.Event()
         self.sync_state = BlockchainSyncState.UNSYNCED
 
+        # height of last_block; the genesis block is height 0
+        self.height = 0
+        # the target the next block's header must carry
+        self.target = genesis_block.block_header.get_target()
+        # timestamp of the block the current retarget window started at
+        self.retarget_timestamp = genesis_block.timestamp
+
         block_dir = self.get_block_dir()
 
+        # sorted manifest of block-X.json paths, built on first use.
+        # when watch_block_files is set it is rebuilt if the directory's mtime changes.
+        self.watch_block_files = True
+        self._block_files = None
+        self._block_files_mtime = None
+
+        self.block_store = BlockStore(self.get_segment_dir())
+        self.block_index = BlockIndex(self.get_index_path())
+
+        # height of the latest snapshot written or loaded
+        self.snapshot_height = 0
+
+        # called with each block added, see add_block_listener
+        self.block_listeners = []
+
         #if not os.path.exists(genesis_block.get_block_filename(block_dir)):
             #print("try save genesis block: {}".format(genesis_block.get_block_filename(block_dir)))
         #    genesis_block.save(block_dir)
@@ -40,37 +83,47 @@ class Blockchain(Identifiable):
     def get_identifier(self):
         return ObjectIdentifier.parse(self.metadata.get_attr('identifier'))
 
-    def page_block_files(self, start=0, pagesize=10):
-        block_file_paths = []
+    @property
+    def sync_state(self):
+        return self._sync_state
 
+    @sync_state.setter
+    def sync_state(self, state):
+        self._sync_state = state
+
+        if state == BlockchainSyncState.SYNCED:
+            self._synced.set()
+        else:
+            self._synced.clear()
+
+    # blocks until sync_state is SYNCED; returns False if timeout passed first
+    def wait_until_synced(self, timeout=None):
+        return self._synced.wait(timeout)
+
+    def get_block_files(self):
         # attempt to load blocks from the 'chains/<identifier>/blocks' folder
-        identifier_str = str(self.get_identifier())
-        block_dir = './chain-store/{}/blocks'.format(identifier_str)
+        block_dir = self.get_block_dir()
+
+        if self._block_files is not None and self.watch_block_files:
+            if os.stat(block_dir).st_mtime_ns != self._block_files_mtime:
+                self._block_files = None
 
-        subdirs = block_dir.split('/')
+        if self._block_files is None:
+            self._block_files_mtime = os.stat(block_dir).st_mtime_ns
 
-        for i in range(1, len(subdirs)):
-            dirpath = '/'.join(subdirs[0:i+1])
-            
-            if not os.path.exists(dirpath):
-                os.makedirs(block_dir)
-                break
+            block_files = []
 
-        # walk files in the directory to pick up any block-X.json files
-        for f in os.listdir(block_dir):
-            m = re.search('^block-(\d+).json$', f)
-                    
-            if m is not None:
-                # load json file
-                block_file_paths.append('{}/{}'.format(block_dir, f))
+            # walk files in the directory to pick up any block-X.json files
+            for f in os.listdir(block_dir):
+                m = BLOCK_FILE_PATTERN.search(f)
 
-        if len(block_file_paths) == 0:
-            return
+                if m is not None:
+                    block_files.append((int(m.group(1)), '{}/{}'.format(block_dir, f)))
 
-        assert start < len(block_file_paths), "invalid start index ({} >= {})".format(start, len(block_file_paths))
+            # order by the timestamp in the filename, not by directory order
+            self._block_files = [block_file_path for timestamp, block_file_path in sorted(block_files)]
 
-        for i in range(start, len(block_file_paths), pagesize):
-            yield block_file_paths[i:i+pagesize]
+        return self._block_files
 
     def load_block_file(self, block_file_path):
         with open(block_file_path) as json_data:
@@ -81,18 +134,128 @@ class Blockchain(Identifiable):
             except Exception as e:
                 print("Failed to load block file {}; this may indicate corruption. You may try deleting the directory and rebuilding the database. The error was:\n\t{}".format(block_file_path, e))
 
-    def load_blocks(self):
-       for page in self.page_block_files():
-           for block_file_path in page:
-                block = self.load_block_file(block_file_path)
+    # replays (and verifies) the stored chain, starting from the latest snapshot if there is one.
+    # a verifier can be passed in to reuse its worker pool.
+    def load_blocks(self, verifier=None):
+        owns_verifier = verifier is None
+
+        if owns_verifier:
+            verifier = BlockVerifier()
+
+        try:
+            if self.last_block is None:
+                self.last_block = self.genesis_block
+
+            self.load_snapshot()
 
-                assert block.block_hash != self.genesis_block.block_hash, "genesis block file found ({}): this should not happen".format(block_file_path)
+            # indexed blocks after the chain tip, then any records the index is missing (e.g. after a crash)
+            locations = []
 
-                if self.last_block.timestamp >= block.timestamp:
-                    break
+            for height in range(self.height + 1, len(self.block_index) + 1):
+                locations.append(self.block_index.get_location(self.block_index.get_hash(height)))
 
+            last_indexed_location = None
+
+            if len(self.block_index) != 0:
+                last_indexed_location = self.block_index.get_location(self.block_index.get_hash(len(self.block_index)))
+
+            locations += list(self.block_store.iter_locations(after=last_indexed_location))
+
+            verified_blocks = verifier.verify(map(self.block_store.read_block, locations), self.last_block)
+
+            for location, block in zip(locations, verified_blocks):
                 self.add_block(block)
 
+                # catch the index up if it fell behind the store
+                if block.block_hash not in self.block_index:
+                    self.block_index.add(self.height, block.block_hash, location, block.tx_set.calc_hash())
+
+            self.import_block_files(verifier)
+        finally:
+            if owns_verifier:
+                verifier.shutdown()
+
+    # moves blocks from legacy block-X.json files into the block store.
+    # the json files are left in place and skipped once imported.
+    def import_block_files(self, verifier):
+        block_file_paths = []
+
+        for block_file_path in self.get_block_files():
+            # the filename carries the timestamp, so already-imported files are skipped without parsing them
+            timestamp = int(BLOCK_FILE_PATTERN.search(os.path.basename(block_file_path)).group(1))
+
+            if self.last_block.timestamp < timestamp:
+                block_file_paths.append(block_file_path)
+
+        for block in verifier.verify(map(self.load_block_file, block_file_paths), self.last_block):
+            assert block.block_hash != self.genesis_block.block_hash, "genesis block file found: this should not happen"
+
+            self.add_block(block, save=True)
+
+    # yields pages of stored blocks, starting at the given block index (block index i is height i + 1)
+    def page_blocks(self, start=0, pagesize=10):
+        for i in range(start, len(self.block_index), pagesize):
+            yield [self.get_block_by_height(height) for height in range(i + 1, min(i + pagesize, len(self.block_index)) + 1)]
+
+    def get_block_by_hash(self, block_hash):
+        if block_hash == self.genesis_block.block_hash:
+            return self.genesis_block
+
+        location = self.block_index.get_location(block_hash)
+
+        if location is None:
+            return None
+
+        return self.block_store.read_block(location)
+
+    def get_block_by_height(self, height):
+        if height == 0:
+            return self.genesis_block
+
+        block_hash = self.block_index.get_hash(height)
+
+        if block_hash is None:
+            return None
+
+        return self.block_store.read_block(self.block_index.get_location(block_hash))
+
+    # byte ranges of the stored records for up to count blocks starting at start_height, for serving without decoding
+    def get_record_ranges(self, start_height, count):
+        locations = []
+
+        for height in range(start_height, min(start_height + count, len(self.block_index) + 1)):
+            locations.append(self.block_index.get_location(self.block_index.get_hash(height)))
+
+        return self.block_store.get_record_ranges(locations)
+
+    # ChainHeaders of up to count blocks starting at start_height, for headers-first sync
+    def get_headers(self, start_height, count):
+        headers = []
+
+        for height in range(start_height, min(start_height + count, len(self.block_index) + 1)):
+            block_hash = self.block_index.get_hash(height)
+            location = self.block_index.get_location(block_hash)
+
+            # the transactions aren't decoded; their merkle root is kept in the index
+            headers.append(ChainHeader.from_record(self.block_store.read_raw(location), self.block_index.get_tx_root(block_hash)))
+
+        return headers
+
+    # height of the block with the given hash, or None if it is not part of this chain
+    def get_block_height(self, block_hash):
+        if block_hash == self.genesis_block.block_hash:
+            return 0
+
+        return self.block_index.get_height(block_hash)
+
+    # writes every stored block out as a block-X.json file
+    def export_blocks(self, export_dir):
+        if not os.path.exists(export_dir):
+            os.makedirs(export_dir)
+
+        for block in self.block_store.iter_blocks():
+            block.save(export_dir)
+
     # load a contract via global identifier
     def load_contract(self, contract_identifier):
         pass
@@ -106,27 +269,109 @@ class Blockchain(Identifiable):
 
         assert block.prev_block_hash == self.last_block.block_hash, 'previous block hash does not match'
         assert block.timestamp > self.last_block.timestamp, 'block timestamp should be greater than previous block timestamp'
+        assert block.block_header.get_target() == self.target, 'block target does not match the expected target ({:x} != {:x})'.format(block.block_header.get_target(), self.target)
 
         #block.block_header.block_index = self.last_block.block_header.block_index + 1
 
         self.last_block = block
+        self.height += 1
+
+        if self.height % self.get_retarget_interval() == 0:
+            self.retarget(block.timestamp)
+
+        self.on_block_added(block)
+
+        for listener in self.block_listeners:
+            listener(block)
 
         if save:
             self.save_block(block)
 
+        # only snapshot blocks that are persisted, so startup can resume from the store after them
+        if self.height % SNAPSHOT_INTERVAL == 0 and self.height > self.snapshot_height and block.block_hash in self.block_index:
+            self.save_snapshot()
+
+    # hook for derived classes to update state derived from the chain
+    def on_block_added(self, block):
+        pass
+
+    # registers listener(block) to be called with every block added to the chain, once it is the tip
+    def add_block_listener(self, listener):
+        self.block_listeners.append(listener)
+
+    # derived state to include in snapshots; must be json-serializable
+    def get_snapshot_state(self):
+        return {}
+
+    def restore_snapshot_state(self, state):
+        pass
+
+    def get_snapshot_path(self):
+        return './chain-store/{}/snapshot.json'.format(str(self.get_identifier()))
+
+    def save_snapshot(self):
+        snapshot = ChainSnapshot(height=self.height, last_block=self.last_block, target=self.target, retarget_timestamp=self.retarget_timestamp, state=self.get_snapshot_state())
+        snapshot.save(self.get_snapshot_path())
+
+        self.snapshot_height = self.height
+
+    # restores the chain state from the latest snapshot if it matches the stored chain.
+    # returns True if a snapshot was loaded.
+    def load_snapshot(self):
+        snapshot = ChainSnapshot.load(self.get_snapshot_path())
+
+        if snapshot is None or snapshot.height <= self.height:
+            return False
+
+        if self.block_index.get_hash(snapshot.height) != snapshot.last_block.block_hash:
+            print("Snapshot at height {} does not match the stored chain; ignoring it.".format(snapshot.height))
+            return False
+
+        self.last_block = snapshot.last_block
+        self.height = snapshot.height
+        self.target = snapshot.target
+        self.retarget_timestamp = snapshot.retarget_timestamp
+        self.restore_snapshot_state(snapshot.state)
+        self.snapshot_height = snapshot.height
+
+        return True
+
+    def get_target_block_time(self):
+        return self.metadata.get_attr('target-block-time', DEFAULT_TARGET_BLOCK_TIME)
+
+    def get_retarget_interval(self):
+        return self.metadata.get_attr('retarget-interval', DEFAULT_RETARGET_INTERVAL)
+
+    # scale the target by how long the last retarget window actually took
+    # compared to how long it should have taken.
+    def retarget(self, timestamp):
+        expected_time = self.get_retarget_interval() * self.get_target_block_time()
+        actual_time = timestamp - self.retarget_timestamp
+
+        actual_time = max(actual_time, expected_time // MAX_RETARGET_FACTOR, 1)
+        actual_time = min(actual_time, expected_time * MAX_RETARGET_FACTOR)
+
+        self.target = min(MAX_TARGET, self.target * actual_time // expected_time)
+        self.retarget_timestamp = timestamp
+
     def get_block_dir(self):
         identifier_str = str(self.get_identifier())
         block_dir = './chain-store/{}/blocks'.format(identifier_str)
-        subdirs = block_dir.split('/')
 
-        for i in range(1, len(subdirs)):
-            dirpath = '/'.join(subdirs[0:i+1])
-            
-            if not os.path.exists(dirpath):
-                os.makedirs(block_dir)
-                break
+        if not os.path.exists(block_dir):
+            os.makedirs(block_dir)
 
         return block_dir
 
+    def get_segment_dir(self):
+        return './chain-store/{}/segments'.format(str(self.get_identifier()))
+
+    # index records gained the merkle root in version 2. an older block-index.dat is not read;
+    # load_blocks indexes the stored blocks again instead.
+    def get_index_path(self):
+        return './chain-store/{}/block-index-2.dat'.format(str(self.get_identifier()))
+
+    # called by add_block once the block is the chain tip, so self.height is its height
     def save_block(self, block):
-        block.save(self.get_block_dir())
\ No newline at end of file
+        location = self.block_store.append(block)
+        self.block_index.add(self.height, block.block_hash, location, block.tx_set.calc_hash())
\ No newline at end of file
@@ -7,7 +7,10 @@ class BlockchainMetadata(Hashable, Serializable):
     def serialize(self):
         return self.data
 
-    def get_attr(self, attr):
+    def get_attr(self, attr, default=None):
+        if attr not in self.data and default is not None:
+            return default
+
         return self.data[attr]
 
     @classmethod
@@ -1,13 +1,214 @@
+import sys
+import json
+import struct
+import hashlib
+from array import array
+
 from utility_classes import Hashable
+from binary_codec import BinaryWriter, BinaryReader
+from instruction import *
+
+# packed bytecode layout:
+#   magic, version
+#   constant pool: varint count, then a ValueType byte and the typed data of each constant
+#   varint instruction count, varint argument count
+#   opcodes: a byte per instruction
+#   argument starts: u32 (little endian) per instruction, plus one for the end of the last instruction's arguments
+#   arguments: u32 (little endian) constant pool index per argument
+PACKED_BYTECODE_MAGIC = b'VXBC'
+PACKED_BYTECODE_VERSION = 1
+
+FLOAT_DATA = struct.Struct('<d')
+
+# array type code of the u32 sections
+INDEX_TYPECODE = 'I'
+
+assert array(INDEX_TYPECODE).itemsize == 4
+
+# opcode byte -> Opcode, or None for bytes that aren't one
+OPCODES_BY_VALUE = [None] * 256
+
+for opcode in Opcode:
+    OPCODES_BY_VALUE[opcode.value] = opcode
 
 class Bytecode(Hashable):
     def __init__(self, instructions):
         self.instructions = instructions
 
+    # the hash of the packed encoding, so a contract hashes the same however its bytecode is held
     def calc_hash(self):
-        hash_result = ''
-        
-        for instruction in self.instructions:
-            hash_result = self.hash_str(hash_result + instruction.calc_hash())
+        return PackedBytecode.pack(self).calc_hash()
+
+# bytecode in its packed binary form. the opcode and argument sections are used in place (no copy)
+# from the bytes or memoryview it was loaded from; only the constant pool is decoded.
+class PackedBytecode(Hashable):
+    def __init__(self, data):
+        self.data = memoryview(data)
+
+        reader = BinaryReader(self.data)
+
+        assert bytes(reader.read_raw(len(PACKED_BYTECODE_MAGIC))) == PACKED_BYTECODE_MAGIC, "not packed bytecode"
+
+        version = reader.read_raw(1)[0]
+
+        assert version == PACKED_BYTECODE_VERSION, "unsupported packed bytecode version {}".format(version)
+
+        self.constants = [PackedBytecode._read_value(reader) for i in range(0, reader.read_uint())]
+
+        instruction_count = reader.read_uint()
+        argument_count = reader.read_uint()
+
+        self.opcodes = reader.read_raw(instruction_count)
+        self.argument_starts = PackedBytecode._read_indices(reader, instruction_count + 1)
+        self.arguments = PackedBytecode._read_indices(reader, argument_count)
+
+        assert reader.at_end(), "trailing data after packed bytecode"
+        assert self.argument_starts[0] == 0 and self.argument_starts[-1] == argument_count, "packed bytecode arguments are out of range"
+
+        for index in self.arguments:
+            assert index < len(self.constants), "packed bytecode refers to missing constant {}".format(index)
+
+        self._instructions = None
+
+    @classmethod
+    def pack(kls, bytecode):
+        return kls(kls.encode(bytecode))
+
+    @classmethod
+    def encode(kls, bytecode):
+        writer = BinaryWriter()
+
+        # encoded constant -> its index in the pool; equal constants are stored once
+        pool = {}
+        opcodes = array('B')
+        argument_starts = array(INDEX_TYPECODE, [0])
+        arguments = array(INDEX_TYPECODE)
+
+        for ins in bytecode.instructions:
+            # a raw value would pack (and hash) the same as its Opcode, though it doesn't run the same
+            assert isinstance(ins.opcode, Opcode), "opcode {} can't be packed".format(ins.opcode)
+
+            opcodes.append(ins.opcode.value)
+
+            for arg in ins.arguments:
+                arg_writer = BinaryWriter()
+                kls._write_value(arg_writer, arg)
+
+                encoded = arg_writer.getvalue()
+
+                if encoded not in pool:
+                    pool[encoded] = len(pool)
+
+                arguments.append(pool[encoded])
+
+            argument_starts.append(len(arguments))
+
+        if sys.byteorder != 'little':
+            argument_starts.byteswap()
+            arguments.byteswap()
+
+        writer.buffer += PACKED_BYTECODE_MAGIC
+        writer.buffer.append(PACKED_BYTECODE_VERSION)
+
+        writer.write_uint(len(pool))
+
+        # dicts keep insertion order, which is index order
+        for encoded in pool:
+            writer.buffer += encoded
+
+        writer.write_uint(len(opcodes))
+        writer.write_uint(len(arguments))
+
+        writer.buffer += opcodes.tobytes()
+        writer.buffer += argument_starts.tobytes()
+        writer.buffer += arguments.tobytes()
+
+        return writer.getvalue()
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    # the Opcode of the instruction at index, or the raw byte if it isn't one
+    def get_opcode(self, index):
+        value = self.opcodes[index]
+        opcode = OPCODES_BY_VALUE[value]
+
+        if opcode is None:
+            return value
+
+        return opcode
+
+    def get_arguments(self, index):
+        return [self.constants[self.arguments[i]] for i in range(self.argument_starts[index], self.argument_starts[index + 1])]
+
+    # Instruction objects for code that walks bytecode.instructions (e.g. BytecodeParser); built on first use
+    @property
+    def instructions(self):
+        if self._instructions is None:
+            self._instructions = [Instruction(self.get_opcode(i), self.get_arguments(i)) for i in range(0, len(self))]
+
+        return self._instructions
+
+    def to_bytecode(self):
+        return Bytecode(list(self.instructions))
+
+    def calc_hash(self):
+        return hashlib.sha256(self.data).hexdigest()
+
+    # n u32 values, viewed in place where the byte order allows it
+    @classmethod
+    def _read_indices(kls, reader, count):
+        raw = reader.read_raw(count * 4)
+
+        if sys.byteorder == 'little':
+            return raw.cast(INDEX_TYPECODE)
+
+        indices = array(INDEX_TYPECODE, raw.tobytes())
+        indices.byteswap()
+
+        return indices
+
+    @classmethod
+    def _write_value(kls, writer, value):
+        value_type = value.value_type
+        data = value.data
+
+        writer.buffer.append(value_type.value)
+
+        if value_type == ValueType.PTR or value_type == ValueType.INT:
+            assert type(data) is int, "{} value holds {}, which can't be packed".format(value_type, type(data).__name__)
+
+            # zigzag, so small negative numbers stay small
+            writer.write_uint(data * 2 if data >= 0 else -data * 2 - 1)
+        elif value_type == ValueType.FLOAT:
+            assert type(data) is float, "{} value holds {}, which can't be packed".format(value_type, type(data).__name__)
+
+            writer.buffer += FLOAT_DATA.pack(data)
+        elif value_type == ValueType.STRING:
+            assert type(data) is str, "{} value holds {}, which can't be packed".format(value_type, type(data).__name__)
+
+            writer.write_str(data)
+        elif value_type == ValueType.BOOL:
+            assert type(data) is bool, "{} value holds {}, which can't be packed".format(value_type, type(data).__name__)
+
+            writer.buffer.append(1 if data else 0)
+        else:
+            # arrays, dicts and untyped values are stored as json
+            writer.write_str(json.dumps(data, separators=(',', ':'), sort_keys=True))
+
+    @classmethod
+    def _read_value(kls, reader):
+        value_type = ValueType(reader.read_raw(1)[0])
+
+        if value_type == ValueType.PTR or value_type == ValueType.INT:
+            data = reader.read_uint()
+
+            return Value(value_type, data >> 1 if data & 1 == 0 else -((data + 1) >> 1))
+        elif value_type == ValueType.FLOAT:
+            return Value(value_type, FLOAT_DATA.unpack(reader.read_raw(FLOAT_DATA.size))[0])
+        elif value_type == ValueType.STRING:
+            return Value(value_type, reader.read_str())
+        elif value_type == ValueType.BOOL:
+            return Value(value_type, reader.read_raw(1)[0] != 0)
 
-        return hash_result
\ No newline at end of file
+        return Value(value_type, json.loads(reader.read_str()))
@@ -1,13 +1,76 @@
-from bytecode import Bytecode
+import threading
+from collections import OrderedDict
+
+from bytecode import Bytecode, PackedBytecode
 from instruction import *
 
+# analyses of packed bytecode kept, keyed by the hash of its bytes
+ANALYSIS_CACHE_SIZE = 1024
+
+# the result of analyzing bytecode: its errors, and the stack it needs to run without underflowing or overflowing
+class BytecodeAnalysis:
+    def __init__(self, errors, stack_needed, stack_peak):
+        self.errors = errors
+        # values that must already be on the stack when the bytecode starts
+        self.stack_needed = stack_needed
+        # the most values the bytecode has pushed beyond its starting stack at any point
+        self.stack_peak = stack_peak
+
+    # True if the bytecode is valid and, started with initial_depth values on the stack, stays within max_stack_size
+    def is_stack_safe(self, initial_depth, max_stack_size):
+        return len(self.errors) == 0 and initial_depth >= self.stack_needed and initial_depth + self.stack_peak <= max_stack_size
+
 class BytecodeParser:
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
     @classmethod
     def analyze(kls, bytecode):
+        return list(kls.verify(bytecode).errors)
+
+    # the BytecodeAnalysis of bytecode. packed bytecode is analyzed once per hash of its bytes;
+    # other bytecode is analyzed every time, as packing it to get a hash costs about as much as the analysis.
+    @classmethod
+    def verify(kls, bytecode):
+        if not isinstance(bytecode, PackedBytecode):
+            return kls._analyze(bytecode)
+
+        bytecode_hash = bytecode.calc_hash()
+
+        with kls._cache_lock:
+            analysis = kls._cache.get(bytecode_hash)
+
+            if analysis is not None:
+                kls._cache.move_to_end(bytecode_hash)
+                return analysis
+
+        analysis = kls._analyze(bytecode)
+
+        with kls._cache_lock:
+            kls._cache[bytecode_hash] = analysis
+
+            if len(kls._cache) > ANALYSIS_CACHE_SIZE:
+                kls._cache.popitem(last=False)
+
+        return analysis
+
+    # checks every instruction's opcode and arguments, and tracks the stack depth, in one pass
+    @classmethod
+    def _analyze(kls, bytecode):
         errors = []
+        # stack depth relative to the start
+        depth = 0
+        stack_needed = 0
+        stack_peak = 0
 
         for ins in bytecode.instructions:
             if Opcode.is_opcode(ins.opcode):
+                pops, pushes = STACK_EFFECTS[Opcode(ins.opcode)]
+
+                stack_needed = max(stack_needed, pops - depth)
+                depth += pushes - pops
+                stack_peak = max(stack_peak, depth)
+
                 if ins.opcode == Opcode.NOOP:
                     continue
 
@@ -42,4 +105,4 @@ class BytecodeParser:
             else:
                 errors.append("'{}' is not a valid opcode".format(ins.opcode))
 
-        return errors
\ No newline at end of file
+        return BytecodeAnalysis(errors, stack_needed, stack_peak)
@@ -0,0 +1,92 @@
+import time
+
+from block import Block
+from block_header import BlockHeader
+from binary_codec import BinaryReader
+from utility_classes import Hashable, Serializable
+
+# the most headers sent in one recvheaders message
+MAX_HEADERS_PER_MESSAGE = 2000
+
+# everything a block hash commits to, with the transaction set reduced to its merkle root.
+# a chain of these can be downloaded and its proof of work checked before any block bodies arrive.
+class ChainHeader(Hashable, Serializable):
+    def __init__(self, block_header, timestamp, tx_root, prev_block_hash, nonce, block_hash):
+        self.block_header = block_header
+        self.timestamp = timestamp
+        self.tx_root = tx_root
+        self.prev_block_hash = prev_block_hash
+        self.nonce = nonce
+        self.block_hash = block_hash
+
+    @classmethod
+    def from_block(kls, block):
+        return ChainHeader(block_header=block.block_header, timestamp=block.timestamp, tx_root=block.tx_set.calc_hash(), prev_block_hash=block.prev_block_hash, nonce=block.nonce, block_hash=block.block_hash)
+
+    # the header of a stored block record (see Block.to_bytes), given the merkle root of its transactions.
+    # only the fields ahead of the transaction set are decoded.
+    @classmethod
+    def from_record(kls, data, tx_root):
+        block_header, timestamp, prev_block_hash, nonce, block_hash = Block.deserialize_binary_header(BinaryReader(data))
+
+        return ChainHeader(block_header=block_header, timestamp=timestamp, tx_root=tx_root, prev_block_hash=prev_block_hash, nonce=nonce, block_hash=block_hash)
+
+    def serialize(self):
+        return {
+            'block_header': self.block_header.serialize(),
+            'timestamp': self.timestamp,
+            'tx_root': self.tx_root,
+            'prev_block_hash': self.prev_block_hash,
+            'nonce': self.nonce,
+            'hash': self.block_hash
+        }
+
+    @classmethod
+    def deserialize(kls, obj):
+        REQUIRED_FIELDS = ['block_header', 'timestamp', 'tx_root', 'prev_block_hash', 'nonce', 'hash']
+
+        assert isinstance(obj, dict), 'header should be dict'
+
+        for field in REQUIRED_FIELDS:
+            assert field in obj, "'{}' is required in header data".format(field)
+
+        block_header = BlockHeader.deserialize(obj['block_header'])
+
+        assert isinstance(obj['timestamp'], int), 'timestamp should be int'
+        assert obj['timestamp'] < int(time.time()), 'timestamp should be < now'
+        assert isinstance(obj['tx_root'], str), 'tx_root should be str'
+        assert isinstance(obj['prev_block_hash'], str), 'prev_block_hash should be str'
+        assert isinstance(obj['nonce'], int), 'nonce should be int'
+        assert isinstance(obj['hash'], str), 'hash should be str'
+
+        return ChainHeader(block_header=block_header, timestamp=obj['timestamp'], tx_root=obj['tx_root'], prev_block_hash=obj['prev_block_hash'], nonce=obj['nonce'], block_hash=obj['hash'])
+
+    # same as Block.calc_hash, with the merkle root standing in for the transaction set
+    def calc_hash(self):
+        prefix = self.block_header.calc_hash() + self.tx_root + self.hash_str(str(self.timestamp))
+
+        return self.hash_str(prefix + str(self.nonce) + self.prev_block_hash)
+
+    # checks that the header follows prev (a ChainHeader or Block) and carries valid proof of work.
+    # raises AssertionError otherwise.
+    def verify(self, prev):
+        assert self.prev_block_hash == prev.block_hash, "header {} prev_block_hash ({}) does not match the previous block ({})".format(self.block_hash, self.prev_block_hash, prev.block_hash)
+        assert self.timestamp > prev.timestamp, "header {} timestamp should be greater than previous block timestamp".format(self.block_hash)
+        assert self.calc_hash() == self.block_hash, "header {} does not match its recalculated hash".format(self.block_hash)
+        assert int(self.block_hash, 16) < self.block_header.get_target(), "header {} does not meet its target".format(self.block_hash)
+
+    # a body matches its (already verified) header when it has the same fields and transaction root,
+    # which also means it hashes to the header's hash. returns a list of errors.
+    def check_body(self, block):
+        errors = []
+
+        if block.block_hash != self.block_hash:
+            errors.append("Block {} was received in place of {}".format(block.block_hash, self.block_hash))
+        elif block.prev_block_hash != self.prev_block_hash or block.timestamp != self.timestamp or block.nonce != self.nonce or block.block_header.serialize() != self.block_header.serialize():
+            errors.append("Block {} does not match its header".format(self.block_hash))
+        elif block.tx_set.calc_hash() != self.tx_root:
+            errors.append("Transactions of block {} do not match the header's merkle root".format(self.block_hash))
+        else:
+            errors.extend(block.check_preconditions())
+
+        return errors
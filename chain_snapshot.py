@@ -0,0 +1,63 @@
+import os
+import json
+
+from block import Block
+from utility_classes import Serializable
+
+# a checkpoint of a blockchain's in-memory state at a given height,
+# so startup only has to replay the blocks added after it.
+class ChainSnapshot(Serializable):
+    def __init__(self, height, last_block, target, retarget_timestamp, state):
+        self.height = height
+        self.last_block = last_block
+        self.target = target
+        self.retarget_timestamp = retarget_timestamp
+        # state derived from the chain by subclasses (e.g. the metachain's subchain registry)
+        self.state = state
+
+    def serialize(self):
+        return {
+            'height': self.height,
+            'last_block': self.last_block.serialize(),
+            'target': '{:x}'.format(self.target),
+            'retarget_timestamp': self.retarget_timestamp,
+            'state': self.state
+        }
+
+    @classmethod
+    def deserialize(kls, obj):
+        REQUIRED_FIELDS = ['height', 'last_block', 'target', 'retarget_timestamp', 'state']
+
+        assert isinstance(obj, dict), 'snapshot should be dict'
+
+        for field in REQUIRED_FIELDS:
+            assert field in obj, "'{}' is required in snapshot data".format(field)
+
+        assert isinstance(obj['height'], int), 'height should be int'
+        assert isinstance(obj['target'], str), 'target should be hex str'
+        assert isinstance(obj['retarget_timestamp'], int), 'retarget_timestamp should be int'
+        assert isinstance(obj['state'], dict), 'state should be dict'
+
+        return ChainSnapshot(height=obj['height'], last_block=Block.deserialize(obj['last_block']), target=int(obj['target'], 16), retarget_timestamp=obj['retarget_timestamp'], state=obj['state'])
+
+    def save(self, snapshot_path):
+        # write to a temporary file first so a crash never leaves a partial snapshot behind
+        tmp_path = '{}.tmp'.format(snapshot_path)
+
+        with open(tmp_path, 'w') as outfile:
+            json.dump(self.serialize(), outfile)
+
+        os.replace(tmp_path, snapshot_path)
+
+    @classmethod
+    def load(kls, snapshot_path):
+        if not os.path.exists(snapshot_path):
+            return None
+
+        with open(snapshot_path) as json_data:
+            try:
+                return kls.deserialize(json.load(json_data))
+            except Exception as e:
+                print("Failed to load snapshot {}; the chain will be replayed from the start. The error was:\n\t{}".format(snapshot_path, e))
+
+        return None
\ No newline at end of file
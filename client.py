@@ -1,7 +1,9 @@
 import _thread
+import threading
 import socket
 import json
 import time
+import itertools
 from functools import reduce
 
 from object_identifier import ObjectIdentifier
@@ -9,6 +11,15 @@ from metachain import metachain as mc, get_subchains
 from transaction import Transaction
 from transaction_pool import TransactionPool
 from block import Block
+from block_store import BlockStore
+from block_verifier import BlockVerifier
+from message_framing import MessageDecoder, encode_message, get_hello_message, create_codec
+from sync_flow import DEFAULT_SYNC_WINDOW, get_credit_message
+from gossip import INV_TX, GOSSIP_FEATURE, get_inv_messages, get_inv_response, get_getdata_responses, peer_supports_gossip
+from tx_batch import get_tx_batch_message, split_tx_batches
+
+# how long broadcast_transactions waits for the server's results for a batch
+TX_BATCH_TIMEOUT = 30
 
 class InvalidMessage(Exception):
     def __init__(self, msg):
@@ -21,6 +32,18 @@ class Client:
         self.socket = None
         self.peers = []
         self.is_connected = False
+        self.block_verifier = BlockVerifier()
+        # frames must not interleave between the heartbeat, sync and broadcast threads
+        self._send_lock = threading.Lock()
+        # compresses what we send, once compression has been negotiated
+        self.codec = None
+        # protocol features the server listed in its hello
+        self.server_features = None
+        # request ids are taken from the sync thread and from broadcast_transactions callers;
+        # next() on a count is atomic, so no two requests share an id
+        self._request_ids = itertools.count(1)
+        # request id -> [threading.Event, results] for pushtx_batch messages awaiting their pushtx_result
+        self._pending_batches = {}
 
     def connect(self, server_address, server_port):
         assert not self.is_connected
@@ -33,6 +56,9 @@ class Client:
             self.socket.connect((server_address, server_port))
             self.is_connected = True
 
+            # offer compression; servers that don't support it never answer, and we stay on plain json
+            self.send(get_hello_message([GOSSIP_FEATURE]))
+
             _thread.start_new_thread(self.listen_for_server_messages, ())
             _thread.start_new_thread(self.periodically_resync_with_peers, ())
             _thread.start_new_thread(self.sync_metachain, ())
@@ -47,22 +73,96 @@ class Client:
 
         self.socket.close()
         self.is_connected = False
+        self.block_verifier.shutdown()
 
         #if self.is_connected:
         #    _thread.start_new_thread(self.periodically_resync_with_peers, ())
 
+    def send(self, obj):
+        # compressed messages must be encoded in the order they are sent
+        with self._send_lock:
+            self.socket.sendall(encode_message(obj, codec=self.codec))
+
+    # the server's answer to our hello. it compresses after our hello_ack, so the decoder has to be ready before it goes out.
+    def _receive_hello(self, decoder, obj):
+        self.server_features = obj.get("features")
+
+        if obj.get("codec") is None:
+            return
+
+        codec = create_codec(obj["codec"])
+
+        with self._send_lock:
+            decoder.codec = codec
+            self.codec = codec
+
+            self.socket.sendall(encode_message({
+                'type': 'hello_ack'
+            }, codec=codec))
+
     def broadcast_transaction(self, tx, blockchain_identifier):
         print("broadcast: {}".format(tx.serialize()))
         try:
-            self.socket.send(json.dumps({
+            self.send({
                 'type': 'pushtx',
                 'tx': tx.serialize(),
                 'blockchain': str(blockchain_identifier)
-            }).encode('utf-8'))
+            })
         except Exception as e:
             print("Failed to broadcast tx: {}".format(e))
             raise e
 
+    def _new_request_id(self):
+        return next(self._request_ids)
+
+    # submits many transactions, MAX_TX_BATCH per message, and waits for the server's verdict on each.
+    # returns one {'status', 'hash'?, 'error'?} result per transaction, in order.
+    def broadcast_transactions(self, txs, blockchain_identifier, timeout=TX_BATCH_TIMEOUT):
+        pending = []
+
+        for batch in split_tx_batches(txs):
+            request_id = self._new_request_id()
+
+            self._pending_batches[request_id] = [threading.Event(), None]
+            pending.append(request_id)
+
+            self.send(get_tx_batch_message(batch, blockchain_identifier, request_id))
+
+        results = []
+
+        try:
+            for request_id in pending:
+                done, batch_results = self._pending_batches[request_id]
+
+                if not done.wait(timeout):
+                    raise TimeoutError("No pushtx_result for batch {}".format(request_id))
+
+                results.extend(self._pending_batches[request_id][1])
+        finally:
+            for request_id in pending:
+                self._pending_batches.pop(request_id, None)
+
+        return results
+
+    def _receive_tx_results(self, obj):
+        pending = self._pending_batches.get(obj.get("id"))
+
+        if pending is None or not isinstance(obj.get("results"), list):
+            raise InvalidMessage(obj)
+
+        pending[1] = obj["results"]
+        pending[0].set()
+
+    # announces (transaction, source) pairs new to our pool to the server, unless they came from it
+    def relay_transactions(self, items):
+        if not peer_supports_gossip(self.server_features):
+            return
+
+        hashes = [tx.calc_hash() for tx, source in items if source is not self]
+
+        for message in get_inv_messages(INV_TX, hashes):
+            self.send(message)
+
     def respond_to_message(self, obj):
         msg_type = obj["type"]
 
@@ -72,55 +172,92 @@ class Client:
         if msg_type == "pong":
             print("pong")
         elif msg_type == "recvblockpage":
-            print("recvblockpage", obj)
-
             blockpage = obj["blockpage"]
 
             assert isinstance(blockpage, list), 'blockpage should be list'
 
-            for block_json in blockpage:
-                # load serialized block object
-                block_obj = Block.deserialize(block_json)
-                assert block_obj.prev_block_hash == mc.last_block.block_hash, "requested block object prev_block_hash ({}) should be equal to the block hash of the previous block in the local chain ({})".format(block_obj.prev_block_hash, mc.last_block.block_hash)
+            # load serialized block objects
+            self._add_block_page(list(map(lambda block_json: Block.deserialize(block_json), blockpage)), obj.get("id"))
 
-                mc.add_block(block_obj, save=True)
+        elif msg_type == "syncdone":
+            if 'error' in obj:
+                self.handlers['onstatus']("Sync failed: {}".format(obj['error']))
+            else:
+                self.handlers['onstatus']("Sync complete")
 
         elif msg_type == "recvtx":
             print("recvtx")
             tx = obj["tx"]
 
             tx_obj = Transaction.deserialize(tx)
-            TransactionPool.queue_tx(tx_obj)
+            TransactionPool.instance.queue_tx(tx_obj, source=self)
             print("GOT TX: {}".format(tx))
 
+        elif msg_type == "pushtx_result":
+            self._receive_tx_results(obj)
+
+        elif msg_type == "inv":
+            getdata = get_inv_response(TransactionPool.instance, obj, self, self.send)
+
+            if getdata is not None:
+                self.send(getdata)
+
+        elif msg_type == "getdata":
+            for message in get_getdata_responses(TransactionPool.instance, obj):
+                self.send(message)
+
         elif msg_type == "updatepeers":
             self._updatepeers(obj["peers"])
 
+    # blocks are verified (in parallel) and linked to the local chain tip before being added.
+    # the page's blocks are then handed back to the sync stream's window.
+    def _add_block_page(self, blocks, request_id):
+        for block_obj in self.block_verifier.verify(blocks, mc.last_block):
+            mc.add_block(block_obj, save=True)
+
+        if len(blocks) != 0:
+            self.send(get_credit_message(request_id, len(blocks)))
+
+    # the attachment of a recvblockpage_raw message holds stored block records
+    def _receive_raw_block_page(self, attachment, request_id):
+        if attachment is None:
+            raise InvalidMessage("recvblockpage_raw without block data")
+
+        self._add_block_page([Block.from_bytes(record) for record in BlockStore.split_records(attachment)], request_id)
+
     def listen_for_server_messages(self):
         _thread.start_new_thread(self.heartbeat, ())
 
+        decoder = MessageDecoder()
+
         while 1:
             if not self.is_connected:
                 return
 
             try:
-                data = self.socket.recv(1024)
+                messages = decoder.recv_from(self.socket)
 
-                if not data:
+                if messages is None:
                     break
 
-                obj = None
+                for payload, attachment in messages:
+                    try:
+                        obj = None
 
-                try:
-                    obj = json.loads(data)
-                except:
-                    raise InvalidMessage(data)
+                        try:
+                            obj = json.loads(payload)
+                        except:
+                            raise InvalidMessage(payload)
 
-                self.respond_to_message(obj)
+                        if obj.get("type") == "hello":
+                            self._receive_hello(decoder, obj)
+                        elif obj.get("type") == "recvblockpage_raw":
+                            self._receive_raw_block_page(attachment, obj.get("id"))
+                        else:
+                            self.respond_to_message(obj)
 
-            except InvalidMessage as e:
-                self.handlers['onstatus'](str(e))
-                continue
+                    except InvalidMessage as e:
+                        self.handlers['onstatus'](str(e))
 
             except Exception as e:
                 print("Error while listening for server messages: {}".format(e))
@@ -133,29 +270,31 @@ class Client:
 
     def heartbeat(self):
         while self.is_connected:
-            self.socket.send(json.dumps({
+            self.send({
                 'type': 'ping'
-            }).encode('utf-8'))
+            })
 
             time.sleep(1)
     
     def sync_metachain(self):
         print("Loading local metachain blocks...")
-        mc.load_blocks()
+        mc.load_blocks(self.block_verifier)
 
         get_subchains()
 
-        print("Syncing metachain (wait 5s...)")
-        time.sleep(5)
-
+        print("Syncing metachain...")
         print("mc.last_block.block_hash = {}".format(mc.last_block.block_hash))
 
-        # load latest copy of the metachain
-        self.socket.send(json.dumps({
+        # load latest copy of the metachain.
+        # the server streams pages while we have window left; we hand it back as pages are added
+        self.send({
             'type': 'get_chain_metadata',
+            'id': self._new_request_id(),
             'identifier': str(mc.get_identifier()),
-            'last_block_hash': mc.last_block.block_hash
-        }).encode('utf-8'))
+            'last_block_hash': mc.last_block.block_hash,
+            'raw': True,
+            'window': DEFAULT_SYNC_WINDOW
+        })
 
         # when we get data from the metachain,
         # we can start to pull other blockchains that are nested within the metachain.
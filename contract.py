@@ -5,6 +5,7 @@ class Contract(Hashable):
     def __init__(self, contract_name, schema, bytecode):
         self.contract_name = contract_name
         self.schema = schema
+        # a Bytecode, or a PackedBytecode as stored on chain; both hash the same
         self.bytecode = bytecode
         
     def calc_hash(self):
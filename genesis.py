@@ -31,7 +31,7 @@ def generate_genesis_block():
         prev_block_hash='0'
     )
 
-    block.solve()
+    block.solve(workers=None)
     block.verify()
 
     return block
@@ -0,0 +1,279 @@
+import time
+import random
+import threading
+from collections import OrderedDict
+
+from metachain import metachain
+from transaction import Transaction
+
+# each new transaction is announced to at most this many of our peers; they announce it onwards the same way
+GOSSIP_FANOUT = 8
+
+# hashes remembered as seen, so the same announcement arriving from several peers is only fetched once
+SEEN_SET_SIZE = 100000
+
+# the most items in one inv or getdata message
+MAX_INV_ITEMS = 1000
+
+# seconds a getdata may go unanswered before the item is asked for from another peer that announced it
+GETDATA_TIMEOUT = 10
+
+# peers remembered per requested item as others to ask, should the request go unanswered
+MAX_ANNOUNCERS = 4
+
+INV_TX = 'tx'
+INV_BLOCK = 'block'
+
+INV_KINDS = [INV_TX, INV_BLOCK]
+
+# peers that list this in their hello understand inv/getdata; older peers are pushed full transactions
+GOSSIP_FEATURE = 'inv'
+
+# a bounded set of recently seen hashes, forgetting the least recently seen first
+class SeenSet:
+    def __init__(self, max_size=SEEN_SET_SIZE):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    # marks key as seen; returns True if it had not been seen before
+    def add(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return False
+
+            self._items[key] = True
+
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+            return True
+
+# items requested with getdata and not received yet, in the order their requests expire.
+# peers announcing an item while it is requested are remembered, so an unanswered request can be retried with them.
+# a peer is kept as (peer, send), where send(message) sends it a message from any thread.
+class InflightRequests:
+    class Request:
+        def __init__(self, kind, expires):
+            self.kind = kind
+            self.expires = expires
+            # (peer, send) of other peers that announced the item
+            self.announcers = []
+
+    def __init__(self, timeout=GETDATA_TIMEOUT, max_size=SEEN_SET_SIZE):
+        self.timeout = timeout
+        self.max_size = max_size
+        # item hash -> Request
+        self._requests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._requests)
+
+    def __contains__(self, item_hash):
+        with self._lock:
+            return item_hash in self._requests
+
+    # returns True if the item should be requested from peer now. if it is already requested,
+    # peer is remembered as another announcer and False is returned.
+    def request(self, kind, item_hash, peer, send, now):
+        with self._lock:
+            request = self._requests.get(item_hash)
+
+            if request is not None:
+                if len(request.announcers) < MAX_ANNOUNCERS and all(announcer is not peer for announcer, announcer_send in request.announcers):
+                    request.announcers.append((peer, send))
+
+                return False
+
+            self._requests[item_hash] = InflightRequests.Request(kind, now + self.timeout)
+
+            if len(self._requests) > self.max_size:
+                self._requests.popitem(last=False)
+
+            return True
+
+    def received(self, item_hash):
+        with self._lock:
+            self._requests.pop(item_hash, None)
+
+    # takes the requests that expired by now, as (kind, item hash, peer, send) of the announcer to ask next.
+    # those are requested again from that peer; requests with no announcer left are dropped (peer and send are None),
+    # so the next announcement of the item is requested afresh.
+    def expire(self, now):
+        expired = []
+
+        with self._lock:
+            while len(self._requests) != 0:
+                item_hash, request = next(iter(self._requests.items()))
+
+                if request.expires > now:
+                    break
+
+                if len(request.announcers) == 0:
+                    del self._requests[item_hash]
+                    expired.append((request.kind, item_hash, None, None))
+                    continue
+
+                peer, send = request.announcers.pop(0)
+                request.expires = now + self.timeout
+                self._requests.move_to_end(item_hash)
+
+                expired.append((request.kind, item_hash, peer, send))
+
+        return expired
+
+def get_inv_message(kind, hashes):
+    return {
+        'type': 'inv',
+        'items': [[kind, item_hash] for item_hash in hashes]
+    }
+
+# inv messages announcing hashes, MAX_INV_ITEMS at most per message
+def get_inv_messages(kind, hashes):
+    return [get_inv_message(kind, hashes[i:i + MAX_INV_ITEMS]) for i in range(0, len(hashes), MAX_INV_ITEMS)]
+
+def get_getdata_message(items):
+    return {
+        'type': 'getdata',
+        'items': [[kind, item_hash] for kind, item_hash in items]
+    }
+
+def get_getdata_messages(items):
+    return [get_getdata_message(items[i:i + MAX_INV_ITEMS]) for i in range(0, len(items), MAX_INV_ITEMS)]
+
+# the (kind, hash) items of an inv or getdata message, or None if it is malformed
+def parse_inv_items(obj):
+    items = obj.get("items")
+
+    if not isinstance(items, list) or len(items) > MAX_INV_ITEMS:
+        return None
+
+    parsed = []
+
+    for item in items:
+        if not isinstance(item, list) or len(item) != 2 or item[0] not in INV_KINDS or not isinstance(item[1], str):
+            return None
+
+        parsed.append((item[0], item[1]))
+
+    return parsed
+
+# the peers to announce to: a random GOSSIP_FANOUT of them, excluding the peer we heard it from
+def select_fanout(peers, exclude=None, fanout=GOSSIP_FANOUT):
+    peers = [peer for peer in peers if peer is not exclude]
+
+    if len(peers) <= fanout:
+        return peers
+
+    return random.sample(peers, fanout)
+
+def peer_supports_gossip(features):
+    return isinstance(features, list) and GOSSIP_FEATURE in features
+
+def is_known(pool, kind, item_hash):
+    if kind == INV_TX:
+        return item_hash in pool.mempool or item_hash in pool.seen
+
+    return metachain.get_block_height(item_hash) is not None
+
+# answers an inv from peer: the getdata message requesting what we don't have, or None if we have it all.
+# items already requested from another peer aren't asked for again; peer is kept to retry with instead
+# (see retry_expired_requests). send(message) sends peer a message from any thread.
+def get_inv_response(pool, obj, peer, send, now=None):
+    items = parse_inv_items(obj)
+
+    if items is None:
+        return None
+
+    if now is None:
+        now = time.monotonic()
+
+    missing = []
+
+    for kind, item_hash in items:
+        if is_known(pool, kind, item_hash):
+            continue
+
+        if pool.requests.request(kind, item_hash, peer, send, now):
+            missing.append((kind, item_hash))
+
+    if len(missing) == 0:
+        return None
+
+    return get_getdata_message(missing)
+
+# answers a getdata: a message for each requested item we have
+def get_getdata_responses(pool, obj):
+    items = parse_inv_items(obj)
+
+    if items is None:
+        return []
+
+    messages = []
+
+    for kind, item_hash in items:
+        if kind == INV_TX:
+            tx = pool.mempool.get(item_hash)
+
+            if tx is not None:
+                messages.append({
+                    'type': 'recvtx',
+                    'tx': tx.serialize()
+                })
+
+        elif kind == INV_BLOCK:
+            block = metachain.get_block_by_hash(item_hash)
+
+            if block is not None:
+                messages.append({
+                    'type': 'recvblockpage',
+                    'blockpage': [block.serialize()]
+                })
+
+    return messages
+
+# a 'broadcast' message may only carry a transaction ({'type': 'recvtx', 'tx': ...}), which goes into the pool
+# and is relayed from there like any other. returns the transaction, or None if the message carries anything else.
+def get_broadcast_tx(obj):
+    msg = obj.get("msg")
+
+    if not isinstance(msg, dict) or msg.get("type") != 'recvtx':
+        return None
+
+    try:
+        return Transaction.deserialize(msg.get("tx"))
+    except Exception:
+        return None
+
+# sends the getdata requests that went unanswered to other peers that announced the items. called periodically by the pool.
+def retry_expired_requests(pool, now=None):
+    if now is None:
+        now = time.monotonic()
+
+    # id(peer) -> (send, items)
+    retries = OrderedDict()
+
+    for kind, item_hash, peer, send in pool.requests.expire(now):
+        if is_known(pool, kind, item_hash):
+            # arrived some other way, e.g. a block through sync
+            pool.requests.received(item_hash)
+            continue
+
+        if send is not None:
+            retries.setdefault(id(peer), (send, []))[1].append((kind, item_hash))
+
+    for send, items in retries.values():
+        for message in get_getdata_messages(items):
+            try:
+                send(message)
+            except Exception as e:
+                print("Failed to send getdata to a peer: {}".format(e))
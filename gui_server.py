@@ -9,16 +9,26 @@ import datetime
 
 from client import *
 from server import *
+from async_server import AsyncServer
+from async_client import AsyncClient
 
 from object_identifier import ObjectIdentifier
 from transaction_pool import TransactionPool
+from metachain import metachain
+
+# serve peers from a single asyncio event loop rather than a thread per connection
+USE_ASYNC_SERVER = True
+# pipeline requests to the upstream peer over one asyncio connection
+USE_ASYNC_CLIENT = True
 
 class P2PServer(Frame):
     def __init__(self, root):
         Frame.__init__(self, root)
         self.root = root
 
-        self.client = Client(
+        client_kls = AsyncClient if USE_ASYNC_CLIENT else Client
+
+        self.client = client_kls(
             {
                 'onconnect': self._onselfconnect,
                 'ondisconnect': self._onselfdisconnect,
@@ -28,11 +38,19 @@ class P2PServer(Frame):
             }
         ) # so it can connect to other servers as a client
     
-        self.server = Server(
-            onstatus=self.server_status
-        )
-
-        TransactionPool(server=self.server, client=self.client).instance.start()
+        if USE_ASYNC_SERVER:
+            self.server = AsyncServer(
+                onstatus=self.server_status
+            )
+        else:
+            self.server = Server(
+                onstatus=self.server_status
+            )
+
+        transaction_pool = TransactionPool(server=self.server, client=self.client).instance
+        # mined transactions leave the pool, so they aren't selected, accepted or relayed again
+        metachain.add_block_listener(transaction_pool.remove_block_transactions)
+        transaction_pool.start()
 
     def _onselfconnect(self):
         self.client_status("Connected to server successfully")
@@ -16,9 +16,15 @@ class Opcode(Enum):
     @classmethod
     def is_opcode(kls, value):
         if isinstance(value, kls):
-            return any(value.value == item.value for item in kls)
-        else:
-            return any(value == item.value for item in kls)
+            return True
+
+        try:
+            return value in OPCODE_VALUES
+        except TypeError:
+            # unhashable, so not equal to any opcode's value
+            return False
+
+OPCODE_VALUES = frozenset([item.value for item in Opcode])
 
 class ValueType(Enum):
     ANY = 0
@@ -40,6 +46,9 @@ REAL_TYPES = {
     ValueType.DICT: dict
 }
 
+# python type -> the ValueType Value.create gives its data, filled in as types are seen
+CREATED_TYPES = {}
+
 OPERANDS = {
     Opcode.LOAD: [ValueType.PTR],
     Opcode.PUSH: [ValueType.ANY],
@@ -51,6 +60,19 @@ OPERANDS = {
     Opcode.MOD: [],
 }
 
+# (values popped, values pushed) by each opcode when run
+STACK_EFFECTS = {
+    Opcode.NOOP: (0, 0),
+    Opcode.LOAD: (0, 0),
+    Opcode.PUSH: (0, 1),
+    Opcode.POP: (1, 0),
+    Opcode.ADD: (2, 1),
+    Opcode.SUB: (2, 1),
+    Opcode.MUL: (2, 1),
+    Opcode.DIV: (2, 1),
+    Opcode.MOD: (2, 1),
+}
+
 class Value(Hashable):
     def __init__(self, value_type, data):
         self.value_type = value_type
@@ -58,11 +80,21 @@ class Value(Hashable):
         
     @classmethod
     def create(kls, data):
-        for key, value in REAL_TYPES.items():
-            if isinstance(data, value):
-                return kls(key, data)
+        value_type = CREATED_TYPES.get(type(data))
+
+        if value_type is None:
+            # first value of this python type: find its ValueType the same way as always, in REAL_TYPES order
+            for key, value in REAL_TYPES.items():
+                if isinstance(data, value):
+                    value_type = key
+                    break
+
+            if value_type is None:
+                raise Exception("no compatible type known for {}".format(type(data).__name__))
+
+            CREATED_TYPES[type(data)] = value_type
 
-        raise Exception("no compatible type known for {}".format(type(data).__name__))
+        return kls(value_type, data)
 
     def calc_hash(self):
         return self.hash_str(self.hash_str(self.value_type) + self.hash_str(self.data))
@@ -78,4 +110,4 @@ class Instruction(Hashable):
         for arg in self.arguments:
             arg_hash = self.hash_str(arg_hash + arg.calc_hash())
 
-        return self.hash_str(self.opcode.calc_hash() + arg_hash)
\ No newline at end of file
+        return self.hash_str(self.hash_str(self.opcode) + arg_hash)
\ No newline at end of file
@@ -0,0 +1,209 @@
+import heapq
+import itertools
+import threading
+from numbers import Number
+
+from transaction import Transaction
+from binary_codec import BinaryWriter
+
+# pending transactions kept before the lowest-priority ones are evicted
+MAX_MEMPOOL_SIZE = 50000
+
+# limits of the batch handed to a miner for one block
+MAX_BLOCK_TXS = 2000
+MAX_BLOCK_BYTES = 1024 * 1024
+
+# outcomes of adding a transaction
+TX_ACCEPTED = 'accepted'
+# already pending
+TX_DUPLICATE = 'duplicate'
+# the pool is full of higher-priority transactions
+TX_REJECTED = 'rejected'
+
+# the fee a transaction offers, read from its data; transactions without one pay nothing
+def get_tx_fee(tx):
+    fee = tx.data.get('fee')
+
+    if isinstance(fee, Number) and not isinstance(fee, bool) and fee > 0:
+        return fee
+
+    return 0
+
+# pending transactions keyed by hash, ordered by fee (highest first) and then timestamp (oldest first).
+# two heaps give the best transactions for a block and the worst to evict; entries removed from the pool
+# stay in the heaps until they surface, and are skipped then.
+class Mempool:
+    class Entry:
+        def __init__(self, tx, tx_hash, fee, size, seq):
+            self.tx = tx
+            self.tx_hash = tx_hash
+            self.fee = fee
+            self.size = size
+            # identifies this entry's heap items; items of an earlier entry for the same hash are stale
+            self.seq = seq
+
+    def __init__(self, max_size=MAX_MEMPOOL_SIZE):
+        self.max_size = max_size
+
+        # tx hash -> Entry
+        self._entries = {}
+        # (-fee, timestamp, seq, tx hash): best first
+        self._best = []
+        # (fee, -timestamp, seq, tx hash): worst first
+        self._worst = []
+        # breaks ties between otherwise equal transactions in insertion order
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self._entries
+
+    def get(self, tx_hash):
+        entry = self._entries.get(tx_hash)
+
+        if entry is None:
+            return None
+
+        return entry.tx
+
+    # adds tx if it is new. returns False if it was already pending, or if the pool is full of better transactions.
+    def add(self, tx):
+        return self.add_many([tx])[0] == TX_ACCEPTED
+
+    # adds a batch of transactions under one lock; returns the outcome (TX_ACCEPTED, ...) of each.
+    # tx_hashes can be passed if the caller has already hashed txs.
+    def add_many(self, txs, tx_hashes=None):
+        for tx in txs:
+            assert isinstance(tx, Transaction)
+
+        if tx_hashes is None:
+            tx_hashes = [tx.calc_hash() for tx in txs]
+
+        # hashing and sizing don't need the lock
+        prepared = []
+
+        for tx, tx_hash in zip(txs, tx_hashes):
+            writer = BinaryWriter()
+            tx.serialize_binary(writer)
+
+            prepared.append((tx, tx_hash, len(writer.buffer)))
+
+        with self._lock:
+            results = [self._add(tx, tx_hash, size) for tx, tx_hash, size in prepared]
+
+            self._compact()
+
+        return results
+
+    def _add(self, tx, tx_hash, size):
+        if tx_hash in self._entries:
+            return TX_DUPLICATE
+
+        fee = get_tx_fee(tx)
+
+        if len(self._entries) >= self.max_size:
+            worst = self._peek(self._worst)
+
+            # (fee, -timestamp) of tx must beat the worst pending transaction to displace it
+            if worst is not None and (fee, -tx.timestamp) <= (worst.fee, -worst.tx.timestamp):
+                return TX_REJECTED
+
+            self._evict()
+
+        seq = next(self._seq)
+
+        self._entries[tx_hash] = Mempool.Entry(tx, tx_hash, fee, size, seq)
+        heapq.heappush(self._best, (-fee, tx.timestamp, seq, tx_hash))
+        heapq.heappush(self._worst, (fee, -tx.timestamp, seq, tx_hash))
+
+        return TX_ACCEPTED
+
+    def remove(self, tx_hash):
+        with self._lock:
+            return self._entries.pop(tx_hash, None) is not None
+
+    # drops the transactions that made it into a block
+    def remove_block_transactions(self, block):
+        # nothing to hash for blocks replayed at startup, before anything is pending
+        if len(self._entries) == 0:
+            return
+
+        self.remove_many([tx.calc_hash() for tx in block.tx_set.transactions])
+
+    def remove_many(self, tx_hashes):
+        with self._lock:
+            for tx_hash in tx_hashes:
+                self._entries.pop(tx_hash, None)
+
+            self._compact()
+
+    # the highest-priority transactions that fit in a block, best first. they stay pending until
+    # remove_block_transactions is called with the block they were mined into.
+    def select_batch(self, max_count=MAX_BLOCK_TXS, max_bytes=MAX_BLOCK_BYTES):
+        batch = []
+        popped = []
+        batch_bytes = 0
+
+        with self._lock:
+            while self._best and len(batch) < max_count:
+                item = heapq.heappop(self._best)
+                entry = self._get_live_entry(item)
+
+                if entry is None:
+                    # removed since it was pushed
+                    continue
+
+                popped.append(item)
+
+                if batch_bytes + entry.size > max_bytes:
+                    # a smaller transaction further down may still fit
+                    continue
+
+                batch.append(entry.tx)
+                batch_bytes += entry.size
+
+            for item in popped:
+                heapq.heappush(self._best, item)
+
+        return batch
+
+    def _get_live_entry(self, item):
+        entry = self._entries.get(item[3])
+
+        if entry is None or entry.seq != item[2]:
+            return None
+
+        return entry
+
+    # the live entry at the top of heap, dropping stale ones on the way
+    def _peek(self, heap):
+        while heap:
+            entry = self._get_live_entry(heap[0])
+
+            if entry is not None:
+                return entry
+
+            heapq.heappop(heap)
+
+        return None
+
+    def _evict(self):
+        entry = self._peek(self._worst)
+
+        if entry is not None:
+            heapq.heappop(self._worst)
+            del self._entries[entry.tx_hash]
+
+    # rebuilds the heaps once they are mostly stale entries, so they stay O(pool size)
+    def _compact(self):
+        if len(self._best) + len(self._worst) <= 4 * len(self._entries) + 64:
+            return
+
+        self._best = [item for item in self._best if self._get_live_entry(item) is not None]
+        self._worst = [item for item in self._worst if self._get_live_entry(item) is not None]
+
+        heapq.heapify(self._best)
+        heapq.heapify(self._worst)
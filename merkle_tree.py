@@ -0,0 +1,84 @@
+from utility_classes import Hashable
+
+# internal nodes hash their children behind this prefix, so no internal node has the preimage
+# of a leaf (leaf hashes are computed from 64-character hashes)
+NODE_PREFIX = '01'
+
+# a binary merkle tree over hex hash strings.
+# every level is kept, so appending a leaf only rehashes the path from that leaf up to the root.
+# when a level has an odd number of nodes, the last node is carried up to the next level unchanged.
+# it is never paired with a copy of itself, so [a, b, c] and [a, b, c, c] have different roots.
+class MerkleTree(Hashable):
+    def __init__(self, leaves=[]):
+        self.levels = [[]]
+
+        for leaf in leaves:
+            self.append(leaf)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def root(self):
+        if len(self.levels[0]) == 0:
+            return ''
+
+        return self.levels[-1][0]
+
+    def append(self, leaf_hash):
+        self.levels[0].append(leaf_hash)
+
+        index = len(self.levels[0]) - 1
+        depth = 0
+
+        while len(self.levels[depth]) > 1:
+            level = self.levels[depth]
+            parent_index = index // 2
+
+            node = level[parent_index * 2]
+
+            if parent_index * 2 + 1 < len(level):
+                node = self.hash_str(NODE_PREFIX + node + level[parent_index * 2 + 1])
+
+            if depth + 1 == len(self.levels):
+                self.levels.append([])
+
+            parent_level = self.levels[depth + 1]
+
+            if parent_index < len(parent_level):
+                parent_level[parent_index] = node
+            else:
+                parent_level.append(node)
+
+            index = parent_index
+            depth += 1
+
+    # returns the sibling hashes on the path from a leaf to the root,
+    # as a list of [sibling_hash, sibling_is_left] pairs. levels where the node is carried up have no entry.
+    def proof(self, index):
+        assert 0 <= index < len(self.levels[0]), "leaf index out of range ({})".format(index)
+
+        path = []
+
+        for level in self.levels[:-1]:
+            if index % 2 == 0:
+                if index + 1 < len(level):
+                    path.append([level[index + 1], False])
+            else:
+                path.append([level[index - 1], True])
+
+            index //= 2
+
+        return path
+
+    @classmethod
+    def verify_proof(kls, leaf_hash, proof, root):
+        hasher = Hashable()
+        node = leaf_hash
+
+        for sibling_hash, sibling_is_left in proof:
+            if sibling_is_left:
+                node = hasher.hash_str(NODE_PREFIX + sibling_hash + node)
+            else:
+                node = hasher.hash_str(NODE_PREFIX + node + sibling_hash)
+
+        return node == root
\ No newline at end of file
@@ -0,0 +1,278 @@
+import json
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# every message on the wire is a frame: a 4-byte big-endian payload length, a flags byte, then the payload.
+FRAME_HEADER = struct.Struct('>IB')
+
+# set on a json message frame when the next frame is a binary attachment belonging to it
+FLAG_HAS_ATTACHMENT = 0x01
+# set on the frame carrying a binary attachment
+FLAG_ATTACHMENT = 0x02
+# set on a json message frame whose payload went through the connection's compression stream
+FLAG_COMPRESSED = 0x04
+
+# frames larger than this are treated as a protocol error
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+class FramingError(Exception):
+    pass
+
+# per-connection streaming compression of json payloads.
+# each direction keeps one compression context for the life of the connection, so keys and values
+# repeated across messages (block_header, tx_set, ...) compress against everything sent before.
+# frames must be compressed in the order they are sent and decompressed in the order they arrive.
+class ZlibCodec:
+    name = 'zlib'
+
+    def __init__(self):
+        self._compressor = zlib.compressobj()
+        self._decompressor = zlib.decompressobj()
+
+    def compress(self, data):
+        # a sync flush ends each message on a byte boundary the receiver can decompress up to
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    # raises FramingError if data would decompress to more than max_length bytes
+    def decompress(self, data, max_length=MAX_FRAME_SIZE):
+        # one byte over the limit tells a payload of exactly max_length apart from a longer one
+        payload = self._decompressor.decompress(data, max_length + 1)
+
+        if len(payload) > max_length or len(self._decompressor.unconsumed_tail) != 0:
+            raise FramingError("compressed frame expands past {} bytes".format(max_length))
+
+        return payload
+
+# collects decompressed output, failing as soon as it grows past max_length
+class BoundedOutput:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.max_length = MAX_FRAME_SIZE
+
+    def write(self, data):
+        if len(self.buffer) + len(data) > self.max_length:
+            raise FramingError("compressed frame expands past {} bytes".format(self.max_length))
+
+        self.buffer += data
+
+        return len(data)
+
+    def flush(self):
+        pass
+
+class ZstdCodec:
+    name = 'zstd'
+
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor().compressobj()
+        # zstd's decompressobj has no output limit, so output goes through a writer that enforces one
+        self._output = BoundedOutput()
+        self._decompressor = zstandard.ZstdDecompressor().stream_writer(self._output)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def decompress(self, data, max_length=MAX_FRAME_SIZE):
+        self._output.max_length = max_length
+        self._decompressor.write(data)
+
+        payload = bytes(self._output.buffer)
+        self._output.buffer.clear()
+
+        return payload
+
+# codecs this node supports, most preferred first
+def get_codec_names():
+    if zstandard is not None:
+        return [ZstdCodec.name, ZlibCodec.name]
+
+    return [ZlibCodec.name]
+
+# the codec to use with a peer offering codec_names, or None if there is none in common
+def select_codec_name(codec_names):
+    if not isinstance(codec_names, list):
+        return None
+
+    for name in get_codec_names():
+        if name in codec_names:
+            return name
+
+    return None
+
+def create_codec(name):
+    if name == ZstdCodec.name and zstandard is not None:
+        return ZstdCodec()
+
+    if name == ZlibCodec.name:
+        return ZlibCodec()
+
+    raise FramingError("unsupported codec {}".format(name))
+
+# responses carry the id of the request they answer, so clients can have several requests outstanding
+def tag_request_id(obj, request_id):
+    if request_id is not None:
+        obj['id'] = request_id
+
+    return obj
+
+# compression is negotiated per connection:
+#   client -> server  {'type': 'hello', 'codecs': [...]}
+#   server -> client  {'type': 'hello', 'codec': name or None}; the server now accepts compressed frames
+#   client -> server  {'type': 'hello_ack'}, the client's first compressed frame; the server now sends compressed frames
+# peers from before compression don't answer hello, and both sides keep sending plain json.
+# hello messages also list the optional protocol features each side understands (e.g. gossip's inv/getdata).
+def get_hello_message(features=[]):
+    return {
+        'type': 'hello',
+        'codecs': get_codec_names(),
+        'features': features
+    }
+
+def get_hello_reply(obj, features=[]):
+    return tag_request_id({
+        'type': 'hello',
+        'codec': select_codec_name(obj.get("codecs")),
+        'features': features
+    }, obj.get("id"))
+
+def encode_frame(payload, flags=0):
+    return FRAME_HEADER.pack(len(payload), flags) + payload
+
+def encode_payload(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# a message serialized once, for sending to many peers
+class PreparedMessage:
+    def __init__(self, obj):
+        self.payload = encode_payload(obj)
+
+# encodes a json message (or a PreparedMessage). when attachment_size is given, the header of the attachment frame
+# is appended, and the caller sends the attachment bytes right after (e.g. with socket.sendfile).
+# with a codec the payload is compressed, so the result must be sent before any later message is encoded.
+def encode_message(obj, attachment_size=None, codec=None):
+    if isinstance(obj, PreparedMessage):
+        payload = obj.payload
+    else:
+        payload = encode_payload(obj)
+
+    flags = 0
+
+    if codec is not None:
+        payload = codec.compress(payload)
+        flags |= FLAG_COMPRESSED
+
+    if attachment_size is None:
+        return encode_frame(payload, flags)
+
+    return encode_frame(payload, flags | FLAG_HAS_ATTACHMENT) + FRAME_HEADER.pack(attachment_size, FLAG_ATTACHMENT)
+
+def send_message(sock, obj, attachment=None):
+    if attachment is None:
+        sock.sendall(encode_message(obj))
+    else:
+        sock.sendall(encode_message(obj, len(attachment)))
+        sock.sendall(attachment)
+
+# incremental frame decoder. received data goes into one reusable bytearray (via recv_into),
+# and complete frames are split off it, so messages of any size and several messages per read are handled.
+class MessageDecoder:
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self._buffer = bytearray(buffer_size)
+        self._start = 0
+        self._end = 0
+        # a message whose attachment frame has not arrived yet
+        self._pending_payload = None
+        # decompresses frames flagged FLAG_COMPRESSED, once compression has been negotiated
+        self.codec = None
+
+    def _reserve(self, size):
+        # move unparsed data to the front, growing the buffer if it still doesn't fit
+        if self._end + size <= len(self._buffer):
+            return
+
+        unparsed = self._end - self._start
+
+        if unparsed + size > len(self._buffer):
+            new_buffer = bytearray(max(len(self._buffer) * 2, unparsed + size))
+            new_buffer[:unparsed] = self._buffer[self._start:self._end]
+            self._buffer = new_buffer
+        else:
+            self._buffer[:unparsed] = self._buffer[self._start:self._end]
+
+        self._start = 0
+        self._end = unparsed
+
+    # reads once from the socket and returns the complete messages received, as (payload, attachment) pairs.
+    # returns None when the connection has been closed.
+    def recv_from(self, sock):
+        if self._end == len(self._buffer):
+            self._reserve(DEFAULT_BUFFER_SIZE)
+
+        count = sock.recv_into(memoryview(self._buffer)[self._end:])
+
+        if count == 0:
+            return None
+
+        self._end += count
+
+        return self._parse()
+
+    # for transports that hand over data themselves (e.g. asyncio protocols)
+    def feed(self, data):
+        self._reserve(len(data))
+        self._buffer[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+        return self._parse()
+
+    def _parse(self):
+        messages = []
+
+        while self._end - self._start >= FRAME_HEADER.size:
+            length, flags = FRAME_HEADER.unpack_from(self._buffer, self._start)
+
+            if length > MAX_FRAME_SIZE:
+                raise FramingError("frame of {} bytes exceeds the maximum frame size".format(length))
+
+            frame_end = self._start + FRAME_HEADER.size + length
+
+            if frame_end > self._end:
+                # make sure the whole frame will fit once it arrives
+                self._reserve(FRAME_HEADER.size + length - (self._end - self._start))
+                break
+
+            payload = bytes(self._buffer[self._start + FRAME_HEADER.size:frame_end])
+            self._start = frame_end
+
+            if flags & FLAG_COMPRESSED:
+                if self.codec is None:
+                    raise FramingError("compressed frame before compression was negotiated")
+
+                # bounded like a plain frame, so a small frame can't expand without limit
+                payload = self.codec.decompress(payload, MAX_FRAME_SIZE)
+
+            if flags & FLAG_ATTACHMENT:
+                if self._pending_payload is None:
+                    raise FramingError("attachment frame without a message")
+
+                messages.append((self._pending_payload, payload))
+                self._pending_payload = None
+            elif self._pending_payload is not None:
+                raise FramingError("expected an attachment frame")
+            elif flags & FLAG_HAS_ATTACHMENT:
+                self._pending_payload = payload
+            else:
+                messages.append((payload, None))
+
+        if self._start == self._end:
+            self._start = 0
+            self._end = 0
+
+        return messages
\ No newline at end of file
@@ -2,7 +2,33 @@ from blockchain import Blockchain
 from blockchain_metadata import BlockchainMetadata
 from genesis import genesis_block
 
-metachain = Blockchain(genesis_block, genesis_block, BlockchainMetadata({
+BLOCKCHAIN_ENTRY_CONTRACT = 'vivx.network.core-metachain.BlockchainEntry'
+
+class Metachain(Blockchain):
+    def __init__(self, genesis_block, last_block, metadata):
+        # registry of subchains, identifier -> blockchain metadata, built from BlockchainEntry transactions
+        self.subchains = {}
+
+        Blockchain.__init__(self, genesis_block, last_block, metadata)
+
+        self.on_block_added(genesis_block)
+
+    def on_block_added(self, block):
+        for tx in block.tx_set.transactions:
+            if tx.contract_identifier == BLOCKCHAIN_ENTRY_CONTRACT and 'identifier' in tx.data:
+                self.subchains[tx.data['identifier']] = tx.data
+
+    def get_snapshot_state(self):
+        return {
+            'subchains': self.subchains
+        }
+
+    def restore_snapshot_state(self, state):
+        assert isinstance(state.get('subchains'), dict), 'subchains should be dict'
+
+        self.subchains = state['subchains']
+
+metachain = Metachain(genesis_block, genesis_block, BlockchainMetadata({
     'identifier': 'vivx.network.core-metachain',
     'contract-chain-identifier': 'core-metachain.Contracts',
     'version': '1',
@@ -11,14 +37,9 @@ metachain = Blockchain(genesis_block, genesis_block, BlockchainMetadata({
 }))
 #metachain.load_blocks()
 
-# TODO: Make Metachain a dervied class of Blockchain and move these methods to it
 def get_subchains():
-    for block_page in metachain.page_block_files():
-        blocks = [metachain.load_block_file(block_file_path) for block_file_path in block_page]
-        tx_sets = [block.tx_set for block in blocks]
-        txs = [tx for sublist in [tx_set.transactions for tx_set in tx_sets] for tx in sublist if tx.contract_identifier == 'vivx.network.core-metachain.BlockchainEntry']#[tx for tx in tx_set.transactions for tx_set in tx_sets]
+    return metachain.subchains
 
 def get_subchain(identifier):
     print("identifier = {}".format(identifier))
-    for block in metachain.blocks:
-        print("block = {}".format(block))
\ No newline at end of file
+    return metachain.subchains.get(str(identifier))
\ No newline at end of file
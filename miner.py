@@ -5,6 +5,7 @@ from block import Block
 from block_header import BlockHeader
 from transaction import Transaction
 from transaction_set import TransactionSet
+from transaction_pool import TransactionPool
 
 class Miner:
   def __init__(self, blockchain):
@@ -29,10 +30,12 @@ class Miner:
     
     while self.is_mining:
       print("mining")
-      block_header = BlockHeader(version='0.1-alpha')
-      current_block = Block(block_header=block_header, timestamp=int(time.time()), tx_set=self.tx_queue, prev_block_hash=self.blockchain.last_block.block_hash)
+      block_header = BlockHeader(version='0.1-alpha', target=self.blockchain.target)
+      # the best pending transactions that fit in a block; they leave the pool once the block is added
+      tx_set = TransactionSet(TransactionPool.instance.select_batch())
+      current_block = Block(block_header=block_header, timestamp=int(time.time()), tx_set=tx_set, prev_block_hash=self.blockchain.last_block.block_hash)
       try:
-        for tx in self.tx_queue:
+        for tx in tx_set.transactions:
       #    # calculate byte size
          # tx_serialized = tx.serialize()
          # tx_bytes = bytes(tx_serialized)
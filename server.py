@@ -1,5 +1,8 @@
+import os
 import socket
 import _thread
+import threading
+import queue
 import json
 import time
 import datetime
@@ -12,6 +15,18 @@ from transaction_pool import TransactionPool
 from metachain import get_subchain, metachain
 from bootstrap import NODE_HUBS, select_node_hub
 from miner import Miner
+from message_framing import MessageDecoder, PreparedMessage, encode_message, tag_request_id, get_hello_reply, create_codec
+from sync_flow import SyncWindow, SyncStalled, PageSizer, MAX_SYNC_PAGE_SIZE, get_requested_window
+from chain_header import MAX_HEADERS_PER_MESSAGE
+from gossip import INV_TX, GOSSIP_FEATURE, get_inv_messages, get_inv_response, get_getdata_responses, get_broadcast_tx, select_fanout, peer_supports_gossip
+from tx_batch import get_tx_batch_response
+from sync_workers import SyncWorkerPool, SyncBusy, BlockPageCache
+
+# clients that send nothing (not even a ping) for this long are disconnected
+CLIENT_IDLE_TIMEOUT = 30
+
+# broadcasts queued for a client beyond this are dropped for that client, so a slow client can't hold up the rest
+PEER_SEND_QUEUE_SIZE = 1024
 
 class Server:
     def __init__(self, onstatus):
@@ -19,9 +34,22 @@ class Server:
 
         self.socket = None
         self.clients = {}
+        # frames must not interleave, so each client socket has a lock held for a whole message
+        self._send_locks = {}
+        # client socket -> codec compressing what we send, once the client has finished negotiating compression
+        self._codecs = {}
+        # (client socket, request id) -> SyncWindow of each running sync stream
+        self._sync_windows = {}
+        # client socket -> queue of broadcast messages, drained by a sender thread per client
+        self._send_queues = {}
+        # client socket -> protocol features the client listed in its hello
+        self._features = {}
+        # runs get_chain_metadata streams on a fixed number of threads
+        self.sync_workers = SyncWorkerPool()
+        # serialized blocks shared between sync streams
+        self.block_cache = BlockPageCache()
         self.is_running = False
         self.node_hub = select_node_hub()
-        self._tx_queue = []
         #self.miners = [
         #    Miner(blockchain=metachain)
         #]
@@ -38,10 +66,11 @@ class Server:
             # have to get this working with public-facing addresses.
             self.inform_node_hub("http://{}:{}".format(address, port))
 
-            #_thread.start_new_thread(self.update_tx_queue, ())
             _thread.start_new_thread(self.listen_for_connections, ())
             _thread.start_new_thread(self.load_metachain, ())
 
+            self.sync_workers.start()
+
             #for miner in self.miners:
             #    miner.start_mining()
 
@@ -58,14 +87,14 @@ class Server:
 
         self.socket.close()
         self.is_running = False
+        self.sync_workers.stop()
         self.clients = {}
         self.peers = []
         
         self.onstatus("Server not running")
 
     def _queue_tx(self, tx):
-        self._tx_queue.append(tx)
-        print("Tx queued to be sent to peers: {}".format(tx.serialize()))
+        self.relay_transactions([(tx, None)])
 
     def inform_node_hub(self, address):
         assert self.node_hub is not None, "node hub not set"
@@ -87,38 +116,101 @@ class Server:
         metachain.load_blocks()
         metachain.sync_state = BlockchainSyncState.SYNCED
 
-    def update_tx_queue(self):
-        while self.is_running:
-            while len(self._tx_queue) != 0:
-                tx_obj = self._tx_queue[0]
-                tx_serialized = tx_obj.serialize()
+    # queues obj for every client (except exclude) without waiting on any of them.
+    # the message is serialized once; clients whose queue is full miss it.
+    def broadcast(self, obj, exclude=None):
+        message = PreparedMessage(obj)
+
+        for key, client_socket in list(self.clients.items()):
+            if client_socket is not exclude:
+                self.queue_message(client_socket, message)
+
+    def queue_message(self, client_socket, message):
+        send_queue = self._send_queues.get(client_socket)
+
+        if send_queue is None:
+            return
+
+        try:
+            send_queue.put_nowait(message)
+        except queue.Full:
+            print("Send queue of a client is full; dropping a message")
+
+    # gossips (transaction, source) pairs on to a random GOSSIP_FANOUT of our clients, skipping the client each came from.
+    # clients that understand inv only get the hashes, and fetch what they don't have with getdata.
+    # older clients are sent the transactions themselves.
+    def relay_transactions(self, items):
+        tx_messages = {}
+
+        for client_socket in select_fanout(list(self.clients.values())):
+            txs = [tx for tx, source in items if source is not client_socket]
+
+            if len(txs) == 0:
+                continue
+
+            if peer_supports_gossip(self._features.get(client_socket)):
+                for message in get_inv_messages(INV_TX, [tx.calc_hash() for tx in txs]):
+                    self.queue_message(client_socket, PreparedMessage(message))
 
-                for key, value in self.clients.items():
-                    value.send(json.dumps({
+                continue
+
+            for tx in txs:
+                if id(tx) not in tx_messages:
+                    tx_messages[id(tx)] = PreparedMessage({
                         'type': 'recvtx',
-                        'tx': tx_serialized
-                    }).encode('utf-8'))
+                        'tx': tx.serialize()
+                    })
 
-                self._tx_queue.pop(0)
+                self.queue_message(client_socket, tx_messages[id(tx)])
 
-            time.sleep(0.5)
+    def send_queued(self, client_socket, send_queue):
+        while True:
+            message = send_queue.get()
+
+            if message is None:
+                return
+
+            try:
+                self.send_to_client(client_socket, message)
+            except Exception as e:
+                # the connection is gone; handle_client_messages will remove the client
+                return
 
     def add_client(self, client_socket, client_address):
         assert self.is_running
 
         self.clients["%s:%s" % client_address] = client_socket
+        self._send_locks[client_socket] = threading.Lock()
+        self._send_queues[client_socket] = queue.Queue(PEER_SEND_QUEUE_SIZE)
         _thread.start_new_thread(self.handle_client_messages, (client_socket, client_address))
+        _thread.start_new_thread(self.send_queued, (client_socket, self._send_queues[client_socket]))
         # self.onstatus("Server is running ({} active connections)".format(len(self.clients)))
 
     def remove_client(self, client_socket, client_address):
         del self.clients["%s:%s" % client_address]
+        self._send_locks.pop(client_socket, None)
+        self._codecs.pop(client_socket, None)
+        self._features.pop(client_socket, None)
+
+        send_queue = self._send_queues.pop(client_socket, None)
+
+        if send_queue is not None:
+            # wake the sender thread up to exit, discarding what it hasn't sent
+            with send_queue.mutex:
+                send_queue.queue.clear()
+
+            send_queue.put_nowait(None)
+
+        for key, window in list(self._sync_windows.items()):
+            if key[0] is client_socket:
+                window.close()
         # self.onstatus("Server is running ({} active connections)".format(len(self.clients)))
 
     def listen_for_connections(self):
         while self.is_running:
             try:
                 client_socket, client_address = self.socket.accept()
-                client_socket.settimeout(2)
+                client_socket.settimeout(CLIENT_IDLE_TIMEOUT)
                 self.add_client(client_socket, client_address)
             except:
                 break
@@ -126,17 +218,40 @@ class Server:
         if self.is_running:
             self.stop()
 
+    def send_to_client(self, client_socket, obj):
+        # compressed messages must be encoded in the order they are sent
+        with self._send_locks.get(client_socket, threading.Lock()):
+            client_socket.sendall(encode_message(obj, codec=self._codecs.get(client_socket)))
+
+    # answers a client's hello; compressed frames from the client are accepted from now on
+    def negotiate_codec(self, client_socket, decoder, obj):
+        self._features[client_socket] = obj.get("features")
+
+        reply = get_hello_reply(obj, [GOSSIP_FEATURE])
+
+        self.send_to_client(client_socket, reply)
+
+        if reply['codec'] is not None:
+            decoder.codec = create_codec(reply['codec'])
+
+    # the client compresses from its hello_ack on; our side of the stream switches over with it
+    def enable_codec(self, client_socket, decoder):
+        if decoder.codec is None:
+            raise InvalidMessage("hello_ack without a negotiated codec")
+
+        with self._send_locks.get(client_socket, threading.Lock()):
+            self._codecs[client_socket] = decoder.codec
+
     def respond_to_command(self, client_socket, obj):
-        print("message: {}".format(obj))
         msg_type = obj["type"]
 
         if msg_type is None:
             raise InvalidMessage(obj)
 
         if msg_type == 'ping':
-            client_socket.send(json.dumps({
+            self.send_to_client(client_socket, tag_request_id({
                 'type': 'pong'
-            }).encode('utf-8'))
+            }, obj.get("id")))
         elif msg_type == "get_chain_metadata":
             if obj["identifier"] is None:
                 raise InvalidMessage(obj)
@@ -151,9 +266,57 @@ class Server:
             except:
                 raise InvalidMessage(obj)
 
-            _thread.start_new_thread(self.sync_blockchain_for_client, (client_socket, identifier, obj["last_block_hash"]))
+            # clients that set 'raw' get pages of stored block records instead of json
+            raw = obj.get("raw", False) is True
+
+            window = SyncWindow(get_requested_window(obj))
+            self._sync_windows[(client_socket, obj.get("id"))] = window
+
+            try:
+                self.sync_workers.submit(self.sync_blockchain_for_client, client_socket, identifier, obj["last_block_hash"], raw, obj.get("id"), window)
+            except SyncBusy as e:
+                del self._sync_windows[(client_socket, obj.get("id"))]
+                self.send_to_client(client_socket, self.get_sync_done_message(obj.get("id"), str(e)))
             #get_subchain(identifier)
 
+        elif msg_type == "get_headers":
+            identifier = self.parse_chain_identifier(obj)
+
+            if obj.get("last_block_hash") is None:
+                raise InvalidMessage(obj)
+
+            # answered by the sync workers too, so requests can't spawn threads without limit
+            try:
+                self.sync_workers.submit(self.send_headers, client_socket, identifier, obj["last_block_hash"], obj.get("count"), obj.get("id"))
+            except SyncBusy as e:
+                self.send_to_client(client_socket, self.get_sync_busy_reply(obj, e))
+
+        elif msg_type == "get_blocks":
+            identifier = self.parse_chain_identifier(obj)
+
+            if not isinstance(obj.get("start_height"), int) or obj["start_height"] < 1:
+                raise InvalidMessage(obj)
+
+            if not isinstance(obj.get("count"), int) or obj["count"] < 1:
+                raise InvalidMessage(obj)
+
+            raw = obj.get("raw", False) is True
+
+            try:
+                self.sync_workers.submit(self.send_blocks, client_socket, identifier, obj["start_height"], obj["count"], raw, obj.get("id"))
+            except SyncBusy as e:
+                self.send_to_client(client_socket, self.get_sync_busy_reply(obj, e))
+
+        elif msg_type == "sync_credit":
+            # the client has finished with some blocks of a sync stream and can take that many more
+            if not isinstance(obj.get("blocks"), int) or obj["blocks"] <= 0:
+                raise InvalidMessage(obj)
+
+            window = self._sync_windows.get((client_socket, obj.get("id")))
+
+            if window is not None:
+                window.grant(obj["blocks"])
+
         elif msg_type == "pushtx":
             print("pushtx")
             if obj["tx"] is None:
@@ -170,17 +333,9 @@ class Server:
                 print("Error deserializing tx: {}".format(e))
                 raise InvalidMessage(obj)
 
-
-            # lets have all servers connected to a set (maybe 8) other independent servers.
-            # when we broadcast a transaction to all these nodes, they will broadcast it to their connected nodes as well.
-            #for key, value in self.clients.items():
-            #    value.send({
-            #        'type': 'recvtx',
-            #        'tx': tx.serialize()
-            #    })
-                #print(key, value)
-
-            TransactionPool.instance.queue_tx(tx)
+            # the pool gossips new transactions on to a few of our clients (see relay_transactions),
+            # and they announce it to a few of theirs.
+            TransactionPool.instance.queue_tx(tx, source=client_socket)
 
             # =====
 
@@ -196,102 +351,266 @@ class Server:
                 # TODO: make address be the server's publicly accessible address
             #     hub.posttx(address="http://{}:{}".format(addr, port), tx=tx.serialize())
 
+        elif msg_type == "pushtx_batch":
+            # many transactions in one frame; they go into the pool together, and we answer with a result for each
+            response = get_tx_batch_response(TransactionPool.instance, obj, source=client_socket)
+
+            if response is None:
+                raise InvalidMessage(obj)
+
+            self.send_to_client(client_socket, response)
+
+        elif msg_type == "recvtx":
+            # a transaction we asked for with getdata
+            tx = None
+
+            try:
+                tx = Transaction.deserialize(obj["tx"])
+            except Exception as e:
+                raise InvalidMessage(obj)
+
+            TransactionPool.instance.queue_tx(tx, source=client_socket)
+
+        elif msg_type == "inv":
+            getdata = get_inv_response(TransactionPool.instance, obj, client_socket, lambda message: self.queue_message(client_socket, PreparedMessage(message)))
+
+            if getdata is not None:
+                self.send_to_client(client_socket, getdata)
+
+        elif msg_type == "getdata":
+            for message in get_getdata_responses(TransactionPool.instance, obj):
+                self.send_to_client(client_socket, message)
+
         elif msg_type == "broadcast":
-            if obj["msg"] is None:
+            # only transactions are relayed, through the pool, so clients can't push other messages to every peer
+            tx = get_broadcast_tx(obj)
+
+            if tx is None:
                 raise InvalidMessage(obj)
 
-            self.socket.sendall(obj["msg"])
+            TransactionPool.instance.queue_tx(tx, source=client_socket)
 
     def handle_client_messages(self, client_socket, client_address):
+        decoder = MessageDecoder()
+
         while self.is_running:
             try:
-                data = client_socket.recv(1024)
+                messages = decoder.recv_from(client_socket)
 
-                if (not data) or len(data) == 0:
+                if messages is None:
                     break
 
-                obj = None
+            except Exception as e:
+                break
 
+            for payload, attachment in messages:
                 try:
-                    obj = json.loads(data)
-                except:
-                    raise InvalidMessage(data)
+                    obj = None
 
-                self.respond_to_command(client_socket, obj)
+                    try:
+                        obj = json.loads(payload)
+                    except:
+                        raise InvalidMessage(payload)
 
-            except InvalidMessage as e:
-                self.onstatus(str(e))
-                continue
+                    if not isinstance(obj, dict):
+                        raise InvalidMessage(obj)
 
-            except Exception as e:
-                break
+                    # compression is set up here, where the connection's decoder is
+                    if obj.get("type") == "hello":
+                        self.negotiate_codec(client_socket, decoder, obj)
+                    elif obj.get("type") == "hello_ack":
+                        self.enable_codec(client_socket, decoder)
+                    else:
+                        self.respond_to_command(client_socket, obj)
+
+                except InvalidMessage as e:
+                    self.onstatus(str(e))
 
         self.remove_client(client_socket, client_address)
 
-    def sync_blockchain_for_client(self, client_socket, identifier, last_block_hash=None):
-        # TODO: assert that this node responds to that blockchain.
-        # check if the blockchain exists locally, and verify with other peers.
-        # if it does not exist locally, we have to sync in here, first.
-        self.onstatus("Sync requested for blockchain with identifier {}".format(identifier))
+    # sends the stored records of up to count blocks as a recvblockpage_raw message with the raw bytes as its attachment.
+    # the bytes go from the segment files to the socket without building Block objects.
+    def send_raw_block_page(self, client_socket, blockchain, start_height, count, request_id=None):
+        ranges = blockchain.get_record_ranges(start_height, count)
+        size = sum([end - start for segment, start, end in ranges])
+
+        with self._send_locks.get(client_socket, threading.Lock()):
+            client_socket.sendall(encode_message(tag_request_id({
+                'type': 'recvblockpage_raw'
+            }, request_id), attachment_size=size, codec=self._codecs.get(client_socket)))
+
+            for segment, start, end in ranges:
+                if hasattr(os, 'sendfile'):
+                    with open(blockchain.block_store.get_segment_path(segment), 'rb') as segment_file:
+                        client_socket.sendfile(segment_file, start, end - start)
+                else:
+                    client_socket.sendall(blockchain.block_store.get_segment_view(segment, start, end))
+
+    # index (for page_blocks) of the first block a client whose chain ends at last_block_hash is missing
+    def get_sync_start_index(self, blockchain, last_block_hash):
+        if last_block_hash is None:
+            return 0
+
+        last_block_height = blockchain.get_block_height(last_block_hash)
+
+        if last_block_height is None:
+            # possible fork has occurred, last block hash given by client and metachain should be in sync at this point.
+            raise Exception("possible fork occurred: last block hash given by client ({}) not found after sync. \
+                   The fork may have occurred from the client side or from the source that the blocks were synced from previously.".format(last_block_hash))
+
+        # page indices start at height 1, so the block after last_block_height is at that index
+        return last_block_height
+
+    def parse_chain_identifier(self, obj):
+        if obj.get("identifier") is None:
+            raise InvalidMessage(obj)
 
-        if identifier == metachain.get_identifier():
-            print("metachain sync requested...")
+        try:
+            return ObjectIdentifier.parse(obj["identifier"])
+        except:
+            raise InvalidMessage(obj)
 
-            assert metachain.sync_state != BlockchainSyncState.UNSYNCED, "metachain sync state should not be UNSYNCED, sync should have started previously"
+    # the chain served for identifier, or None if it is not available (yet)
+    def get_served_chain(self, identifier):
+        # TODO: serve other blockchains than the metachain
+        if identifier != metachain.get_identifier() or metachain.sync_state != BlockchainSyncState.SYNCED:
+            return None
 
-            if metachain.sync_state == BlockchainSyncState.SYNCING:
-                print("sync is currently in progress. waiting...")
+        return metachain
 
-            # poll until it is synced
-            while metachain.sync_state != BlockchainSyncState.SYNCED:
-                print("waiting...")
-                time.sleep(0.5)
+    # the headers of (up to count of) the blocks after last_block_hash, as a recvheaders message.
+    # clients fetch and check these before downloading the blocks themselves.
+    def get_headers_message(self, identifier, last_block_hash, count, request_id=None):
+        obj = tag_request_id({
+            'type': 'recvheaders'
+        }, request_id)
 
-            # TODO: ensure sync state is OK.
+        blockchain = self.get_served_chain(identifier)
 
-            # feed each block to the client
-            start_index = 0
-            page_size = 10
+        if blockchain is None:
+            obj['error'] = "blockchain {} is not available".format(identifier)
+            return obj
 
-            if last_block_hash is not None:
-                start_index = -1
+        if not isinstance(count, int) or count < 1 or count > MAX_HEADERS_PER_MESSAGE:
+            count = MAX_HEADERS_PER_MESSAGE
 
-                # find block with hash - TODO: optimize this!
-                counter = 0
+        try:
+            start_index = self.get_sync_start_index(blockchain, last_block_hash)
+        except Exception as e:
+            obj['error'] = str(e)
+            return obj
 
-                for block_page in metachain.page_block_files(pagesize=page_size):
-                    block_hashes = list(map(lambda block_file_path: metachain.load_block_file(block_file_path).block_hash, block_page))
-                    hash_index = block_hashes.index(last_block_hash)
+        obj['headers'] = [header.serialize() for header in blockchain.get_headers(start_index + 1, count)]
 
-                    if hash_index is not None:
-                        start_index = counter + hash_index + 1
-                        break
-                    else:
-                        counter += page_size
+        return obj
 
-                if counter > 0 and start_index == -1:
-                    # possible fork has occurred, last block hash given by client and metachain should be in sync at this point.
-                    raise "possible fork occurred: last block hash given by client ({}) not found after sync. \
-                           The fork may have occurred from the client side or from the source that the blocks were synced from previously.".format(last_block_hash)
+    def send_headers(self, client_socket, identifier, last_block_hash, count, request_id=None):
+        self.send_to_client(client_socket, self.get_headers_message(identifier, last_block_hash, count, request_id))
 
-            print("start_index = {}".format(start_index))
+    # answers a get_blocks request with one page holding the blocks at start_height and after
+    def send_blocks(self, client_socket, identifier, start_height, count, raw, request_id=None):
+        blockchain = self.get_served_chain(identifier)
+        serialized_blocks = []
 
-            # TODO: Find a way to cache this data
+        if blockchain is not None:
+            count = min(count, MAX_SYNC_PAGE_SIZE)
 
-            for block_page in metachain.page_block_files(start=start_index // page_size, pagesize=page_size):
-                block_page_start_index = start_index - ((start_index // page_size) * page_size)
-                serialized_blocks = []
+            if raw:
+                self.send_raw_block_page(client_socket, blockchain, start_height, count, request_id)
+                return
 
-                for block in block_page[block_page_start_index:]:
-                    serialized_blocks.append(metachain.load_block_file(block).serialize())
+            serialized_blocks = self.block_cache.get_page(blockchain, start_height - 1, count)
 
-                if len(serialized_blocks) == 0:
-                    print("No blocks to send - client is in sync")
-                    break
+        self.send_to_client(client_socket, tag_request_id({
+            'type': 'recvblockpage',
+            'blockpage': serialized_blocks
+        }, request_id))
+
+    # the answer to a get_headers or get_blocks request turned away because too many sync requests are waiting
+    def get_sync_busy_reply(self, obj, error):
+        if obj["type"] == "get_headers":
+            reply = {
+                'type': 'recvheaders'
+            }
+        else:
+            reply = {
+                'type': 'recvblockpage',
+                'blockpage': []
+            }
 
-                client_socket.send(json.dumps({
-                    'type': 'recvblockpage',
-                    'blockpage': serialized_blocks
-                }).encode('utf-8'))
+        reply['error'] = str(error)
 
-                time.sleep(2)
\ No newline at end of file
+        return tag_request_id(reply, obj.get("id"))
+
+    # a sync ends with a syncdone message, so clients know when a request has been fully answered
+    def get_sync_done_message(self, request_id, error=None):
+        obj = tag_request_id({
+            'type': 'syncdone'
+        }, request_id)
+
+        if error is not None:
+            obj['error'] = error
+
+        return obj
+
+    def sync_blockchain_for_client(self, client_socket, identifier, last_block_hash=None, raw=False, request_id=None, window=None):
+        # TODO: assert that this node responds to that blockchain.
+        # check if the blockchain exists locally, and verify with other peers.
+        # if it does not exist locally, we have to sync in here, first.
+        if window is None:
+            window = SyncWindow(None)
+
+        try:
+            # queued while the client went away
+            if window.closed:
+                return
+
+            self.onstatus("Sync requested for blockchain with identifier {}".format(identifier))
+
+            if identifier == metachain.get_identifier():
+                print("metachain sync requested...")
+
+                if metachain.sync_state != BlockchainSyncState.SYNCED:
+                    print("sync is currently in progress. waiting...")
+
+                # load_metachain sets the state when it has finished
+                metachain.wait_until_synced()
+
+                # TODO: ensure sync state is OK.
+
+                # feed each block to the client
+                try:
+                    start_index = self.get_sync_start_index(metachain, last_block_hash)
+                except Exception as e:
+                    self.send_to_client(client_socket, self.get_sync_done_message(request_id, str(e)))
+                    raise e
+
+                print("start_index = {}".format(start_index))
+
+                # pages are streamed as fast as the client's window allows, sized to the observed throughput
+                page_sizer = PageSizer()
+                page_start = start_index
+
+                try:
+                    while page_start < len(metachain.block_index):
+                        started = time.time()
+                        count = window.take(min(page_sizer.page_size, len(metachain.block_index) - page_start))
+
+                        if raw:
+                            self.send_raw_block_page(client_socket, metachain, page_start + 1, count, request_id)
+                        else:
+                            self.send_to_client(client_socket, tag_request_id({
+                                'type': 'recvblockpage',
+                                'blockpage': self.block_cache.get_page(metachain, page_start, count)
+                            }, request_id))
+
+                        page_start += count
+                        page_sizer.record(count, time.time() - started)
+                except SyncStalled as e:
+                    self.send_to_client(client_socket, self.get_sync_done_message(request_id, str(e)))
+                    return
+
+                self.send_to_client(client_socket, self.get_sync_done_message(request_id))
+        finally:
+            if self._sync_windows.get((client_socket, request_id)) is window:
+                del self._sync_windows[(client_socket, request_id)]
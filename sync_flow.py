@@ -0,0 +1,139 @@
+import asyncio
+import threading
+
+# flow control for block sync streams.
+# a client asks for blocks with a window: the number of blocks it is willing to have in flight.
+# the server streams pages while it has window left, and the client hands the window back
+# (with a sync_credit message) as it finishes adding each page.
+
+# window used by our clients when requesting a sync
+DEFAULT_SYNC_WINDOW = 2000 # blocks
+
+MIN_SYNC_PAGE_SIZE = 10
+MAX_SYNC_PAGE_SIZE = 1000
+
+# page sizes are adjusted so that sending a page takes about this long at the observed throughput
+SYNC_PAGE_TARGET_TIME = 0.5 # seconds
+
+# weight of the latest page when smoothing the observed throughput
+THROUGHPUT_SMOOTHING = 0.25
+
+# a sync stalled on credit for this long is abandoned
+SYNC_CREDIT_TIMEOUT = 60 # seconds
+
+class SyncStalled(Exception):
+    pass
+
+# the window a sync request asks for, or None if it did not ask for flow control
+def get_requested_window(obj):
+    window = obj.get("window")
+
+    if isinstance(window, int) and not isinstance(window, bool) and window > 0:
+        return window
+
+    return None
+
+def get_credit_message(request_id, block_count):
+    return {
+        'type': 'sync_credit',
+        'id': request_id,
+        'blocks': block_count
+    }
+
+# picks the size of the next page from the throughput (blocks per second) of the previous ones.
+# the time a page takes includes waiting for credit, so a slow client shrinks pages as well as a slow link.
+class PageSizer:
+    def __init__(self, page_size=MIN_SYNC_PAGE_SIZE):
+        self.page_size = page_size
+        # smoothed blocks per second
+        self.throughput = None
+
+    def record(self, block_count, elapsed):
+        if block_count == 0:
+            return
+
+        throughput = block_count / max(elapsed, 0.001)
+
+        if self.throughput is None:
+            self.throughput = throughput
+        else:
+            self.throughput = (1 - THROUGHPUT_SMOOTHING) * self.throughput + THROUGHPUT_SMOOTHING * throughput
+
+        # grow at most 2x per page so one fast page doesn't overshoot
+        page_size = min(int(self.throughput * SYNC_PAGE_TARGET_TIME), self.page_size * 2)
+
+        self.page_size = max(MIN_SYNC_PAGE_SIZE, min(page_size, MAX_SYNC_PAGE_SIZE))
+
+# the window of one sync stream, shared by the thread sending pages and the thread receiving credit.
+# a window of None means the client did not ask for flow control.
+class SyncWindow:
+    def __init__(self, window):
+        self.window = window
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def grant(self, block_count):
+        with self._cond:
+            if self.window is not None:
+                self.window += block_count
+
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    # waits until there is window left and takes up to wanted blocks of it; returns how many were taken
+    def take(self, wanted, timeout=SYNC_CREDIT_TIMEOUT):
+        with self._cond:
+            if self.window is None:
+                return wanted
+
+            if not self._cond.wait_for(lambda: self.window > 0 or self.closed, timeout):
+                raise SyncStalled("no sync credit received for {}s".format(timeout))
+
+            if self.closed:
+                raise SyncStalled("sync stream closed")
+
+            taken = min(wanted, self.window)
+            self.window -= taken
+
+            return taken
+
+# SyncWindow for streams served from an asyncio event loop; only used from the loop's thread
+class AsyncSyncWindow:
+    def __init__(self, window):
+        self.window = window
+        self.closed = False
+        self._event = asyncio.Event()
+
+    def grant(self, block_count):
+        if self.window is not None:
+            self.window += block_count
+
+        self._event.set()
+
+    def close(self):
+        self.closed = True
+        self._event.set()
+
+    async def take(self, wanted, timeout=SYNC_CREDIT_TIMEOUT):
+        if self.window is None:
+            return wanted
+
+        while self.window <= 0 and not self.closed:
+            self._event.clear()
+
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise SyncStalled("no sync credit received for {}s".format(timeout))
+
+        if self.closed:
+            raise SyncStalled("sync stream closed")
+
+        taken = min(wanted, self.window)
+        self.window -= taken
+
+        return taken
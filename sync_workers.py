@@ -0,0 +1,136 @@
+import _thread
+import threading
+import queue
+from collections import OrderedDict
+
+# sync streams served at once; further requests wait in the queue for a free worker
+SYNC_WORKERS = 8
+
+# sync requests waiting for a worker before new ones are turned away
+SYNC_QUEUE_SIZE = 64
+
+# serialized blocks are cached in aligned chunks of this many heights
+BLOCK_CHUNK_SIZE = 100
+
+# chunks kept in the block page cache
+BLOCK_CACHE_CHUNKS = 64
+
+class SyncBusy(Exception):
+    pass
+
+# a fixed set of worker threads running queued sync requests.
+# submit fails with SyncBusy once SYNC_QUEUE_SIZE requests are waiting, instead of spawning ever more threads.
+class SyncWorkerPool:
+    def __init__(self, workers=SYNC_WORKERS, queue_size=SYNC_QUEUE_SIZE):
+        self.workers = workers
+        self.is_running = False
+        self._queue = queue.Queue(queue_size)
+
+    def start(self):
+        assert not self.is_running
+
+        self.is_running = True
+
+        for i in range(self.workers):
+            _thread.start_new_thread(self._work, ())
+
+    def stop(self):
+        self.is_running = False
+
+        # wake every worker up to exit; requests still queued are dropped
+        with self._queue.mutex:
+            self._queue.queue.clear()
+
+        for i in range(self.workers):
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def submit(self, fn, *args):
+        try:
+            self._queue.put_nowait((fn, args))
+        except queue.Full:
+            raise SyncBusy("too many sync requests are waiting; try again later")
+
+    def _work(self):
+        while self.is_running:
+            job = self._queue.get()
+
+            if job is None:
+                return
+
+            fn, args = job
+
+            try:
+                fn(*args)
+            except Exception as e:
+                print("Sync worker failed: {}".format(e))
+
+# serialized blocks shared by every sync stream, so clients syncing the same range
+# read and serialize each block once. chunks being loaded are waited for rather than loaded again.
+class BlockPageCache:
+    def __init__(self, max_chunks=BLOCK_CACHE_CHUNKS, chunk_size=BLOCK_CHUNK_SIZE):
+        self.max_chunks = max_chunks
+        self.chunk_size = chunk_size
+
+        # (chain identifier, chunk index) -> list of serialized blocks; only full chunks are kept
+        self._chunks = OrderedDict()
+        # (chain identifier, chunk index) -> threading.Event set when the chunk has been loaded
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    # the serialized blocks at page index start_index (height start_index + 1) and after, up to count
+    def get_page(self, blockchain, start_index, count):
+        end_index = min(start_index + count, len(blockchain.block_index))
+        page = []
+
+        for chunk_index in range(start_index // self.chunk_size, (end_index - 1) // self.chunk_size + 1):
+            chunk_start = chunk_index * self.chunk_size
+            chunk = self._get_chunk(blockchain, chunk_index)
+
+            page.extend(chunk[max(start_index - chunk_start, 0):end_index - chunk_start])
+
+        return page
+
+    def _get_chunk(self, blockchain, chunk_index):
+        key = (str(blockchain.get_identifier()), chunk_index)
+
+        while True:
+            with self._lock:
+                chunk = self._chunks.get(key)
+
+                if chunk is not None:
+                    self._chunks.move_to_end(key)
+                    return chunk
+
+                loading = self._loading.get(key)
+
+                if loading is None:
+                    loading = threading.Event()
+                    self._loading[key] = loading
+                    break
+
+            # another stream is loading it
+            loading.wait()
+
+        chunk = []
+
+        try:
+            for block_page in blockchain.page_blocks(start=chunk_index * self.chunk_size, pagesize=self.chunk_size):
+                chunk = [block.serialize() for block in block_page]
+                break
+        finally:
+            with self._lock:
+                # the chunk at the chain tip may still grow, so it is not kept
+                if len(chunk) == self.chunk_size:
+                    self._chunks[key] = chunk
+
+                    if len(self._chunks) > self.max_chunks:
+                        self._chunks.popitem(last=False)
+
+                del self._loading[key]
+
+            loading.set()
+
+        return chunk
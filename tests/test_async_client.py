@@ -0,0 +1,163 @@
+import asyncio
+import json
+
+import pytest
+
+# async_client shares constants with the server, which reports to node hubs over http
+pytest.importorskip('requests')
+
+import async_client
+from async_client import AsyncClient, AsyncConnection, parse_peer_address
+from message_framing import MessageDecoder, encode_message
+
+# runs test(connection, requests) with an AsyncConnection to a server that passes each request,
+# and a function sending it a reply, to answer(request, reply)
+def run_connection(test, answer):
+    async def main():
+        async def handle(reader, writer):
+            decoder = MessageDecoder()
+
+            def reply(obj):
+                writer.write(encode_message(obj))
+
+            while True:
+                data = await reader.read(65536)
+
+                if not data:
+                    break
+
+                for payload, attachment in decoder.feed(data):
+                    answer(json.loads(payload), reply)
+
+            writer.close()
+
+        listener = await asyncio.start_server(handle, '127.0.0.1', 0)
+        connection = AsyncConnection(asyncio.get_running_loop())
+
+        await connection.open('127.0.0.1', listener.sockets[0].getsockname()[1])
+        listener_task = asyncio.get_running_loop().create_task(connection.listen())
+
+        try:
+            await test(connection)
+        finally:
+            connection.close()
+            listener.close()
+            await listener_task
+
+    asyncio.run(main())
+
+def test_parse_peer_address():
+    assert parse_peer_address('http://10.0.0.1:8090/') == ('10.0.0.1', 8090)
+    assert parse_peer_address('10.0.0.1:8090') == ('10.0.0.1', 8090)
+    assert parse_peer_address(['10.0.0.1', 8090]) == ('10.0.0.1', 8090)
+    assert parse_peer_address('10.0.0.1') is None
+    assert parse_peer_address(None) is None
+
+# responses are matched to requests by id, whatever order they come back in
+def test_pipelined_requests_get_their_own_responses():
+    held = []
+
+    def answer(obj, reply):
+        held.append((obj, reply))
+
+        if len(held) == 3:
+            for request, send in reversed(held):
+                send({ 'type': 'pong', 'id': request['id'], 'value': request['value'] })
+
+    async def test(connection):
+        responses = await asyncio.gather(*[connection.request({ 'type': 'ping', 'value': i }, timeout=5) for i in range(0, 3)])
+
+        assert [obj['value'] for obj, attachment in responses] == [0, 1, 2]
+
+    run_connection(test, answer)
+
+def test_streamed_request_ends_at_syncdone():
+    def answer(obj, reply):
+        for i in range(0, 3):
+            reply({ 'type': 'recvblockpage', 'id': obj['id'], 'blockpage': [i] })
+
+        reply({ 'type': 'syncdone', 'id': obj['id'] })
+
+    async def test(connection):
+        pages = [obj['blockpage'] async for request_id, obj, attachment in connection.request_stream({ 'type': 'get_chain_metadata' })]
+
+        assert pages == [[0], [1], [2]]
+
+    run_connection(test, answer)
+
+def test_stream_error_is_raised():
+    def answer(obj, reply):
+        reply({ 'type': 'syncdone', 'id': obj['id'], 'error': 'busy' })
+
+    async def test(connection):
+        with pytest.raises(Exception, match='busy'):
+            async for response in connection.request_stream({ 'type': 'get_chain_metadata' }):
+                pass
+
+    run_connection(test, answer)
+
+def test_outstanding_requests_fail_when_the_connection_closes():
+    def answer(obj, reply):
+        pass
+
+    async def test(connection):
+        request = asyncio.ensure_future(connection.request({ 'type': 'ping' }))
+        stream = connection.request_stream({ 'type': 'get_chain_metadata' })
+        streamed = asyncio.ensure_future(stream.__anext__())
+
+        await asyncio.sleep(0.05)
+        connection.close()
+
+        with pytest.raises(asyncio.CancelledError):
+            await request
+
+        with pytest.raises(ConnectionError):
+            await streamed
+
+    run_connection(test, answer)
+
+def make_client(connection, statuses):
+    client = AsyncClient({ 'onstatus': statuses.append })
+    client.loop = asyncio.get_running_loop()
+    client.connection = connection
+    client.is_connected = True
+
+    return client
+
+def test_keepalive_interval_backs_off_while_pongs_are_prompt(monkeypatch):
+    monkeypatch.setattr(async_client, 'KEEPALIVE_MIN_INTERVAL', 0.01)
+    monkeypatch.setattr(async_client, 'KEEPALIVE_MAX_INTERVAL', 0.04)
+
+    def answer(obj, reply):
+        reply({ 'type': 'pong', 'id': obj['id'] })
+
+    async def test(connection):
+        client = make_client(connection, [])
+        keepalive = asyncio.get_running_loop().create_task(client.keepalive())
+
+        await asyncio.sleep(0.5)
+
+        assert client.keepalive_interval == 0.04
+        assert client.rtt is not None
+
+        client.is_connected = False
+        await keepalive
+
+    run_connection(test, answer)
+
+def test_unanswered_ping_disconnects(monkeypatch):
+    monkeypatch.setattr(async_client, 'KEEPALIVE_MIN_INTERVAL', 0.01)
+    monkeypatch.setattr(async_client, 'KEEPALIVE_TIMEOUT', 0.05)
+
+    def answer(obj, reply):
+        pass
+
+    async def test(connection):
+        statuses = []
+        client = make_client(connection, statuses)
+
+        await asyncio.wait_for(client.keepalive(), 5)
+
+        assert len(statuses) == 1
+
+    run_connection(test, answer)
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+# the server reports to node hubs over http
+pytest.importorskip('requests')
+
+import async_server
+import server as server_module
+from async_server import AsyncServer
+from message_framing import MessageDecoder, encode_message
+from transaction import Transaction
+from transaction_pool import TransactionPool
+from object_identifier import ObjectIdentifier
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(server_module, 'select_node_hub', lambda: None)
+    monkeypatch.setattr(TransactionPool, 'instance', TransactionPool.TransactionPoolSingleton(None, None))
+
+    return TransactionPool.instance
+
+class Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.decoder = MessageDecoder()
+        self.messages = []
+
+    def send(self, obj):
+        self.writer.write(encode_message(obj))
+
+    async def receive(self, timeout=5):
+        while len(self.messages) == 0:
+            data = await asyncio.wait_for(self.reader.read(65536), timeout)
+
+            assert data, 'connection closed'
+
+            self.messages += [json.loads(payload) for payload, attachment in self.decoder.feed(data)]
+
+        return self.messages.pop(0)
+
+# runs test(server, connect) against an AsyncServer listening on a free port of this loop
+def run_server(test):
+    statuses = []
+
+    async def main():
+        server = AsyncServer(onstatus=statuses.append)
+        server.loop = asyncio.get_running_loop()
+        server.is_running = True
+
+        listener = await asyncio.start_server(server.handle_peer, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+
+        async def connect():
+            return Connection(*await asyncio.open_connection('127.0.0.1', port))
+
+        try:
+            await test(server, connect)
+        finally:
+            server.is_running = False
+            listener.close()
+
+    asyncio.run(main())
+
+    return statuses
+
+def test_peers_are_served_concurrently(pool):
+    async def test(server, connect):
+        peers = [await connect() for i in range(0, 20)]
+
+        for i, peer in enumerate(peers):
+            peer.send({ 'type': 'ping', 'id': i })
+
+        for i, peer in enumerate(peers):
+            assert await peer.receive() == { 'type': 'pong', 'id': i }
+
+        assert len(server.clients) == 20
+
+    run_server(test)
+
+def test_unknown_messages_are_reported(pool):
+    async def test(server, connect):
+        peer = await connect()
+        peer.send({ 'type': 'nonsense' })
+        peer.send({ 'type': 'ping' })
+
+        assert await peer.receive() == { 'type': 'pong' }
+
+    assert len(run_server(test)) == 1
+
+def test_broadcast_only_relays_transactions(pool):
+    tx = Transaction(ObjectIdentifier.parse('vivx.network.core-metachain'), { 'value': 1 }, 100)
+
+    async def test(server, connect):
+        sender, other = await connect(), await connect()
+
+        sender.send({ 'type': 'broadcast', 'msg': { 'type': 'updatepeers', 'peers': ['10.0.0.1:8090'] } })
+        sender.send({ 'type': 'broadcast', 'msg': { 'type': 'recvtx', 'tx': tx.serialize() } })
+        sender.send({ 'type': 'ping' })
+
+        assert await sender.receive() == { 'type': 'pong' }
+
+        with pytest.raises(asyncio.TimeoutError):
+            await other.receive(timeout=0.2)
+
+    statuses = run_server(test)
+
+    assert len(statuses) == 1
+    assert [queued.calc_hash() for queued, source in pool.tx_queue] == [tx.calc_hash()]
+
+# get_headers and get_blocks share the sync streams' limit of SYNC_WORKERS running and SYNC_QUEUE_SIZE waiting
+def test_header_and_block_requests_are_bounded(pool, monkeypatch):
+    monkeypatch.setattr(async_server, 'SYNC_WORKERS', 1)
+    monkeypatch.setattr(async_server, 'SYNC_QUEUE_SIZE', 1)
+
+    release = threading.Event()
+
+    def get_headers_message(identifier, last_block_hash, count, request_id=None):
+        release.wait(5)
+
+        return { 'type': 'recvheaders', 'id': request_id, 'headers': [] }
+
+    async def test(server, connect):
+        monkeypatch.setattr(server, 'get_headers_message', get_headers_message)
+
+        peer = await connect()
+
+        for i in range(0, 2):
+            peer.send({ 'type': 'get_headers', 'identifier': 'vivx.network.core-metachain', 'last_block_hash': '0', 'id': i })
+
+        peer.send({ 'type': 'get_blocks', 'identifier': 'vivx.network.core-metachain', 'start_height': 1, 'count': 10, 'id': 2 })
+
+        busy = await peer.receive()
+
+        assert busy['id'] == 2
+        assert busy['type'] == 'recvblockpage' and busy['blockpage'] == [] and 'error' in busy
+
+        release.set()
+
+        assert sorted([(await peer.receive())['id'] for i in range(0, 2)]) == [0, 1]
+
+        await asyncio.sleep(0.05)
+
+        assert server._sync_requests == 0
+
+    run_server(test)
@@ -0,0 +1,58 @@
+import pytest
+
+from binary_codec import BinaryWriter, BinaryReader
+
+@pytest.mark.parametrize('value', [0, 1, 127, 128, 300, 2 ** 32, 2 ** 64 + 5])
+def test_uint_round_trip(value):
+    writer = BinaryWriter()
+    writer.write_uint(value)
+
+    reader = BinaryReader(writer.getvalue())
+
+    assert reader.read_uint() == value
+    assert reader.at_end()
+
+def test_uint_is_compact():
+    writer = BinaryWriter()
+    writer.write_uint(127)
+    writer.write_uint(128)
+
+    assert writer.getvalue() == b'\x7f\x80\x01'
+
+def test_negative_uint_is_rejected():
+    with pytest.raises(AssertionError):
+        BinaryWriter().write_uint(-1)
+
+def test_strings_and_bytes():
+    writer = BinaryWriter()
+    writer.write_str('vivx ✓')
+    writer.write_bytes(b'\x00\x01')
+
+    reader = BinaryReader(writer.getvalue())
+
+    assert reader.read_str() == 'vivx ✓'
+    assert reader.read_bytes() == b'\x00\x01'
+    assert reader.at_end()
+
+@pytest.mark.parametrize('value', ['ab' * 32, '0', '', 'ABCD', 'abc'])
+def test_hash_round_trip(value):
+    writer = BinaryWriter()
+    writer.write_hash(value)
+
+    assert BinaryReader(writer.getvalue()).read_hash() == value
+
+def test_hex_hash_is_stored_raw():
+    writer = BinaryWriter()
+    writer.write_hash('ab' * 32)
+
+    assert len(writer.getvalue()) == 33
+
+def test_truncated_data_is_an_error():
+    writer = BinaryWriter()
+    writer.write_str('hello')
+
+    with pytest.raises(AssertionError):
+        BinaryReader(writer.getvalue()[:-1]).read_str()
+
+    with pytest.raises(AssertionError):
+        BinaryReader(b'\x80').read_uint()
@@ -0,0 +1,68 @@
+import pytest
+
+import block as block_module
+from block import Block
+from block_header import BlockHeader, MAX_TARGET
+from transaction import Transaction
+from transaction_set import TransactionSet
+from object_identifier import ObjectIdentifier
+
+def make_block(target=MAX_TARGET, txs=None):
+    if txs is None:
+        txs = [Transaction(ObjectIdentifier.parse('vivx.network.core-metachain'), { 'value': i, 'name': 'tx ✓' }, 100 + i) for i in range(0, 3)]
+
+    return Block(block_header=BlockHeader(version='0.1-alpha', target=target), timestamp=1000, tx_set=TransactionSet(txs), prev_block_hash='cd' * 32)
+
+def test_solved_block_meets_its_target():
+    block = make_block(target=MAX_TARGET >> 8)
+    block.solve(workers=1)
+
+    assert block.meets_target()
+    assert block.calc_hash() == block.block_hash
+    assert block.verify()
+
+# the parallel search hands out nonce ranges in order, so it finds the same (lowest) nonce as the serial one
+@pytest.mark.parametrize('chunk_size', [16, block_module.SOLVE_CHUNK_SIZE])
+def test_parallel_solve_matches_serial(monkeypatch, chunk_size):
+    monkeypatch.setattr(block_module, 'SOLVE_CHUNK_SIZE', chunk_size)
+
+    serial = make_block(target=MAX_TARGET >> 10)
+    serial.solve(workers=1)
+
+    parallel = make_block(target=MAX_TARGET >> 10)
+    parallel.solve(workers=2)
+
+    assert (parallel.nonce, parallel.block_hash) == (serial.nonce, serial.block_hash)
+
+def test_solved_block_is_not_solved_again():
+    block = make_block()
+    block.solve(workers=1)
+
+    with pytest.raises(AssertionError):
+        block.solve(workers=1)
+
+def test_binary_round_trip():
+    block = make_block()
+    block.solve(workers=1)
+
+    decoded = Block.from_bytes(block.to_bytes())
+
+    assert decoded.serialize() == block.serialize()
+    assert decoded.calc_hash() == block.block_hash
+
+def test_legacy_header_round_trip():
+    block = make_block(target=None, txs=[])
+    block.nonce = 0
+    block.block_hash = block.calc_hash()
+
+    decoded = Block.from_bytes(block.to_bytes())
+
+    assert decoded.block_header.target is None
+    assert decoded.serialize() == block.serialize()
+
+def test_trailing_data_is_rejected():
+    block = make_block()
+    block.solve(workers=1)
+
+    with pytest.raises(AssertionError):
+        Block.from_bytes(block.to_bytes() + b'\x00')
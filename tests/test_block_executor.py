@@ -0,0 +1,85 @@
+import pytest
+
+from block_executor import BlockExecutor, group_independent, get_contract_args
+from bytecode import Bytecode, PackedBytecode
+from contract import Contract
+from instruction import Instruction, Opcode, Value, ValueType
+from object_identifier import ObjectIdentifier
+from transaction import Transaction
+
+ADD = Bytecode([Instruction(Opcode.ADD)])
+POP = Bytecode([Instruction(Opcode.POP)])
+
+def make_contracts():
+    return {
+        'vivx.network.add': Contract('add', None, ADD),
+        'vivx.network.pop': Contract('pop', None, PackedBytecode.pack(POP))
+    }
+
+def make_tx(contract, data, timestamp=100):
+    return Transaction(ObjectIdentifier.parse(contract), data, timestamp)
+
+def stack_of(result):
+    return [(value.value_type, value.data) for value in result.stack]
+
+def data_of(result):
+    return [value.data for value in result.stack]
+
+@pytest.mark.parametrize('args, expected', [
+    ([1, 2], 3),
+    ([1.5, 2], 3.5),
+    ([1.5, 2.25], 3.75)
+])
+def test_arithmetic_on_args(args, expected):
+    contracts = make_contracts()
+    result = make_tx('vivx.network.add', { 'args': args }).execute_contract(contracts['vivx.network.add'])
+
+    assert result.ok, result.error
+    assert data_of(result) == [expected]
+    assert result.gas_used > 0
+
+def test_string_args_are_strings():
+    result = make_tx('vivx.network.add', { 'args': ['a', 'b'] }).execute_contract(make_contracts()['vivx.network.add'])
+
+    assert not result.ok
+    assert 'numeric' in result.error
+
+def test_unsupported_args_are_rejected():
+    with pytest.raises(AssertionError):
+        get_contract_args(make_tx('vivx.network.add', { 'args': [None] }))
+
+def test_results_in_block_order():
+    txs = [
+        make_tx('vivx.network.add', { 'args': [1, 2] }, 1),
+        make_tx('vivx.network.pop', {}, 2),
+        make_tx('vivx.network.missing', {}, 3),
+        make_tx('vivx.network.add', { 'args': [3, 4] }, 4)
+    ]
+
+    results = BlockExecutor(make_contracts(), workers=1).execute_transactions(txs)
+
+    assert [result.tx_hash for result in results] == [tx.calc_hash() for tx in txs]
+    assert data_of(results[0]) == [3]
+    assert results[1].error is not None
+    assert results[2].error.startswith('no contract')
+    assert data_of(results[3]) == [7]
+
+def test_parallel_matches_serial():
+    txs = [make_tx('vivx.network.add', { 'args': [i, i], 'state_keys': ['k{}'.format(i % 5)] }, i) for i in range(0, 100)]
+
+    serial = BlockExecutor(make_contracts(), workers=1).execute_transactions(txs)
+
+    with BlockExecutor(make_contracts(), workers=2) as executor:
+        parallel = executor.execute_transactions(txs)
+
+    assert [stack_of(result) for result in parallel] == [stack_of(result) for result in serial]
+
+def test_group_independent():
+    txs = [
+        make_tx('vivx.network.add', { 'state_keys': ['a'] }, 1),
+        make_tx('vivx.network.add', { 'state_keys': ['b'] }, 2),
+        make_tx('vivx.network.add', { 'state_keys': ['a', 'c'] }, 3),
+        make_tx('vivx.network.add', { 'state_keys': ['c'] }, 4)
+    ]
+
+    assert group_independent(txs) == [[0, 2, 3], [1]]
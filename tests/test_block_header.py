@@ -0,0 +1,21 @@
+import pytest
+
+from block_header import BlockHeader, MAX_TARGET, LEGACY_TARGET
+
+def test_legacy_header_has_no_target():
+    header = BlockHeader(version='0.1-alpha')
+
+    assert 'target' not in header.serialize()
+    assert header.get_target() == LEGACY_TARGET
+    assert BlockHeader.deserialize(header.serialize()).target is None
+
+def test_target_round_trip():
+    header = BlockHeader(version='0.1-alpha', target=MAX_TARGET >> 3)
+
+    assert BlockHeader.deserialize(header.serialize()).get_target() == MAX_TARGET >> 3
+    assert header.calc_hash() != BlockHeader(version='0.1-alpha', target=MAX_TARGET >> 4).calc_hash()
+
+@pytest.mark.parametrize('target', ['0', '{:x}'.format(MAX_TARGET + 1), 'xyz', 5])
+def test_invalid_target_is_rejected(target):
+    with pytest.raises(AssertionError):
+        BlockHeader.deserialize({ 'version': '0.1-alpha', 'target': target })
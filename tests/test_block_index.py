@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from block_index import BlockIndex, INDEX_RECORD
+from block_store import BlockLocation
+
+def make_hash(height):
+    return '{:064x}'.format(height)
+
+def test_records_reload(tmp_path):
+    index_path = str(tmp_path / 'index.dat')
+    index = BlockIndex(index_path)
+
+    for height in range(1, 4):
+        index.add(height, make_hash(height), BlockLocation(0, height * 100, 50), make_hash(height * 2))
+
+    index = BlockIndex(index_path)
+
+    assert len(index) == 3
+    assert index.get_height(make_hash(2)) == 2
+    assert index.get_location(make_hash(3)) == BlockLocation(0, 300, 50)
+    assert index.get_hash(1) == make_hash(1)
+    assert index.get_tx_root(make_hash(2)) == make_hash(4)
+    assert index.get_hash(4) is None
+
+def test_out_of_order_add_is_rejected(tmp_path):
+    index = BlockIndex(str(tmp_path / 'index.dat'))
+
+    with pytest.raises(AssertionError):
+        index.add(2, make_hash(2), BlockLocation(0, 0, 50), make_hash(4))
+
+def test_torn_record_is_truncated(tmp_path):
+    index_path = str(tmp_path / 'index.dat')
+    index = BlockIndex(index_path)
+
+    for height in range(1, 3):
+        index.add(height, make_hash(height), BlockLocation(0, height * 100, 50), make_hash(height * 2))
+
+    # a crash partway through writing the third record
+    with open(index_path, 'ab') as outfile:
+        outfile.write(INDEX_RECORD.pack(3, bytes.fromhex(make_hash(3)), 0, 300, 50, bytes.fromhex(make_hash(6)))[:20])
+
+    index = BlockIndex(index_path)
+
+    assert len(index) == 2
+    assert os.path.getsize(index_path) == 2 * INDEX_RECORD.size
+
+    index.add(3, make_hash(3), BlockLocation(0, 300, 50), make_hash(6))
+    index = BlockIndex(index_path)
+
+    assert len(index) == 3
+    assert index.get_location(make_hash(3)) == BlockLocation(0, 300, 50)
+
+def test_empty_tx_root_reloads(tmp_path):
+    index_path = str(tmp_path / 'index.dat')
+    BlockIndex(index_path).add(1, make_hash(1), BlockLocation(0, 0, 50), '')
+
+    assert BlockIndex(index_path).get_tx_root(make_hash(1)) == ''
@@ -0,0 +1,123 @@
+import os
+
+import pytest
+
+import block_store
+from block import Block
+from block_header import BlockHeader
+from block_store import BlockStore, RECORD_HEADER
+from transaction_set import TransactionSet
+
+def make_block(nonce):
+    return Block(block_header=BlockHeader(version='0.1-alpha'), timestamp=nonce, tx_set=TransactionSet([]), prev_block_hash='0', nonce=nonce, block_hash='{:064x}'.format(nonce))
+
+def test_blocks_read_back(tmp_path):
+    store = BlockStore(str(tmp_path))
+    locations = [store.append(make_block(i)) for i in range(1, 4)]
+
+    assert list(BlockStore(str(tmp_path)).iter_locations()) == locations
+    assert [block.nonce for block in store.iter_blocks()] == [1, 2, 3]
+
+def test_iter_locations_after(tmp_path):
+    store = BlockStore(str(tmp_path))
+    locations = [store.append(make_block(i)) for i in range(1, 4)]
+
+    assert list(store.iter_locations(after=locations[0])) == locations[1:]
+
+def test_torn_tail_is_truncated_on_open(tmp_path):
+    store = BlockStore(str(tmp_path))
+    locations = [store.append(make_block(i)) for i in range(1, 3)]
+    segment_path = store.get_segment_path(locations[-1].segment)
+    good_size = os.path.getsize(segment_path)
+
+    # a record whose payload was only partly written
+    with open(segment_path, 'ab') as outfile:
+        outfile.write(RECORD_HEADER.pack(100) + b'\x00' * 10)
+
+    store = BlockStore(str(tmp_path))
+
+    assert os.path.getsize(segment_path) == good_size
+
+    location = store.append(make_block(3))
+
+    assert location.offset == good_size
+
+    reopened = BlockStore(str(tmp_path))
+
+    assert list(reopened.iter_locations()) == locations + [location]
+    assert [block.nonce for block in reopened.iter_blocks()] == [1, 2, 3]
+
+def test_torn_record_header_is_truncated_on_open(tmp_path):
+    store = BlockStore(str(tmp_path))
+    store.append(make_block(1))
+    segment_path = store.get_segment_path(0)
+    good_size = os.path.getsize(segment_path)
+
+    with open(segment_path, 'ab') as outfile:
+        outfile.write(b'\x00\x00')
+
+    BlockStore(str(tmp_path))
+
+    assert os.path.getsize(segment_path) == good_size
+
+def test_split_records_matches_record_ranges(tmp_path):
+    store = BlockStore(str(tmp_path))
+    locations = [store.append(make_block(i)) for i in range(1, 4)]
+    ranges = store.get_record_ranges(locations)
+
+    assert len(ranges) == 1
+
+    segment, start, end = ranges[0]
+    payloads = list(BlockStore.split_records(store.get_segment_view(segment, start, end)))
+
+    assert [Block.from_bytes(payload).nonce for payload in payloads] == [1, 2, 3]
+
+def test_reads_are_views_of_the_segment(tmp_path):
+    store = BlockStore(str(tmp_path))
+    block = make_block(1)
+    location = store.append(block)
+
+    raw = store.read_raw(location)
+
+    assert isinstance(raw, memoryview)
+    assert bytes(raw) == block.to_bytes()
+
+def test_tail_segment_is_remapped_as_it_grows(tmp_path):
+    store = BlockStore(str(tmp_path))
+    first = store.append(make_block(1))
+
+    assert store.read_block(first).nonce == 1
+
+    # the map made for the first read is too short for the second block
+    second = store.append(make_block(2))
+
+    assert store.read_block(second).nonce == 2
+    assert store.read_block(first).nonce == 1
+
+def test_record_ranges_split_at_segments_and_gaps(tmp_path, monkeypatch):
+    monkeypatch.setattr(block_store, 'MAX_SEGMENT_SIZE', 2 * (RECORD_HEADER.size + len(make_block(1).to_bytes())))
+
+    store = BlockStore(str(tmp_path))
+    locations = [store.append(make_block(i)) for i in range(1, 6)]
+
+    assert [location.segment for location in locations] == [0, 0, 1, 1, 2]
+    assert [segment for segment, start, end in store.get_record_ranges(locations)] == [0, 1, 2]
+    assert len(store.get_record_ranges([locations[0], locations[2], locations[3]])) == 2
+    assert len(store.get_record_ranges([locations[2], locations[0]])) == 2
+
+    segment, start, end = store.get_record_ranges(locations[2:4])[0]
+    payloads = BlockStore.split_records(store.get_segment_view(segment, start, end))
+
+    assert [Block.from_bytes(payload).nonce for payload in payloads] == [3, 4]
+
+def test_split_records_rejects_truncated_data(tmp_path):
+    store = BlockStore(str(tmp_path))
+    location = store.append(make_block(1))
+    segment, start, end = store.get_record_ranges([location])[0]
+    data = bytes(store.get_segment_view(segment, start, end))
+
+    with pytest.raises(AssertionError):
+        list(BlockStore.split_records(data[:-1]))
+
+    with pytest.raises(AssertionError):
+        list(BlockStore.split_records(data + b'\x00'))
@@ -0,0 +1,56 @@
+import pytest
+
+from block import Block
+from block_header import BlockHeader, MAX_TARGET
+from block_verifier import BlockVerifier, check_block
+from transaction_set import TransactionSet
+
+# the easiest target, so any hash meets it
+TARGET = MAX_TARGET
+
+# a block that checks out
+def make_block(prev_block, timestamp):
+    block = Block(block_header=BlockHeader(version='0.1-alpha', target=TARGET), timestamp=timestamp, tx_set=TransactionSet([]), prev_block_hash=prev_block.block_hash, nonce=0)
+    block.block_hash = block.calc_hash()
+
+    return block
+
+def make_chain(count):
+    genesis = Block(block_header=BlockHeader(version='0.1-alpha', target=TARGET), timestamp=1, tx_set=TransactionSet([]), prev_block_hash='0', nonce=0)
+    genesis.block_hash = genesis.calc_hash()
+
+    blocks = []
+    prev_block = genesis
+
+    for i in range(0, count):
+        prev_block = make_block(prev_block, 2 + i)
+        blocks.append(prev_block)
+
+    return genesis, blocks
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_verifies_in_order(workers):
+    genesis, blocks = make_chain(5)
+
+    with BlockVerifier(workers) as verifier:
+        assert list(verifier.verify(blocks, genesis)) == blocks
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_block_that_failed_to_load_is_an_error(workers):
+    genesis, blocks = make_chain(5)
+    verified = []
+
+    with BlockVerifier(workers) as verifier:
+        with pytest.raises(AssertionError, match='failed to load'):
+            for block in verifier.verify(blocks[:2] + [None] + blocks[2:], genesis):
+                verified.append(block)
+
+    assert verified == blocks[:2]
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_broken_linkage_is_an_error(workers):
+    genesis, blocks = make_chain(3)
+
+    with BlockVerifier(workers) as verifier:
+        with pytest.raises(AssertionError):
+            list(verifier.verify([blocks[0], blocks[2]], genesis))
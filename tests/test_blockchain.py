@@ -0,0 +1,299 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import blockchain as blockchain_module
+from block import Block
+from block_header import BlockHeader, MAX_TARGET
+from block_verifier import BlockVerifier
+from chain_header import ChainHeader
+from chain_snapshot import ChainSnapshot
+from blockchain import Blockchain, MAX_RETARGET_FACTOR
+from blockchain_metadata import BlockchainMetadata
+from transaction import Transaction
+from transaction_set import TransactionSet
+from object_identifier import ObjectIdentifier
+
+RETARGET_INTERVAL = 4
+TARGET_BLOCK_TIME = 10
+
+def make_genesis():
+    genesis = Block(block_header=BlockHeader(version='0.1-alpha', target=MAX_TARGET), timestamp=1, tx_set=TransactionSet([]), prev_block_hash='0', nonce=0)
+    genesis.block_hash = genesis.calc_hash()
+
+    return genesis
+
+# a chain kept under tmp_path (chain data lives in ./chain-store)
+@pytest.fixture
+def make_chain(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    genesis = make_genesis()
+
+    def make_chain():
+        return Blockchain(genesis, genesis, BlockchainMetadata({
+            'identifier': 'vivx.network.test',
+            'retarget-interval': RETARGET_INTERVAL,
+            'target-block-time': TARGET_BLOCK_TIME
+        }))
+
+    return make_chain
+
+# a block on the chain's tip carrying its current target
+def mine(chain, timestamp, txs=[]):
+    block = Block(block_header=BlockHeader(version='0.1-alpha', target=chain.target), timestamp=timestamp, tx_set=TransactionSet(list(txs)), prev_block_hash=chain.last_block.block_hash)
+    block.solve(workers=1)
+
+    return block
+
+def mine_window(chain, block_time, save=False):
+    for i in range(0, RETARGET_INTERVAL):
+        chain.add_block(mine(chain, chain.last_block.timestamp + block_time), save=save)
+
+def test_fast_blocks_lower_the_target(make_chain):
+    chain = make_chain()
+    target = chain.target
+
+    mine_window(chain, TARGET_BLOCK_TIME // 2)
+
+    assert chain.target == target // 2
+
+def test_retarget_is_bounded(make_chain):
+    chain = make_chain()
+    target = chain.target
+
+    mine_window(chain, 1)
+
+    assert chain.target == target // MAX_RETARGET_FACTOR
+
+    lowered = chain.target
+
+    mine_window(chain, TARGET_BLOCK_TIME * 100)
+
+    assert chain.target == lowered * MAX_RETARGET_FACTOR
+
+    # never easier than MAX_TARGET
+    mine_window(chain, TARGET_BLOCK_TIME * 100)
+
+    assert chain.target == MAX_TARGET
+
+def test_block_with_wrong_target_is_rejected(make_chain):
+    chain = make_chain()
+    block = Block(block_header=BlockHeader(version='0.1-alpha', target=chain.target // 2), timestamp=2, tx_set=TransactionSet([]), prev_block_hash=chain.last_block.block_hash, nonce=0)
+    block.block_hash = block.calc_hash()
+
+    with pytest.raises(AssertionError):
+        chain.add_block(block)
+
+def test_stored_chain_reloads(make_chain):
+    chain = make_chain()
+
+    mine_window(chain, TARGET_BLOCK_TIME // 2, save=True)
+    mine_window(chain, TARGET_BLOCK_TIME, save=True)
+
+    reloaded = make_chain()
+    reloaded.load_blocks(BlockVerifier(1))
+
+    assert reloaded.height == chain.height
+    assert reloaded.last_block.block_hash == chain.last_block.block_hash
+    assert reloaded.target == chain.target
+
+def test_blocks_are_found_by_hash_and_height(make_chain):
+    chain = make_chain()
+    blocks = []
+
+    for i in range(0, 3):
+        blocks.append(mine(chain, chain.last_block.timestamp + 1))
+        chain.add_block(blocks[-1], save=True)
+
+    for height, block in enumerate(blocks, 1):
+        assert chain.get_block_height(block.block_hash) == height
+        assert chain.get_block_by_height(height).block_hash == block.block_hash
+        assert chain.get_block_by_hash(block.block_hash).block_hash == block.block_hash
+
+    assert chain.get_block_height(chain.genesis_block.block_hash) == 0
+    assert chain.get_block_height('ab' * 32) is None
+    assert chain.get_block_by_height(len(blocks) + 1) is None
+
+def test_block_files_are_listed_in_timestamp_order(make_chain):
+    chain = make_chain()
+    block_dir = chain.get_block_dir()
+
+    for name in ['block-20.json', 'block-3.json', 'block-100.json', 'notes.txt']:
+        open('{}/{}'.format(block_dir, name), 'w').close()
+
+    assert chain.get_block_files() == ['{}/block-{}.json'.format(block_dir, timestamp) for timestamp in [3, 20, 100]]
+
+def test_block_file_manifest_is_cached(make_chain, monkeypatch):
+    chain = make_chain()
+    block_dir = chain.get_block_dir()
+
+    open('{}/block-1.json'.format(block_dir), 'w').close()
+    block_files = chain.get_block_files()
+
+    monkeypatch.setattr(blockchain_module.os, 'listdir', None)
+
+    assert chain.get_block_files() is block_files
+
+def test_block_file_manifest_follows_the_directory(make_chain):
+    chain = make_chain()
+    block_dir = chain.get_block_dir()
+
+    assert chain.get_block_files() == []
+
+    open('{}/block-1.json'.format(block_dir), 'w').close()
+    # the directory's mtime may not have moved within its resolution
+    stat = os.stat(block_dir)
+    os.utime(block_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert chain.get_block_files() == ['{}/block-1.json'.format(block_dir)]
+
+def test_legacy_block_files_are_imported_once(make_chain):
+    chain = make_chain()
+
+    for i in range(0, 3):
+        block = mine(chain, chain.last_block.timestamp + 1)
+        chain.add_block(block)
+        block.save(chain.get_block_dir())
+
+    imported = make_chain()
+    imported.load_blocks(BlockVerifier(1))
+
+    assert imported.last_block.block_hash == chain.last_block.block_hash
+    assert len(imported.block_index) == 3
+
+    reloaded = make_chain()
+    reloaded.load_blocks(BlockVerifier(1))
+
+    assert reloaded.height == 3
+    assert len(reloaded.block_index) == 3
+
+def test_reload_resumes_from_snapshot(make_chain, monkeypatch):
+    monkeypatch.setattr(blockchain_module, 'SNAPSHOT_INTERVAL', RETARGET_INTERVAL)
+
+    chain = make_chain()
+
+    mine_window(chain, TARGET_BLOCK_TIME // 2, save=True)
+    chain.add_block(mine(chain, chain.last_block.timestamp + 1), save=True)
+
+    assert chain.snapshot_height == RETARGET_INTERVAL
+
+    reloaded = make_chain()
+
+    assert reloaded.load_snapshot()
+    assert reloaded.height == RETARGET_INTERVAL
+    assert reloaded.target == chain.target
+
+    reloaded.load_blocks(BlockVerifier(1))
+
+    assert reloaded.height == chain.height
+    assert reloaded.last_block.block_hash == chain.last_block.block_hash
+
+def test_unsaved_blocks_are_not_snapshotted(make_chain, monkeypatch):
+    monkeypatch.setattr(blockchain_module, 'SNAPSHOT_INTERVAL', RETARGET_INTERVAL)
+
+    chain = make_chain()
+
+    mine_window(chain, TARGET_BLOCK_TIME)
+
+    assert chain.snapshot_height == 0
+    assert ChainSnapshot.load(chain.get_snapshot_path()) is None
+
+def test_snapshot_not_matching_the_store_is_ignored(make_chain, monkeypatch):
+    monkeypatch.setattr(blockchain_module, 'SNAPSHOT_INTERVAL', RETARGET_INTERVAL)
+
+    chain = make_chain()
+
+    mine_window(chain, TARGET_BLOCK_TIME, save=True)
+
+    snapshot = ChainSnapshot.load(chain.get_snapshot_path())
+    snapshot.last_block = chain.genesis_block
+    snapshot.save(chain.get_snapshot_path())
+
+    reloaded = make_chain()
+
+    assert not reloaded.load_snapshot()
+    assert reloaded.height == 0
+
+def test_corrupt_snapshot_is_ignored(tmp_path):
+    snapshot_path = str(tmp_path / 'snapshot.json')
+
+    with open(snapshot_path, 'w') as outfile:
+        outfile.write('{"height": 4')
+
+    assert ChainSnapshot.load(snapshot_path) is None
+
+def make_txs(height):
+    return [Transaction(ObjectIdentifier.parse('vivx.network.test'), { 'value': height * 10 + i }, 1) for i in range(0, height)]
+
+def test_headers_are_served_without_decoding_transactions(make_chain, monkeypatch):
+    chain = make_chain()
+    blocks = []
+
+    for height in range(1, 4):
+        blocks.append(mine(chain, chain.last_block.timestamp + 1, make_txs(height)))
+        chain.add_block(blocks[-1], save=True)
+
+    monkeypatch.setattr(TransactionSet, 'deserialize_binary', None)
+
+    headers = chain.get_headers(1, 100)
+
+    assert [header.serialize() for header in headers] == [ChainHeader.from_block(block).serialize() for block in blocks]
+    assert [header.block_hash for header in chain.get_headers(2, 1)] == [blocks[1].block_hash]
+
+    prev = chain.genesis_block
+
+    for header in headers:
+        header.verify(prev)
+        prev = header
+
+def test_missing_index_is_rebuilt(make_chain):
+    chain = make_chain()
+
+    for height in range(1, 4):
+        chain.add_block(mine(chain, chain.last_block.timestamp + 1, make_txs(height)), save=True)
+
+    os.remove(chain.get_index_path())
+
+    reloaded = make_chain()
+    reloaded.load_blocks(BlockVerifier(1))
+
+    assert len(reloaded.block_index) == 3
+    assert [header.serialize() for header in reloaded.get_headers(1, 100)] == [header.serialize() for header in chain.get_headers(1, 100)]
+
+def test_listeners_are_called_with_each_block(make_chain):
+    chain = make_chain()
+    added = []
+    blocks = []
+
+    chain.add_block_listener(lambda block: added.append((block.block_hash, chain.last_block.block_hash)))
+
+    for i in range(0, 3):
+        blocks.append(mine(chain, chain.last_block.timestamp + 1))
+        chain.add_block(blocks[-1])
+
+    # each listener call comes once the block is the chain tip
+    assert added == [(block.block_hash, block.block_hash) for block in blocks]
+
+# the chain doesn't depend on the node's modules (e.g. the transaction pool, whose import loads ./genesis.json)
+def test_blocks_are_added_outside_the_repository(tmp_path):
+    script = """
+import sys
+sys.path.insert(0, {!r})
+from block import Block
+from block_header import BlockHeader, MAX_TARGET
+from blockchain import Blockchain
+from blockchain_metadata import BlockchainMetadata
+from transaction_set import TransactionSet
+
+genesis = Block(block_header=BlockHeader(version='0.1-alpha', target=MAX_TARGET), timestamp=1, tx_set=TransactionSet([]), prev_block_hash='0', nonce=0)
+genesis.block_hash = genesis.calc_hash()
+chain = Blockchain(genesis, genesis, BlockchainMetadata({{ 'identifier': 'vivx.network.test' }}))
+block = Block(block_header=BlockHeader(version='0.1-alpha', target=MAX_TARGET), timestamp=2, tx_set=TransactionSet([]), prev_block_hash=genesis.block_hash)
+block.solve(workers=1)
+chain.add_block(block, save=True)
+""".format(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    subprocess.run([sys.executable, '-c', script], cwd=str(tmp_path), check=True)
@@ -0,0 +1,84 @@
+import pytest
+
+from bytecode import Bytecode, PackedBytecode, PACKED_BYTECODE_MAGIC
+from bytecode_parser import BytecodeParser
+from instruction import Instruction, Opcode, Value, ValueType
+from vm import VM, CompiledBytecode
+
+def push(value_type, data):
+    return Instruction(Opcode.PUSH, [Value(value_type, data)])
+
+PROGRAM = Bytecode([
+    push(ValueType.INT, 2),
+    push(ValueType.FLOAT, -3.0),
+    Instruction(Opcode.ADD),
+    push(ValueType.FLOAT, 1.5),
+    Instruction(Opcode.MUL),
+    Instruction(Opcode.NOOP),
+    push(ValueType.INT, 2),
+    push(ValueType.STRING, 'vivx ✓'),
+    push(ValueType.BOOL, True),
+    push(ValueType.ARRAY, [1, 'a']),
+    Instruction(Opcode.POP),
+    Instruction(Opcode.POP),
+    Instruction(Opcode.POP)
+])
+
+def describe(bytecode):
+    return [(ins.opcode, [(arg.value_type, arg.data) for arg in ins.arguments]) for ins in bytecode.instructions]
+
+def test_round_trip():
+    packed = PackedBytecode.pack(PROGRAM)
+
+    assert bytes(packed.data[:len(PACKED_BYTECODE_MAGIC)]) == PACKED_BYTECODE_MAGIC
+    assert len(packed) == len(PROGRAM.instructions)
+    assert describe(packed) == describe(PROGRAM)
+    assert describe(PackedBytecode(bytes(packed.data)).to_bytecode()) == describe(PROGRAM)
+
+def test_equal_constants_are_stored_once():
+    packed = PackedBytecode.pack(PROGRAM)
+
+    assert len(packed.constants) == 6
+
+def test_hash_is_the_same_packed_or_not():
+    packed = PackedBytecode.pack(PROGRAM)
+
+    assert PROGRAM.calc_hash() == packed.calc_hash()
+    assert PackedBytecode(bytes(packed.data)).calc_hash() == packed.calc_hash()
+
+def test_hash_covers_argument_types():
+    assert Bytecode([push(ValueType.INT, 1)]).calc_hash() != Bytecode([push(ValueType.PTR, 1)]).calc_hash()
+
+@pytest.mark.parametrize('data', [
+    b'XXXX\x01\x00\x00\x00\x00\x00\x00\x00',
+    PACKED_BYTECODE_MAGIC + b'\x02\x00\x00\x00\x00\x00\x00\x00',
+    bytes(PackedBytecode.pack(Bytecode([])).data) + b'\x00',
+    bytes(PackedBytecode.pack(Bytecode([])).data)[:-1]
+])
+def test_malformed_data_is_rejected(data):
+    with pytest.raises(AssertionError):
+        PackedBytecode(data)
+
+def test_mismatched_data_is_rejected():
+    with pytest.raises(AssertionError):
+        PackedBytecode.pack(Bytecode([push(ValueType.INT, 1.5)]))
+
+def run(bytecode, analysis=None):
+    vm = VM(CompiledBytecode(bytecode, analysis))
+    vm.evaluate()
+
+    return [(value.value_type, value.data) for value in vm.stack], vm.gas_used
+
+def test_packed_runs_like_unpacked():
+    packed = PackedBytecode.pack(PROGRAM)
+    expected = run(PROGRAM)
+
+    assert expected[0] == [(ValueType.FLOAT, -1.5), (ValueType.INT, 2)]
+    assert run(packed) == expected
+    assert run(packed, BytecodeParser.verify(packed)) == expected
+
+@pytest.mark.parametrize('value', [0, -1, 1, -300, 2 ** 40, -(2 ** 40)])
+def test_int_constants_round_trip(value):
+    packed = PackedBytecode(bytes(PackedBytecode.pack(Bytecode([push(ValueType.INT, value)])).data))
+
+    assert packed.constants[0].data == value
@@ -0,0 +1,48 @@
+import pytest
+
+from bytecode import Bytecode, PackedBytecode
+from bytecode_parser import BytecodeParser
+from instruction import Instruction, Opcode, Value, ValueType
+
+def push(value=1):
+    return Instruction(Opcode.PUSH, [Value(ValueType.INT, value)])
+
+def test_stack_use():
+    analysis = BytecodeParser.verify(Bytecode([push(), push(), Instruction(Opcode.ADD), Instruction(Opcode.ADD)]))
+
+    assert analysis.errors == []
+    assert analysis.stack_needed == 1
+    assert analysis.stack_peak == 2
+    assert not analysis.is_stack_safe(0, 64)
+    assert analysis.is_stack_safe(1, 64)
+    assert not analysis.is_stack_safe(63, 64)
+
+def test_argument_errors():
+    errors = BytecodeParser.analyze(Bytecode([Instruction(Opcode.PUSH), Instruction(Opcode.POP, [Value(ValueType.INT, 1)])]))
+
+    assert len(errors) == 2
+
+def test_packed_bytecode_analysis_is_cached():
+    bytecode = PackedBytecode.pack(Bytecode([push(), Instruction(Opcode.POP)]))
+
+    assert BytecodeParser.verify(bytecode) is BytecodeParser.verify(PackedBytecode(bytes(bytecode.data)))
+
+def test_unknown_packed_opcode_is_an_error():
+    data = bytearray(PackedBytecode.pack(Bytecode([Instruction(Opcode.NOOP)])).data)
+    # magic, version, then single-byte counts of constants, instructions and arguments come before the opcode
+    data[8] = 0xfe
+
+    assert BytecodeParser.analyze(PackedBytecode(bytes(data))) == ["'254' is not a valid opcode"]
+
+# a raw opcode value packed the same as its Opcode, so it was handed the analysis cached for the Opcode form
+def test_raw_opcode_values_are_not_confused_with_opcodes():
+    enum_form = Bytecode([push(), Instruction(Opcode.POP)])
+    raw_form = Bytecode([Instruction(Opcode.PUSH.value, [Value(ValueType.INT, 1)]), Instruction(Opcode.POP.value)])
+
+    assert BytecodeParser.verify(PackedBytecode.pack(enum_form)).errors == []
+
+    with pytest.raises(AssertionError):
+        PackedBytecode.pack(raw_form)
+
+    with pytest.raises(AssertionError):
+        BytecodeParser.verify(raw_form)
@@ -0,0 +1,70 @@
+import pytest
+
+from block import Block
+from block_header import BlockHeader, MAX_TARGET
+from chain_header import ChainHeader
+from transaction import Transaction
+from transaction_set import TransactionSet
+from object_identifier import ObjectIdentifier
+
+def make_tx(value):
+    return Transaction(ObjectIdentifier.parse('vivx.network.core-metachain'), { 'value': value }, 1)
+
+def make_block(prev_block, txs=[], target=MAX_TARGET >> 4):
+    block = Block(block_header=BlockHeader(version='0.1-alpha', target=target), timestamp=prev_block.timestamp + 1, tx_set=TransactionSet(list(txs)), prev_block_hash=prev_block.block_hash)
+    block.solve(workers=1)
+
+    return block
+
+@pytest.fixture
+def genesis():
+    genesis = Block(block_header=BlockHeader(version='0.1-alpha', target=MAX_TARGET), timestamp=1, tx_set=TransactionSet([]), prev_block_hash='0', nonce=0)
+    genesis.block_hash = genesis.calc_hash()
+
+    return genesis
+
+def test_header_hashes_like_its_block(genesis):
+    block = make_block(genesis, [make_tx(1), make_tx(2)])
+    header = ChainHeader.from_block(block)
+
+    assert header.calc_hash() == block.block_hash
+    assert ChainHeader.from_record(block.to_bytes(), block.tx_set.calc_hash()).serialize() == header.serialize()
+    assert ChainHeader.deserialize(header.serialize()).serialize() == header.serialize()
+
+def test_header_chain_verifies(genesis):
+    first = make_block(genesis)
+    second = make_block(first, [make_tx(1)])
+
+    ChainHeader.from_block(first).verify(genesis)
+    ChainHeader.from_block(second).verify(ChainHeader.from_block(first))
+
+    with pytest.raises(AssertionError):
+        ChainHeader.from_block(second).verify(genesis)
+
+def test_header_with_wrong_tx_root_fails(genesis):
+    header = ChainHeader.from_block(make_block(genesis, [make_tx(1)]))
+    header.tx_root = TransactionSet([make_tx(2)]).calc_hash()
+
+    with pytest.raises(AssertionError):
+        header.verify(genesis)
+
+def test_header_missing_its_target_fails(genesis):
+    header = ChainHeader.from_block(make_block(genesis))
+    # a hash consistent with the header, but nowhere near the target
+    header.block_header = BlockHeader(version='0.1-alpha', target=1)
+    header.block_hash = header.calc_hash()
+
+    with pytest.raises(AssertionError, match='target'):
+        header.verify(genesis)
+
+def test_body_must_match_its_header(genesis):
+    block = make_block(genesis, [make_tx(1), make_tx(2)])
+    header = ChainHeader.from_block(block)
+
+    assert header.check_body(block) == []
+    assert len(header.check_body(make_block(genesis))) == 1
+
+    tampered = Block.from_bytes(block.to_bytes())
+    tampered.tx_set = TransactionSet([make_tx(1)])
+
+    assert len(header.check_body(tampered)) == 1
@@ -0,0 +1,21 @@
+import threading
+
+from client import Client
+
+def test_request_ids_are_unique_across_threads():
+    client = Client({})
+    request_ids = []
+
+    def take():
+        ids = [client._new_request_id() for i in range(0, 1000)]
+        request_ids.extend(ids)
+
+    threads = [threading.Thread(target=take) for i in range(0, 8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert sorted(request_ids) == list(range(1, 8001))
@@ -0,0 +1,102 @@
+from gossip import SeenSet, InflightRequests, MAX_INV_ITEMS, INV_TX, GETDATA_TIMEOUT, get_inv_messages, get_inv_response, get_broadcast_tx, parse_inv_items, retry_expired_requests
+from mempool import Mempool
+from transaction import Transaction
+from object_identifier import ObjectIdentifier
+
+# the parts of TransactionPool the gossip functions use
+class Pool:
+    def __init__(self):
+        self.mempool = Mempool()
+        self.seen = SeenSet()
+        self.requests = InflightRequests()
+
+class Peer:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+def make_tx(value):
+    return Transaction(ObjectIdentifier.parse('vivx.network.core-metachain'), { 'value': value }, 100)
+
+def make_hashes(count):
+    return ['{:064x}'.format(i) for i in range(0, count)]
+
+def test_large_announcements_are_split():
+    hashes = make_hashes(MAX_INV_ITEMS * 2 + 500)
+    messages = get_inv_messages(INV_TX, hashes)
+
+    assert len(messages) == 3
+    assert all(parse_inv_items(message) is not None for message in messages)
+    assert [item_hash for message in messages for kind, item_hash in parse_inv_items(message)] == hashes
+
+def test_oversized_inv_is_rejected():
+    assert parse_inv_items({ 'items': [[INV_TX, item_hash] for item_hash in make_hashes(MAX_INV_ITEMS + 1)] }) is None
+
+def test_items_are_requested_once():
+    pool = Pool()
+    a, b = Peer(), Peer()
+    inv = get_inv_messages(INV_TX, make_hashes(3))[0]
+
+    assert len(parse_inv_items(get_inv_response(pool, inv, a, a.send, now=0))) == 3
+    assert get_inv_response(pool, inv, b, b.send, now=1) is None
+
+def test_known_transactions_are_not_requested():
+    pool = Pool()
+    peer = Peer()
+    tx = make_tx(1)
+
+    pool.mempool.add(tx)
+
+    assert get_inv_response(pool, get_inv_messages(INV_TX, [tx.calc_hash()])[0], peer, peer.send, now=0) is None
+
+def test_unanswered_request_is_retried_with_another_announcer():
+    pool = Pool()
+    a, b = Peer(), Peer()
+    hashes = make_hashes(2)
+    inv = get_inv_messages(INV_TX, hashes)[0]
+
+    get_inv_response(pool, inv, a, a.send, now=0)
+    get_inv_response(pool, inv, b, b.send, now=1)
+
+    retry_expired_requests(pool, now=GETDATA_TIMEOUT - 1)
+
+    assert b.sent == []
+
+    retry_expired_requests(pool, now=GETDATA_TIMEOUT)
+
+    assert len(b.sent) == 1
+    assert [item_hash for kind, item_hash in parse_inv_items(b.sent[0])] == hashes
+
+    # nobody else announced them, so once b doesn't answer either they are forgotten
+    retry_expired_requests(pool, now=GETDATA_TIMEOUT * 2)
+
+    assert len(pool.requests) == 0
+    assert len(parse_inv_items(get_inv_response(pool, inv, a, a.send, now=GETDATA_TIMEOUT * 2))) == 2
+
+def test_received_items_are_not_retried():
+    pool = Pool()
+    a, b = Peer(), Peer()
+    tx = make_tx(1)
+    inv = get_inv_messages(INV_TX, [tx.calc_hash()])[0]
+
+    get_inv_response(pool, inv, a, a.send, now=0)
+    get_inv_response(pool, inv, b, b.send, now=0)
+
+    pool.mempool.add(tx)
+    pool.requests.received(tx.calc_hash())
+
+    retry_expired_requests(pool, now=GETDATA_TIMEOUT)
+
+    assert b.sent == []
+
+def test_broadcast_may_only_carry_a_transaction():
+    tx = make_tx(1)
+
+    assert get_broadcast_tx({ 'msg': { 'type': 'recvtx', 'tx': tx.serialize() } }).calc_hash() == tx.calc_hash()
+    assert get_broadcast_tx({ 'msg': { 'type': 'recvtx', 'tx': { 'data': 1 } } }) is None
+    assert get_broadcast_tx({ 'msg': { 'type': 'updatepeers', 'peers': [] } }) is None
+    assert get_broadcast_tx({ 'msg': { 'type': 'recvblockpage', 'blockpage': [] } }) is None
+    assert get_broadcast_tx({ 'msg': 'recvtx' }) is None
+    assert get_broadcast_tx({}) is None
@@ -0,0 +1,117 @@
+from block import Block
+from block_header import BlockHeader
+from mempool import Mempool, TX_ACCEPTED, TX_DUPLICATE, TX_REJECTED
+from transaction import Transaction
+from transaction_set import TransactionSet
+from transaction_pool import TransactionPool
+from object_identifier import ObjectIdentifier
+
+def make_tx(value, fee=None, timestamp=100):
+    data = { 'value': value }
+
+    if fee is not None:
+        data['fee'] = fee
+
+    return Transaction(ObjectIdentifier.parse('vivx.network.core-metachain'), data, timestamp)
+
+def test_select_batch_orders_by_fee_then_age():
+    mempool = Mempool()
+    newer = make_tx(1, fee=5, timestamp=200)
+    older = make_tx(2, fee=5, timestamp=100)
+    cheap = make_tx(3, fee=1)
+    free = make_tx(4)
+    best = make_tx(5, fee=10)
+
+    mempool.add_many([newer, older, cheap, free, best])
+
+    assert mempool.select_batch() == [best, older, newer, cheap, free]
+    # selecting doesn't remove anything
+    assert len(mempool) == 5
+
+def test_select_batch_limits():
+    mempool = Mempool()
+    txs = [make_tx(i, fee=i) for i in range(1, 6)]
+
+    mempool.add_many(txs)
+
+    assert mempool.select_batch(max_count=2) == [txs[4], txs[3]]
+    assert mempool.select_batch(max_bytes=0) == []
+
+def test_duplicates():
+    mempool = Mempool()
+    tx = make_tx(1)
+
+    assert mempool.add_many([tx, tx]) == [TX_ACCEPTED, TX_DUPLICATE]
+    assert len(mempool) == 1
+
+def test_full_pool_evicts_the_worst():
+    mempool = Mempool(max_size=2)
+    low = make_tx(1, fee=1)
+    mid = make_tx(2, fee=2)
+    high = make_tx(3, fee=3)
+
+    mempool.add_many([low, mid])
+
+    assert mempool.add_many([make_tx(4, fee=1, timestamp=300)]) == [TX_REJECTED]
+    assert mempool.add_many([high]) == [TX_ACCEPTED]
+    assert low.calc_hash() not in mempool
+    assert mempool.select_batch() == [high, mid]
+
+def test_mined_transactions_are_removed():
+    mempool = Mempool()
+    mined = make_tx(1, fee=5)
+    pending = make_tx(2, fee=1)
+
+    mempool.add_many([mined, pending])
+
+    block = Block(block_header=BlockHeader(version='0.1-alpha'), timestamp=1, tx_set=TransactionSet([mined]), prev_block_hash='0')
+    mempool.remove_block_transactions(block)
+
+    assert mined.calc_hash() not in mempool
+    assert mempool.select_batch() == [pending]
+
+    # a transaction mined and then received again is pending again, not a stale duplicate
+    assert mempool.add(mined)
+    assert mempool.select_batch() == [mined, pending]
+
+def test_heaps_are_compacted():
+    mempool = Mempool()
+    txs = [make_tx(i) for i in range(0, 200)]
+
+    mempool.add_many(txs)
+
+    for tx in txs[:190]:
+        mempool.remove(tx.calc_hash())
+
+    mempool.add(make_tx(1000))
+
+    assert len(mempool) == 11
+    assert len(mempool._best) <= 4 * len(mempool) + 64
+
+def test_pool_rejects_mined_transactions():
+    pool = TransactionPool.TransactionPoolSingleton(None, None)
+    mined = make_tx(1, fee=5)
+    pending = make_tx(2, fee=1)
+    new = make_tx(3)
+
+    assert pool.queue_txs([mined, pending]) == [TX_ACCEPTED, TX_ACCEPTED]
+
+    pool.remove_block_transactions(Block(block_header=BlockHeader(version='0.1-alpha'), timestamp=1, tx_set=TransactionSet([mined]), prev_block_hash='0'))
+
+    assert pool.select_batch() == [pending]
+
+    # pushed again (pushtx, pushtx_batch or recvtx): not accepted, relayed or mined a second time
+    assert not pool.queue_tx(mined)
+    assert pool.queue_txs([mined, new]) == [TX_DUPLICATE, TX_ACCEPTED]
+    assert mined.calc_hash() not in pool.mempool
+    # queued for relay once, when it first arrived
+    assert [tx for tx, source in pool.tx_queue] == [mined, pending, new]
+
+def test_pool_rejects_transactions_mined_before_it_saw_them():
+    pool = TransactionPool.TransactionPoolSingleton(None, None)
+    tx = make_tx(1)
+
+    pool.remove_block_transactions(Block(block_header=BlockHeader(version='0.1-alpha'), timestamp=1, tx_set=TransactionSet([tx]), prev_block_hash='0'))
+
+    assert not pool.queue_tx(tx)
+    assert len(pool.mempool) == 0
@@ -0,0 +1,65 @@
+import pytest
+
+from block import Block
+from block_header import BlockHeader
+from merkle_tree import MerkleTree, NODE_PREFIX
+from transaction import Transaction
+from transaction_set import TransactionSet
+from object_identifier import ObjectIdentifier
+from utility_classes import Hashable
+
+def make_tx(value):
+    return Transaction(ObjectIdentifier.parse('vivx.network.core-metachain'), { 'value': value }, 100)
+
+def test_single_transaction_root_is_its_leaf():
+    tx = make_tx(1)
+
+    assert TransactionSet([tx]).calc_hash() == Hashable().hash_str(tx.calc_hash())
+
+def test_duplicated_trailing_transaction_changes_root():
+    a, b, c = make_tx(1), make_tx(2), make_tx(3)
+
+    assert TransactionSet([a, b, c]).calc_hash() != TransactionSet([a, b, c, c]).calc_hash()
+
+def test_duplicate_transactions_are_rejected():
+    a, b, c = make_tx(1), make_tx(2), make_tx(3)
+
+    assert TransactionSet([a, b, c]).check_duplicates() == []
+    assert len(TransactionSet([a, b, c, c]).check_duplicates()) == 1
+
+def test_incremental_append_matches_rebuild():
+    leaves = [Hashable().hash_str(i) for i in range(0, 13)]
+    tree = MerkleTree()
+
+    for i, leaf in enumerate(leaves):
+        tree.append(leaf)
+
+        assert tree.root() == MerkleTree(leaves[:i + 1]).root()
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5, 8, 13])
+def test_proofs_verify(count):
+    txs = [make_tx(i) for i in range(0, count)]
+    tx_set = TransactionSet(txs)
+
+    for i, tx in enumerate(txs):
+        assert TransactionSet.verify_proof(tx.calc_hash(), tx_set.proof(i), tx_set.calc_hash())
+
+    assert not TransactionSet.verify_proof(make_tx(-1).calc_hash(), tx_set.proof(0), tx_set.calc_hash())
+
+def test_internal_node_is_not_accepted_as_transaction():
+    txs = [make_tx(i) for i in range(0, 4)]
+    tx_set = TransactionSet(txs)
+    tree = tx_set.get_merkle_tree()
+
+    # the children of the root's left node, passed off as a single transaction hash
+    concatenated = tree.levels[0][0] + tree.levels[0][1]
+    proof = [[tree.levels[1][1], False]]
+
+    assert not TransactionSet.verify_proof(concatenated, proof, tx_set.calc_hash())
+    assert not TransactionSet.verify_proof(NODE_PREFIX + concatenated, proof, tx_set.calc_hash())
+
+def test_block_with_duplicate_transaction_fails_preconditions():
+    a, b, c = make_tx(1), make_tx(2), make_tx(3)
+    block = Block(block_header=BlockHeader(version='0.1-alpha'), timestamp=200, tx_set=TransactionSet([a, b, c, c]), prev_block_hash='0')
+
+    assert any('more than once' in error for error in block.check_preconditions())
@@ -0,0 +1,131 @@
+import json
+import socket
+
+import pytest
+
+import message_framing
+from message_framing import MessageDecoder, PreparedMessage, FramingError, ZlibCodec, encode_message, encode_frame, encode_payload, send_message, create_codec, select_codec_name, FLAG_COMPRESSED, FLAG_ATTACHMENT, FLAG_HAS_ATTACHMENT
+
+def decode_all(decoder, data):
+    return [(json.loads(payload), attachment) for payload, attachment in decoder.feed(data)]
+
+def test_messages_split_across_reads():
+    data = encode_message({ 'type': 'ping' }) + encode_message({ 'type': 'pong', 'id': 1 })
+    decoder = MessageDecoder(buffer_size=4)
+    messages = []
+
+    for i in range(0, len(data), 3):
+        messages += decode_all(decoder, data[i:i + 3])
+
+    assert messages == [({ 'type': 'ping' }, None), ({ 'type': 'pong', 'id': 1 }, None)]
+
+def test_attachment_follows_its_message():
+    data = encode_message({ 'type': 'recvblockpage' }, attachment_size=3) + b'abc'
+
+    assert decode_all(MessageDecoder(), data) == [({ 'type': 'recvblockpage' }, b'abc')]
+
+def test_oversized_frame_is_rejected(monkeypatch):
+    monkeypatch.setattr(message_framing, 'MAX_FRAME_SIZE', 16)
+
+    with pytest.raises(FramingError):
+        MessageDecoder().feed(encode_frame(b'x' * 17))
+
+def test_compressed_frame_before_negotiation_is_rejected():
+    with pytest.raises(FramingError):
+        MessageDecoder().feed(encode_message({ 'type': 'ping' }, codec=ZlibCodec()))
+
+def test_select_codec_name():
+    assert select_codec_name(['zlib']) == 'zlib'
+    assert select_codec_name(['lz4']) is None
+    assert select_codec_name(None) is None
+
+@pytest.mark.parametrize('name', ['zlib', 'zstd'])
+def test_compressed_stream_round_trip(name):
+    if name == 'zstd':
+        pytest.importorskip('zstandard')
+
+    sender = create_codec(name)
+    decoder = MessageDecoder()
+    decoder.codec = create_codec(name)
+
+    objs = [{ 'type': 'recvtx', 'tx': { 'value': i } } for i in range(0, 5)]
+    data = b''.join(encode_message(obj, codec=sender) for obj in objs)
+
+    assert [obj for obj, attachment in decode_all(decoder, data)] == objs
+
+# a small frame that expands past the frame size limit drops the connection instead of being inflated
+@pytest.mark.parametrize('name', ['zlib', 'zstd'])
+def test_decompression_is_bounded(monkeypatch, name):
+    if name == 'zstd':
+        pytest.importorskip('zstandard')
+
+    monkeypatch.setattr(message_framing, 'MAX_FRAME_SIZE', 64 * 1024)
+
+    sender = create_codec(name)
+    payload = sender.compress(b' ' * (1024 * 1024))
+
+    assert len(payload) < 64 * 1024
+
+    decoder = MessageDecoder()
+    decoder.codec = create_codec(name)
+
+    with pytest.raises(FramingError):
+        decoder.feed(encode_frame(payload, FLAG_COMPRESSED))
+
+def test_payload_at_the_limit_is_accepted(monkeypatch):
+    monkeypatch.setattr(message_framing, 'MAX_FRAME_SIZE', 1024)
+
+    sender = ZlibCodec()
+    payload = json.dumps(' ' * 1022).encode('utf-8')
+
+    assert len(payload) == 1024
+
+    decoder = MessageDecoder()
+    decoder.codec = ZlibCodec()
+
+    assert decoder.feed(encode_frame(sender.compress(payload), FLAG_COMPRESSED)) == [(payload, None)]
+
+def test_large_message_grows_the_buffer():
+    obj = { 'type': 'recvblockpage', 'blockpage': ['x' * 1000] * 200 }
+    decoder = MessageDecoder(buffer_size=16)
+
+    assert decode_all(decoder, encode_message(obj)) == [(obj, None)]
+
+def test_recv_from_socket():
+    left, right = socket.socketpair()
+
+    try:
+        send_message(left, { 'type': 'ping' })
+        send_message(left, { 'type': 'recvblockpage_raw' }, attachment=b'\x00' * 100000)
+        left.close()
+
+        decoder = MessageDecoder(buffer_size=1024)
+        messages = []
+
+        while True:
+            received = decoder.recv_from(right)
+
+            if received is None:
+                break
+
+            messages += received
+
+        assert [json.loads(payload) for payload, attachment in messages] == [{ 'type': 'ping' }, { 'type': 'recvblockpage_raw' }]
+        assert messages[1][1] == b'\x00' * 100000
+    finally:
+        right.close()
+
+def test_prepared_message_encodes_the_same():
+    obj = { 'type': 'inv', 'items': [['tx', 'ab' * 32]] }
+
+    assert encode_message(PreparedMessage(obj)) == encode_message(obj)
+
+def test_attachment_without_message_is_rejected():
+    with pytest.raises(FramingError):
+        MessageDecoder().feed(encode_frame(b'abc', FLAG_ATTACHMENT))
+
+def test_message_instead_of_attachment_is_rejected():
+    data = encode_frame(encode_payload({ 'type': 'recvblockpage_raw' }), FLAG_HAS_ATTACHMENT) + encode_message({ 'type': 'ping' })
+
+    with pytest.raises(FramingError):
+        MessageDecoder().feed(data)
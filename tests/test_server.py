@@ -0,0 +1,87 @@
+import json
+import queue
+
+import pytest
+
+# the server reports to node hubs over http
+pytest.importorskip('requests')
+
+import server as server_module
+from client import InvalidMessage
+from server import Server
+from gossip import GOSSIP_FEATURE, INV_TX, get_inv_message
+from message_framing import PreparedMessage
+from sync_workers import SyncWorkerPool
+from transaction import Transaction
+from transaction_pool import TransactionPool
+from object_identifier import ObjectIdentifier
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(server_module, 'select_node_hub', lambda: None)
+    monkeypatch.setattr(TransactionPool, 'instance', TransactionPool.TransactionPoolSingleton(None, None))
+
+    return Server(onstatus=print)
+
+def test_broadcast_only_relays_transactions(server):
+    client_socket = object()
+    tx = Transaction(ObjectIdentifier.parse('vivx.network.core-metachain'), { 'value': 1 }, 100)
+
+    with pytest.raises(InvalidMessage):
+        server.respond_to_command(client_socket, { 'type': 'broadcast', 'msg': { 'type': 'updatepeers', 'peers': [] } })
+
+    server.respond_to_command(client_socket, { 'type': 'broadcast', 'msg': { 'type': 'recvtx', 'tx': tx.serialize() } })
+
+    assert [(queued.calc_hash(), source) for queued, source in TransactionPool.instance.tx_queue] == [(tx.calc_hash(), client_socket)]
+
+class Socket:
+    pass
+
+def add_fake_client(server, name, features=None, queue_size=server_module.PEER_SEND_QUEUE_SIZE):
+    client_socket = Socket()
+
+    server.clients[name] = client_socket
+    server._send_queues[client_socket] = queue.Queue(queue_size)
+    server._features[client_socket] = features
+
+    return client_socket
+
+def get_queued(server, client_socket):
+    send_queue = server._send_queues[client_socket]
+
+    return [json.loads(send_queue.get_nowait().payload) for i in range(0, send_queue.qsize())]
+
+def test_full_send_queue_drops_messages(server):
+    client_socket = add_fake_client(server, 'a', queue_size=2)
+
+    for i in range(0, 5):
+        server.queue_message(client_socket, PreparedMessage({ 'type': 'ping', 'id': i }))
+
+    assert [message['id'] for message in get_queued(server, client_socket)] == [0, 1]
+
+def test_transactions_are_relayed_to_other_clients(server):
+    source = add_fake_client(server, 'source')
+    legacy = add_fake_client(server, 'legacy')
+    gossip = add_fake_client(server, 'gossip', features=[GOSSIP_FEATURE])
+    tx = Transaction(ObjectIdentifier.parse('vivx.network.core-metachain'), { 'value': 1 }, 100)
+
+    server.relay_transactions([(tx, source)])
+
+    assert get_queued(server, source) == []
+    assert get_queued(server, legacy) == [{ 'type': 'recvtx', 'tx': tx.serialize() }]
+    assert get_queued(server, gossip) == [get_inv_message(INV_TX, [tx.calc_hash()])]
+
+def test_header_and_block_requests_are_bounded(server, monkeypatch):
+    sent = []
+    client_socket = Socket()
+
+    monkeypatch.setattr(server, 'send_to_client', lambda client_socket, obj: sent.append(obj))
+    # not started, so requests stay queued
+    server.sync_workers = SyncWorkerPool(workers=1, queue_size=1)
+
+    server.respond_to_command(client_socket, { 'type': 'get_headers', 'identifier': 'vivx.network.core-metachain', 'last_block_hash': '0', 'id': 1 })
+    server.respond_to_command(client_socket, { 'type': 'get_headers', 'identifier': 'vivx.network.core-metachain', 'last_block_hash': '0', 'id': 2 })
+    server.respond_to_command(client_socket, { 'type': 'get_blocks', 'identifier': 'vivx.network.core-metachain', 'start_height': 1, 'count': 10, 'id': 3 })
+
+    assert [(message['type'], message['id'], 'error' in message) for message in sent] == [('recvheaders', 2, True), ('recvblockpage', 3, True)]
+    assert sent[1]['blockpage'] == []
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+import pytest
+
+from sync_flow import SyncWindow, AsyncSyncWindow, PageSizer, SyncStalled, get_requested_window, get_credit_message, MIN_SYNC_PAGE_SIZE, MAX_SYNC_PAGE_SIZE
+
+def test_requested_window():
+    assert get_requested_window({ 'window': 100 }) == 100
+    assert get_requested_window({ 'window': 0 }) is None
+    assert get_requested_window({ 'window': True }) is None
+    assert get_requested_window({}) is None
+
+def test_credit_grants_the_window_back():
+    window = SyncWindow(10)
+    window.take(10)
+
+    message = get_credit_message(3, 4)
+
+    assert message == { 'type': 'sync_credit', 'id': 3, 'blocks': 4 }
+
+    window.grant(message['blocks'])
+
+    assert window.take(10, timeout=0.01) == 4
+
+def test_page_size_grows_at_most_twofold():
+    sizer = PageSizer()
+
+    sizer.record(MIN_SYNC_PAGE_SIZE, 0.001)
+
+    assert sizer.page_size == MIN_SYNC_PAGE_SIZE * 2
+
+    for i in range(0, 20):
+        sizer.record(sizer.page_size, 0.001)
+
+    assert sizer.page_size == MAX_SYNC_PAGE_SIZE
+
+def test_page_size_shrinks_when_slow():
+    sizer = PageSizer(page_size=500)
+
+    for i in range(0, 20):
+        sizer.record(sizer.page_size, 10)
+
+    assert sizer.page_size == MIN_SYNC_PAGE_SIZE
+
+def test_window_without_flow_control():
+    assert SyncWindow(None).take(500) == 500
+
+def test_window_is_taken_and_granted():
+    window = SyncWindow(10)
+
+    assert window.take(6) == 6
+    assert window.take(6) == 4
+
+    with pytest.raises(SyncStalled):
+        window.take(1, timeout=0.01)
+
+    threading.Timer(0.01, window.grant, (3,)).start()
+
+    assert window.take(6, timeout=5) == 3
+
+def test_closed_window_stops_the_stream():
+    window = SyncWindow(0)
+    threading.Timer(0.01, window.close).start()
+
+    with pytest.raises(SyncStalled):
+        window.take(1, timeout=5)
+
+def test_async_window():
+    async def main():
+        window = AsyncSyncWindow(2)
+
+        assert await window.take(5) == 2
+
+        asyncio.get_running_loop().call_later(0.01, window.grant, 4)
+
+        assert await window.take(5, timeout=5) == 4
+
+        with pytest.raises(SyncStalled):
+            await window.take(1, timeout=0.01)
+
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from sync_workers import SyncWorkerPool, BlockPageCache, SyncBusy
+
+class FakeBlock:
+    def __init__(self, height):
+        self.height = height
+
+    def serialize(self):
+        return { 'height': self.height }
+
+# a chain of height blocks, counting the blocks read from it
+class FakeBlockchain:
+    def __init__(self, height):
+        self.block_index = [None] * height
+        self.reads = 0
+
+    def get_identifier(self):
+        return 'test.chain'
+
+    def page_blocks(self, start=0, pagesize=10):
+        for i in range(start, len(self.block_index), pagesize):
+            heights = range(i + 1, min(i + pagesize, len(self.block_index)) + 1)
+            self.reads += len(heights)
+
+            yield [FakeBlock(height) for height in heights]
+
+def test_submit_fails_when_the_queue_is_full():
+    pool = SyncWorkerPool(workers=1, queue_size=1)
+    pool.submit(print)
+
+    with pytest.raises(SyncBusy):
+        pool.submit(print)
+
+def test_submitted_jobs_run():
+    pool = SyncWorkerPool(workers=2)
+    done = threading.Event()
+
+    pool.start()
+    pool.submit(done.set)
+
+    assert done.wait(5)
+
+    pool.stop()
+
+def test_page_spans_chunks():
+    blockchain = FakeBlockchain(25)
+    cache = BlockPageCache(chunk_size=10)
+
+    assert [block['height'] for block in cache.get_page(blockchain, 5, 10)] == list(range(6, 16))
+    assert [block['height'] for block in cache.get_page(blockchain, 20, 10)] == list(range(21, 26))
+
+def test_full_chunks_are_cached():
+    blockchain = FakeBlockchain(25)
+    cache = BlockPageCache(chunk_size=10)
+
+    cache.get_page(blockchain, 0, 20)
+    reads = blockchain.reads
+    cache.get_page(blockchain, 0, 20)
+
+    assert blockchain.reads == reads
+
+    # the tip chunk may still grow, so it is read again
+    cache.get_page(blockchain, 20, 10)
+    cache.get_page(blockchain, 20, 10)
+
+    assert blockchain.reads == reads + 10
+
+def test_least_recently_used_chunk_is_evicted():
+    blockchain = FakeBlockchain(40)
+    cache = BlockPageCache(max_chunks=2, chunk_size=10)
+
+    cache.get_page(blockchain, 0, 30)
+    reads = blockchain.reads
+    cache.get_page(blockchain, 0, 10)
+
+    assert blockchain.reads == reads + 10
@@ -0,0 +1,63 @@
+import threading
+
+from transaction import Transaction
+from transaction_pool import TransactionPool
+from object_identifier import ObjectIdentifier
+
+def make_tx(value):
+    return Transaction(ObjectIdentifier.parse('vivx.network.core-metachain'), { 'value': value }, 100)
+
+# records what the pool relays to it
+class Relay:
+    def __init__(self):
+        self.is_connected = True
+        self.relayed = []
+        self.event = threading.Event()
+
+    def relay_transactions(self, items):
+        self.relayed.append(items)
+        self.event.set()
+
+def test_queued_transactions_are_relayed_as_they_arrive():
+    server, client = Relay(), Relay()
+    pool = TransactionPool.TransactionPoolSingleton(server, client)
+    source = object()
+    tx = make_tx(1)
+
+    pool.start()
+
+    try:
+        assert pool.queue_tx(tx, source=source)
+        # no polling interval to wait out
+        assert server.event.wait(1)
+        assert client.event.wait(1)
+
+        assert server.relayed == [[(tx, source)]]
+        assert client.relayed == [[(tx, source)]]
+    finally:
+        pool.stop()
+
+def test_duplicates_are_not_relayed_again():
+    server = Relay()
+    pool = TransactionPool.TransactionPoolSingleton(server, None)
+    tx = make_tx(1)
+
+    assert pool.queue_tx(tx)
+    assert not pool.queue_tx(tx)
+    assert len(pool.tx_queue) == 1
+
+def test_disconnected_client_is_skipped():
+    server, client = Relay(), Relay()
+    client.is_connected = False
+    pool = TransactionPool.TransactionPoolSingleton(server, client)
+
+    pool.start()
+
+    try:
+        pool.queue_tx(make_tx(1))
+
+        assert server.event.wait(1)
+    finally:
+        pool.stop()
+
+    assert client.relayed == []
@@ -0,0 +1,46 @@
+import pytest
+
+from transaction import Transaction
+from transaction_pool import TransactionPool
+from object_identifier import ObjectIdentifier
+from mempool import TX_ACCEPTED, TX_DUPLICATE
+from tx_batch import get_tx_batch_message, get_tx_batch_response, split_tx_batches, TX_INVALID, MAX_TX_BATCH
+
+IDENTIFIER = ObjectIdentifier.parse('vivx.network.core-metachain')
+
+def make_tx(value):
+    return Transaction(IDENTIFIER, { 'value': value }, 100 + value)
+
+def test_split_tx_batches():
+    batches = split_tx_batches(list(range(0, 12)), batch_size=5)
+
+    assert [len(batch) for batch in batches] == [5, 5, 2]
+    assert split_tx_batches([]) == []
+
+def test_batch_response_has_a_result_per_item():
+    pool = TransactionPool.TransactionPoolSingleton(None, None)
+    a, b = make_tx(1), make_tx(2)
+
+    obj = get_tx_batch_message([a, b], IDENTIFIER, request_id=7)
+    obj['txs'] = [obj['txs'][0], 'not a transaction', obj['txs'][1], obj['txs'][0]]
+
+    response = get_tx_batch_response(pool, obj)
+    results = response['results']
+
+    assert response['id'] == 7
+    assert [result['status'] for result in results] == [TX_ACCEPTED, TX_INVALID, TX_ACCEPTED, TX_DUPLICATE]
+    assert results[0]['hash'] == a.calc_hash()
+    assert 'error' in results[1]
+    assert len(pool.mempool) == 2
+    assert len(pool.tx_queue) == 2
+
+def test_malformed_batch_is_ignored():
+    pool = TransactionPool.TransactionPoolSingleton(None, None)
+
+    assert get_tx_batch_response(pool, { 'txs': 'x', 'blockchain': str(IDENTIFIER) }) is None
+    assert get_tx_batch_response(pool, { 'txs': [] }) is None
+    assert get_tx_batch_response(pool, { 'txs': [None] * (MAX_TX_BATCH + 1), 'blockchain': str(IDENTIFIER) }) is None
+
+def test_oversized_batch_message_is_refused():
+    with pytest.raises(AssertionError):
+        get_tx_batch_message([make_tx(1)] * (MAX_TX_BATCH + 1), IDENTIFIER)
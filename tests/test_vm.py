@@ -0,0 +1,126 @@
+import pytest
+
+from bytecode import Bytecode, PackedBytecode
+from bytecode_parser import BytecodeParser
+from instruction import Instruction, Opcode, Value, ValueType
+from vm import VM, CompiledBytecode, MAX_STACK_SIZE
+
+def push(value):
+    return Instruction(Opcode.PUSH, [Value(ValueType.INT, value)])
+
+def op(opcode):
+    return Instruction(opcode)
+
+# 3 * 4, with a value pushed and popped after it, leaving 12
+PROGRAM = [push(3), push(4), op(Opcode.MUL), push(9), op(Opcode.POP), op(Opcode.NOOP)]
+
+def stack_data(vm):
+    return [value.data for value in vm.stack]
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_evaluate(packed):
+    bytecode = Bytecode(PROGRAM)
+
+    if packed:
+        bytecode = PackedBytecode.pack(bytecode)
+
+    vm = VM(bytecode)
+    vm.evaluate()
+
+    assert stack_data(vm) == [12]
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_compiled_matches_uncompiled(packed):
+    bytecode = Bytecode(PROGRAM)
+
+    if packed:
+        bytecode = PackedBytecode.pack(bytecode)
+
+    plain = VM(bytecode)
+    plain.evaluate()
+
+    compiled = VM(CompiledBytecode(bytecode, BytecodeParser.verify(bytecode)))
+    compiled.evaluate()
+
+    assert stack_data(compiled) == stack_data(plain)
+    assert (compiled.gas_used, compiled.steps) == (plain.gas_used, plain.steps)
+
+def test_noop_has_no_handler():
+    compiled = CompiledBytecode(Bytecode([op(Opcode.NOOP), push(1)]))
+
+    assert [handler for handler, operand, cost in compiled.metered_ops][0] is None
+    assert len(compiled.segments[0][0]) == 1
+
+def test_segments_are_checked_without_a_verified_analysis():
+    bytecode = Bytecode(PROGRAM)
+    compiled = CompiledBytecode(bytecode)
+
+    assert compiled.get_segments(0) is compiled.segments
+
+def test_verified_segments_are_unchecked_and_cached():
+    bytecode = Bytecode(PROGRAM)
+    compiled = CompiledBytecode(bytecode, BytecodeParser.verify(bytecode))
+
+    segments = compiled.get_segments(0)
+
+    assert segments is not compiled.segments
+    assert compiled.get_segments(0) is segments
+    # a stack this deep could overflow, so it gets the checked handlers
+    assert compiled.get_segments(MAX_STACK_SIZE) is compiled.segments
+
+def test_stack_needed_uses_checked_segments():
+    bytecode = Bytecode([op(Opcode.POP)])
+    compiled = CompiledBytecode(bytecode, BytecodeParser.verify(bytecode))
+
+    assert compiled.get_segments(0) is compiled.segments
+    assert compiled.get_segments(1) is not compiled.segments
+
+def test_invalid_bytecode_uses_checked_segments():
+    bytecode = Bytecode([Instruction(Opcode.LOAD, [Value(ValueType.INT, 1)])])
+    compiled = CompiledBytecode(bytecode, BytecodeParser.verify(bytecode))
+
+    assert compiled.get_segments(0) is compiled.segments
+
+def test_stack_underflow():
+    vm = VM(Bytecode([push(1), op(Opcode.ADD)]))
+
+    with pytest.raises(AssertionError, match='stack underflow'):
+        vm.evaluate()
+
+def test_stack_overflow():
+    vm = VM(Bytecode([push(1)] * (MAX_STACK_SIZE + 1)), step_limit=MAX_STACK_SIZE * 2)
+
+    with pytest.raises(AssertionError, match='stack overflow'):
+        vm.evaluate()
+
+def test_math_needs_numbers():
+    vm = VM(Bytecode([Instruction(Opcode.PUSH, [Value(ValueType.STRING, 'a')]), push(1), op(Opcode.ADD)]))
+
+    with pytest.raises(AssertionError, match='numeric'):
+        vm.evaluate()
+
+def test_compiled_bytecode_is_reused():
+    bytecode = Bytecode(PROGRAM)
+    compiled = CompiledBytecode(bytecode, BytecodeParser.verify(bytecode))
+    vm = VM(compiled)
+
+    for i in range(3):
+        vm.load(compiled)
+        vm.evaluate()
+
+        assert vm.compiled is compiled
+        assert stack_data(vm) == [12]
+
+def test_load_resets_the_vm():
+    vm = VM(Bytecode(PROGRAM))
+    vm.evaluate()
+
+    vm.load(Bytecode([push(2)]))
+
+    assert vm.stack == []
+    assert (vm.gas_used, vm.steps) == (0, 0)
+    assert vm.compiled is None
+
+    vm.evaluate()
+
+    assert stack_data(vm) == [2]
@@ -0,0 +1,113 @@
+import random
+
+import pytest
+
+from bytecode import Bytecode, PackedBytecode
+from bytecode_parser import BytecodeParser
+from instruction import Instruction, Opcode, Value, ValueType
+from vm import VM, CompiledBytecode, OutOfGas, GAS_COSTS, GAS_CHECK_INTERVAL, MAX_STACK_SIZE, DEFAULT_GAS_LIMIT
+
+def push(value=1):
+    return Instruction(Opcode.PUSH, [Value(ValueType.INT, value)])
+
+def pop():
+    return Instruction(Opcode.POP)
+
+def noop():
+    return Instruction(Opcode.NOOP)
+
+# the outcome of running bytecode: ('ok' or the error, gas used, steps)
+def run(bytecode, gas_limit=DEFAULT_GAS_LIMIT, step_limit=10000, analysis=None):
+    vm = VM(CompiledBytecode(bytecode, analysis), gas_limit=gas_limit, step_limit=step_limit)
+
+    try:
+        vm.evaluate()
+    except OutOfGas as e:
+        assert (e.gas_used, e.steps) == (vm.gas_used, vm.steps)
+        return ('out of gas' if 'gas' in str(e) else 'step limit', vm.gas_used, vm.steps)
+    except AssertionError as e:
+        return (str(e), vm.gas_used, vm.steps)
+
+    return ('ok', vm.gas_used, vm.steps)
+
+# what running instructions one at a time, charging each before it runs, gives
+def reference(instructions, gas_limit=DEFAULT_GAS_LIMIT, step_limit=10000):
+    gas_used = 0
+    steps = 0
+    depth = 0
+
+    for ins in instructions:
+        cost = GAS_COSTS[ins.opcode]
+
+        if gas_used + cost > gas_limit:
+            return ('out of gas', gas_used, steps)
+
+        if steps + 1 > step_limit:
+            return ('step limit', gas_used, steps)
+
+        gas_used += cost
+        steps += 1
+
+        if ins.opcode == Opcode.PUSH:
+            if depth == MAX_STACK_SIZE:
+                return ('stack overflow', gas_used, steps)
+
+            depth += 1
+        elif ins.opcode == Opcode.POP:
+            if depth == 0:
+                return ('stack underflow', gas_used, steps)
+
+            depth -= 1
+
+    return ('ok', gas_used, steps)
+
+def test_failed_program_gas_does_not_depend_on_the_limit():
+    instructions = [push(), pop(), pop()] + [noop()] * (GAS_CHECK_INTERVAL * 2)
+    expected = reference(instructions)
+
+    assert expected == ('stack underflow', 4, 3)
+
+    for gas_limit in [4, 10, 62, 63, 1000, DEFAULT_GAS_LIMIT]:
+        assert run(Bytecode(instructions), gas_limit=gas_limit) == expected
+
+def test_failure_in_a_later_segment():
+    instructions = [noop()] * (GAS_CHECK_INTERVAL + 3) + [pop()] + [noop()] * 10
+
+    assert run(Bytecode(instructions)) == ('stack underflow', GAS_CHECK_INTERVAL + 4, GAS_CHECK_INTERVAL + 4)
+
+def test_out_of_gas_stops_before_the_limit():
+    instructions = [push(), pop()] * 100
+
+    assert run(Bytecode(instructions), gas_limit=100) == ('out of gas', 99, 66)
+
+def test_step_limit():
+    instructions = [noop()] * 100
+
+    assert run(Bytecode(instructions), step_limit=40) == ('step limit', 40, 40)
+
+@pytest.mark.parametrize('packed', [False, True])
+@pytest.mark.parametrize('verified', [False, True])
+def test_matches_reference(packed, verified):
+    rng = random.Random(3)
+
+    for n in range(0, 300):
+        instructions = []
+
+        for i in range(0, rng.randint(0, 150)):
+            opcode = rng.choice([Opcode.PUSH, Opcode.POP, Opcode.NOOP])
+            instructions.append(push() if opcode == Opcode.PUSH else Instruction(opcode))
+
+        gas_limit = rng.randint(0, 400)
+        step_limit = rng.randint(0, 200)
+        bytecode = Bytecode(instructions)
+
+        if packed:
+            bytecode = PackedBytecode.pack(bytecode)
+
+        analysis = BytecodeParser.verify(bytecode) if verified else None
+
+        if analysis is not None and not analysis.is_stack_safe(0, MAX_STACK_SIZE):
+            # the unchecked handlers are only used for stack-safe runs
+            analysis = None
+
+        assert run(bytecode, gas_limit, step_limit, analysis) == reference(instructions, gas_limit, step_limit)
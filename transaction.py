@@ -9,9 +9,13 @@ class Transaction(Hashable, Serializable):
         self.data = data
         self.timestamp = timestamp
         
-    def execute_contract(self):
-        # todo execute the contract script by uploading the data to it and evaluating it
-        pass
+    # runs contract for this transaction: the values in data['args'] are pushed, then the bytecode is evaluated.
+    # returns an ExecutionResult; blocks run all their transactions at once with a BlockExecutor.
+    def execute_contract(self, contract):
+        # imported here so the transaction model doesn't depend on the executor (and its process pool)
+        from block_executor import BlockExecutor
+
+        return BlockExecutor({ str(self.contract_identifier): contract }, workers=1).execute_transactions([self])[0]
 
     def serialize(self):
         return {
@@ -35,6 +39,21 @@ class Transaction(Hashable, Serializable):
 
         return Transaction(contract_identifier=ObjectIdentifier.parse(tx['contract']), data=tx['data'], timestamp=tx['timestamp'])
 
+    def serialize_binary(self, writer):
+        writer.write_str(str(self.contract_identifier))
+        writer.write_str(json.dumps(self.data, separators=(',', ':')))
+        writer.write_uint(int(self.timestamp))
+
+    @classmethod
+    def deserialize_binary(kls, reader):
+        contract = reader.read_str()
+        data = json.loads(reader.read_str())
+        timestamp = reader.read_uint()
+
+        assert isinstance(data, dict), 'data should be dict'
+
+        return Transaction(contract_identifier=ObjectIdentifier.parse(contract), data=data, timestamp=timestamp)
+
     def calc_hash(self):
         tx_str = str(self.contract_identifier) + json.dumps(self.data) + str(self.timestamp)
         tx_hash = self.hash_str(tx_str)
@@ -1,7 +1,11 @@
 import _thread
+import threading
 import time
+from collections import deque
 
 from transaction import Transaction
+from mempool import Mempool, MAX_BLOCK_TXS, MAX_BLOCK_BYTES, TX_ACCEPTED, TX_DUPLICATE
+from gossip import SeenSet, InflightRequests, GETDATA_TIMEOUT, retry_expired_requests
 
 # a global singleton transaction pool
 class TransactionPool:
@@ -9,39 +13,118 @@ class TransactionPool:
         def __init__(self, server, client):
             self.server = server
             self.client = client
-            self.tx_queue = []
+            self.mempool = Mempool()
+            # hashes of transactions already received, so announcements aren't refetched
+            self.seen = SeenSet()
+            # items requested with getdata that haven't arrived yet
+            self.requests = InflightRequests()
+            # (transaction, source) pairs new to the mempool, waiting to be relayed.
+            # source is the connection it came from (a client socket, peer or client), or None if it is our own.
+            self.tx_queue = deque()
+            # signalled when tx_queue gets a transaction (or the pool stops)
+            self._tx_queued = threading.Condition()
             self._loop_thread = None
             self.running = False
 
-        def enqueue(self, tx):
+        # adds a received transaction to the mempool and relays it, unless it is already pending,
+        # was seen before or has been mined. returns True if the transaction was new.
+        def queue_tx(self, tx, source=None):
             assert isinstance(tx, Transaction)
-            self.tx_queue.append(tx)
+
+            tx_hash = tx.calc_hash()
+
+            self.requests.received(tx_hash)
+
+            if tx_hash in self.seen or not self.mempool.add(tx):
+                return False
+
+            self.seen.add(tx_hash)
+
+            with self._tx_queued:
+                self.tx_queue.append((tx, source))
+                self._tx_queued.notify()
+
+            return True
+
+        # queue_tx for a batch of transactions, taking the mempool and relay locks once.
+        # returns the mempool's outcome (TX_ACCEPTED, TX_DUPLICATE, ...) for each transaction.
+        def queue_txs(self, txs, source=None):
+            tx_hashes = [tx.calc_hash() for tx in txs]
+            # transactions seen before (relayed or mined) count as duplicates without reaching the mempool
+            results = [TX_DUPLICATE] * len(txs)
+            unseen = [index for index, tx_hash in enumerate(tx_hashes) if tx_hash not in self.seen]
+
+            added = self.mempool.add_many([txs[index] for index in unseen], [tx_hashes[index] for index in unseen])
+
+            for index, result in zip(unseen, added):
+                results[index] = result
+
+            accepted = [tx for tx, result in zip(txs, results) if result == TX_ACCEPTED]
+
+            for tx_hash, result in zip(tx_hashes, results):
+                self.requests.received(tx_hash)
+
+                if result == TX_ACCEPTED:
+                    self.seen.add(tx_hash)
+
+            if len(accepted) != 0:
+                with self._tx_queued:
+                    self.tx_queue.extend([(tx, source) for tx in accepted])
+                    self._tx_queued.notify()
+
+            return results
+
+        def enqueue(self, tx, source=None):
+            return self.queue_tx(tx, source)
+
+        # the pending transactions a miner should put in its next block
+        def select_batch(self, max_count=MAX_BLOCK_TXS, max_bytes=MAX_BLOCK_BYTES):
+            return self.mempool.select_batch(max_count, max_bytes)
+
+        # called once a block is part of the chain, so its transactions aren't mined or accepted again
+        def remove_block_transactions(self, block):
+            tx_hashes = [tx.calc_hash() for tx in block.tx_set.transactions]
+
+            for tx_hash in tx_hashes:
+                self.seen.add(tx_hash)
+                self.requests.received(tx_hash)
+
+            self.mempool.remove_many(tx_hashes)
 
         def start(self):
             self.running = True
             self._loop_thread = _thread.start_new_thread(self.loop, ())
 
         def stop(self):
-            self.running = False
+            with self._tx_queued:
+                self.running = False
+                self._tx_queued.notify()
 
+        # gossips queued transactions on as soon as they arrive: to some of the server's clients,
+        # and to the server our client is connected to. everything queued meanwhile goes out in one announcement.
+        # between transactions, getdata requests that went unanswered are retried with other peers.
         def loop(self):
-            while self.running:
-                while len(self.tx_queue) != 0:
-                    print("TEST")
-                    tx_obj = self.tx_queue[0]
-                    tx_serialized = tx_obj.serialize()
+            while True:
+                with self._tx_queued:
+                    self._tx_queued.wait_for(lambda: len(self.tx_queue) != 0 or not self.running, GETDATA_TIMEOUT / 2)
+
+                    if not self.running:
+                        return
+
+                    items = list(self.tx_queue)
+                    self.tx_queue.clear()
+
+                retry_expired_requests(self, time.monotonic())
 
-                    # TODO: possibly verify the tx first ? (double-check)
+                if len(items) == 0:
+                    continue
 
-                    for key, value in self.server.clients.items():
-                        value.send(json.dumps({
-                            'type': 'recvtx',
-                            'tx': tx_serialized
-                        }).encode('utf-8'))
+                # TODO: possibly verify the tx first ? (double-check)
 
-                    self.tx_queue.pop(0)
+                self.server.relay_transactions(items)
 
-                time.sleep(2)
+                if self.client is not None and self.client.is_connected:
+                    self.client.relay_transactions(items)
 
 
 
@@ -1,13 +1,22 @@
 from transaction import Transaction
+from merkle_tree import MerkleTree
+import re
+
 from utility_classes import Hashable, Serializable
 
+TX_HASH_PATTERN = re.compile('^[0-9a-f]{64}$')
+
 class TransactionSet(Hashable, Serializable):
     def __init__(self, transactions):
         self.transactions = transactions
+        self._merkle_tree = None
 
-    def add_tx(tx):
+    def add_tx(self, tx):
         self.transactions.append(tx)
 
+        if self._merkle_tree is not None:
+            self._merkle_tree.append(self._leaf_hash(tx))
+
     def serialize(self):
         return list(map(lambda item: item.serialize(), self.transactions))
 
@@ -15,10 +24,56 @@ class TransactionSet(Hashable, Serializable):
     def deserialize(kls, tx_set):
         return TransactionSet(list(map(lambda item: Transaction.deserialize(item), tx_set)))
 
-    def calc_hash(self):
-        tx_hash = ''
-        
+    def serialize_binary(self, writer):
+        writer.write_uint(len(self.transactions))
+
+        for tx in self.transactions:
+            tx.serialize_binary(writer)
+
+    @classmethod
+    def deserialize_binary(kls, reader):
+        count = reader.read_uint()
+
+        return TransactionSet([Transaction.deserialize_binary(reader) for i in range(0, count)])
+
+    # transactions appearing more than once; a valid set has none. returns a list of errors.
+    def check_duplicates(self):
+        errors = []
+        seen = set()
+
         for tx in self.transactions:
-            tx_hash = self.hash_str(tx_hash + tx.calc_hash())
-            
-        return tx_hash
\ No newline at end of file
+            tx_hash = tx.calc_hash()
+
+            if tx_hash in seen:
+                errors.append("Transaction {} appears more than once".format(tx_hash))
+
+            seen.add(tx_hash)
+
+        return errors
+
+    # leaves are hash(tx hash), so a single-transaction set hashes the same
+    # as it did under the previous sequential hash chain. leaves hash exactly 64 hex characters,
+    # which keeps them apart from internal nodes (see NODE_PREFIX in merkle_tree.py).
+    def _leaf_hash(self, tx):
+        return self.hash_str(tx.calc_hash())
+
+    def get_merkle_tree(self):
+        # rebuild if the transaction list was modified directly
+        if self._merkle_tree is None or len(self._merkle_tree) != len(self.transactions):
+            self._merkle_tree = MerkleTree(list(map(self._leaf_hash, self.transactions)))
+
+        return self._merkle_tree
+
+    # inclusion proof for the transaction at tx_index, checked with verify_proof()
+    def proof(self, tx_index):
+        return self.get_merkle_tree().proof(tx_index)
+
+    @classmethod
+    def verify_proof(kls, tx_hash, proof, root):
+        if not isinstance(tx_hash, str) or TX_HASH_PATTERN.match(tx_hash) is None:
+            return False
+
+        return MerkleTree.verify_proof(Hashable().hash_str(tx_hash), proof, root)
+
+    def calc_hash(self):
+        return self.get_merkle_tree().root()
\ No newline at end of file
@@ -0,0 +1,57 @@
+from transaction import Transaction
+
+# the most transactions in one pushtx_batch message; larger submissions are split across messages
+MAX_TX_BATCH = 5000
+
+# outcome of a batch item that could not be deserialized
+TX_INVALID = 'invalid'
+
+def get_tx_batch_message(txs, blockchain_identifier, request_id=None):
+    assert len(txs) <= MAX_TX_BATCH
+
+    return {
+        'type': 'pushtx_batch',
+        'id': request_id,
+        'blockchain': str(blockchain_identifier),
+        'txs': [tx.serialize() for tx in txs]
+    }
+
+# txs in chunks of at most MAX_TX_BATCH
+def split_tx_batches(txs, batch_size=MAX_TX_BATCH):
+    return [txs[i:i + batch_size] for i in range(0, len(txs), batch_size)]
+
+# answers a pushtx_batch: every item is deserialized, then the valid ones are added to the pool together.
+# the pushtx_result message holds one {'status', 'hash'?, 'error'?} result per item, in order,
+# or None is returned if the message itself is malformed.
+def get_tx_batch_response(pool, obj, source=None):
+    items = obj.get("txs")
+
+    if not isinstance(items, list) or len(items) > MAX_TX_BATCH or obj.get("blockchain") is None:
+        return None
+
+    results = [None] * len(items)
+    txs = []
+    indices = []
+
+    for index, item in enumerate(items):
+        try:
+            txs.append(Transaction.deserialize(item))
+            indices.append(index)
+        except Exception as e:
+            results[index] = {
+                'status': TX_INVALID,
+                'error': str(e)
+            }
+
+    for index, tx, status in zip(indices, txs, pool.queue_txs(txs, source=source)):
+        results[index] = {
+            'status': status,
+            'hash': tx.calc_hash()
+        }
+
+    return {
+        'type': 'pushtx_result',
+        'id': obj.get("id"),
+        'results': results
+    }
+
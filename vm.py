@@ -1,52 +1,274 @@
-from bytecode import Bytecode
+import operator
+
+from bytecode import Bytecode, PackedBytecode
 from instruction import *
 
 MAX_STACK_SIZE = 64
 
-class VM:
-    def __init__(self, bytecode):
+# limits of one evaluation, unless the VM is given others
+DEFAULT_GAS_LIMIT = 1000000
+DEFAULT_STEP_LIMIT = 100000
+
+# gas is checked once per segment of this many instructions; a segment that would run out is stepped through one by one
+GAS_CHECK_INTERVAL = 32
+
+# gas charged per instruction. opcodes missing here cost as much as a NOOP.
+GAS_COSTS = {
+    Opcode.NOOP: 1,
+    Opcode.LOAD: 2,
+    Opcode.PUSH: 2,
+    Opcode.POP: 1,
+    Opcode.ADD: 3,
+    Opcode.SUB: 3,
+    Opcode.MUL: 5,
+    Opcode.DIV: 5,
+    Opcode.MOD: 5
+}
+
+# raised when an evaluation would go past its gas or step limit. the instruction that would have
+# gone over is not run; gas_used and steps are what the instructions before it consumed.
+class OutOfGas(Exception):
+    def __init__(self, msg, gas_used, steps):
+        Exception.__init__(self, msg)
+
+        self.gas_used = gas_used
+        self.steps = steps
+
+# the handlers below run compiled instructions: each takes the stack and the instruction's operand
+
+def _push(stack, value):
+    assert len(stack) < MAX_STACK_SIZE, "stack overflow"
+    stack.append(value)
+
+def _pop(stack, operand):
+    assert len(stack) >= 1, "stack underflow"
+    stack.pop()
+
+# a handler for a math opcode, computing fn(top, second) of the two values it pops
+def _math_handler(fn):
+    INT = ValueType.INT
+    FLOAT = ValueType.FLOAT
+    create = Value.create
+
+    def handler(stack, operand):
+        assert len(stack) >= 2, "stack underflow"
+
+        a = stack.pop()
+        b = stack.pop()
+
+        assert a.value_type is INT or a.value_type is FLOAT, "value must be a numeric type"
+        assert b.value_type is INT or b.value_type is FLOAT, "value must be a numeric type"
+
+        stack.append(create(fn(a.data, b.data)))
+
+    return handler
+
+# the same handlers without the stack depth checks, for bytecode whose stack use has been verified (see BytecodeAnalysis)
+
+def _push_unchecked(stack, value):
+    stack.append(value)
+
+def _pop_unchecked(stack, operand):
+    stack.pop()
+
+def _unchecked_math_handler(fn):
+    INT = ValueType.INT
+    FLOAT = ValueType.FLOAT
+    create = Value.create
+
+    def handler(stack, operand):
+        a = stack.pop()
+        b = stack.pop()
+
+        assert a.value_type is INT or a.value_type is FLOAT, "value must be a numeric type"
+        assert b.value_type is INT or b.value_type is FLOAT, "value must be a numeric type"
+
+        stack.append(create(fn(a.data, b.data)))
+
+    return handler
+
+MATH_FUNCTIONS = {
+    Opcode.ADD: operator.add,
+    Opcode.SUB: operator.sub,
+    Opcode.MUL: operator.mul,
+    Opcode.DIV: operator.truediv,
+    Opcode.MOD: operator.mod
+}
+
+# opcodes missing here (NOOP, LOAD) do nothing and are left out of compiled code
+HANDLERS = {
+    Opcode.PUSH: _push,
+    Opcode.POP: _pop
+}
+
+# handler -> its unchecked counterpart
+UNCHECKED_HANDLERS = {
+    _push: _push_unchecked,
+    _pop: _pop_unchecked
+}
+
+for opcode, fn in MATH_FUNCTIONS.items():
+    HANDLERS[opcode] = _math_handler(fn)
+    UNCHECKED_HANDLERS[HANDLERS[opcode]] = _unchecked_math_handler(fn)
+
+# HANDLERS and GAS_COSTS indexed by opcode byte, for compiling packed bytecode
+HANDLERS_BY_VALUE = [None] * 256
+GAS_COSTS_BY_VALUE = [GAS_COSTS[Opcode.NOOP]] * 256
+
+for opcode, handler in HANDLERS.items():
+    HANDLERS_BY_VALUE[opcode.value] = handler
+
+for opcode, cost in GAS_COSTS.items():
+    GAS_COSTS_BY_VALUE[opcode.value] = cost
+
+# bytecode decoded once into (handler, operand) pairs, so evaluating it involves no opcode comparisons.
+# the pairs are split into segments of up to GAS_CHECK_INTERVAL instructions, each knowing its total gas cost.
+# given the bytecode's BytecodeAnalysis, runs that start with a stack it was verified for skip the stack depth checks.
+class CompiledBytecode:
+    def __init__(self, bytecode, analysis=None):
+        assert isinstance(bytecode, Bytecode) or isinstance(bytecode, PackedBytecode)
+
         self.bytecode = bytecode
-        self.stack = []
+        self.analysis = analysis
+        # (handler, operand, gas cost) per instruction; handler is None for instructions that do nothing
+        self.metered_ops = []
+
+        if isinstance(bytecode, PackedBytecode):
+            self._compile_packed(bytecode)
+        else:
+            for ins in bytecode.instructions:
+                handler = HANDLERS.get(ins.opcode)
+                operand = None
+
+                if handler is _push:
+                    operand = ins.arguments[0]
+
+                self.metered_ops.append((handler, operand, GAS_COSTS.get(ins.opcode, GAS_COSTS[Opcode.NOOP])))
+
+        # (ops, gas cost, metered ops): ops are the (handler, operand) pairs of the segment's metered ops that do something
+        self.segments = []
+
+        for start in range(0, len(self.metered_ops), GAS_CHECK_INTERVAL):
+            metered_ops = self.metered_ops[start:start + GAS_CHECK_INTERVAL]
+            ops = [(handler, operand) for handler, operand, cost in metered_ops if handler is not None]
+
+            self.segments.append((ops, sum([cost for handler, operand, cost in metered_ops]), metered_ops))
+
+        # segments using the unchecked handlers, built on first use
+        self._unchecked_segments = None
+
+    # the segments to run when starting with initial_depth values on the stack
+    def get_segments(self, initial_depth):
+        if self.analysis is None or not self.analysis.is_stack_safe(initial_depth, MAX_STACK_SIZE):
+            return self.segments
+
+        if self._unchecked_segments is None:
+            self._unchecked_segments = [(
+                [(UNCHECKED_HANDLERS[handler], operand) for handler, operand in ops],
+                cost,
+                [(UNCHECKED_HANDLERS.get(handler), operand, op_cost) for handler, operand, op_cost in metered_ops]
+            ) for ops, cost, metered_ops in self.segments]
+
+        return self._unchecked_segments
+
+    # straight from the opcode and argument sections, without building Instruction objects
+    def _compile_packed(self, bytecode):
+        constants = bytecode.constants
+        arguments = bytecode.arguments
+        argument_starts = bytecode.argument_starts
+
+        for index, value in enumerate(bytecode.opcodes):
+            handler = HANDLERS_BY_VALUE[value]
+            operand = None
+
+            if handler is _push:
+                assert argument_starts[index + 1] > argument_starts[index], "push without an argument"
+
+                operand = constants[arguments[argument_starts[index]]]
+
+            self.metered_ops.append((handler, operand, GAS_COSTS_BY_VALUE[value]))
 
-    def _ensure_stack_size(self, value):
-        assert len(self.stack) >= value, "stack underflow"
+class VM:
+    def __init__(self, bytecode, gas_limit=DEFAULT_GAS_LIMIT, step_limit=DEFAULT_STEP_LIMIT):
+        self.stack = []
+        self.bytecode = None
+        # compiled on the first evaluate unless given already compiled
+        self.compiled = None
 
-    def _math_operation(self):
-        self._ensure_stack_size(2)
+        self.gas_limit = gas_limit
+        self.step_limit = step_limit
+        # consumed by the current evaluation
+        self.gas_used = 0
+        self.steps = 0
 
-        a = self.stack[-1]
-        self.stack.pop()
-        b = self.stack[-1]
-        self.stack.pop()
+        self.load(bytecode)
 
-        assert a.value_type == ValueType.INT or a.value_type == ValueType.FLOAT, "value must be a numeric type"
-        assert b.value_type == ValueType.INT or b.value_type == ValueType.FLOAT, "value must be a numeric type"
+    # points the VM at other bytecode and empties its stack, so one VM (and its stack list) can run many programs
+    def load(self, bytecode):
+        self.stack.clear()
+        self.gas_used = 0
+        self.steps = 0
 
-        return (a, b)
+        if isinstance(bytecode, CompiledBytecode):
+            self.bytecode = bytecode.bytecode
+            self.compiled = bytecode
+        else:
+            self.bytecode = bytecode
+            self.compiled = None
 
     def evaluate(self):
-        for ins in self.bytecode.instructions:
-            if ins.opcode == Opcode.NOOP:
-                pass
-            elif ins.opcode == Opcode.PUSH:
-                assert len(self.stack) < MAX_STACK_SIZE, "stack overflow"
-                value = ins.arguments[0]
-                self.stack.append(value)
-            elif ins.opcode == Opcode.POP:
-                self._ensure_stack_size(1)
-                self.stack.pop()
-            elif ins.opcode == Opcode.ADD:
-                a, b = self._math_operation()
-                self.stack.append(Value.create(a.data + b.data))
-            elif ins.opcode == Opcode.SUB:
-                a, b = self._math_operation()
-                self.stack.append(Value.create(a.data - b.data))
-            elif ins.opcode == Opcode.MUL:
-                a, b = self._math_operation()
-                self.stack.append(Value.create(a.data * b.data))
-            elif ins.opcode == Opcode.DIV:
-                a, b = self._math_operation()
-                self.stack.append(Value.create(a.data / b.data))
-            elif ins.opcode == Opcode.MOD:
-                a, b = self._math_operation()
-                self.stack.append(Value.create(a.data % b.data))
\ No newline at end of file
+        if self.compiled is None:
+            self.compiled = CompiledBytecode(self.bytecode)
+
+        stack = self.stack
+
+        for ops, cost, metered_ops in self.compiled.get_segments(len(stack)):
+            # a segment is charged up front, as a whole, when it fits in what is left
+            if self.gas_used + cost > self.gas_limit or self.steps + len(metered_ops) > self.step_limit:
+                self._evaluate_metered(metered_ops)
+                continue
+
+            self.gas_used += cost
+            self.steps += len(metered_ops)
+
+            remaining = iter(ops)
+
+            try:
+                for handler, operand in remaining:
+                    handler(stack, operand)
+            except Exception:
+                # charge only up to the instruction that failed, as metering one by one would have
+                self._refund(metered_ops, len(ops) - operator.length_hint(remaining))
+                raise
+
+    # gives back what a pre-charged segment's instructions after the failed one were charged.
+    # started is how many of the segment's ops (those with a handler) had started.
+    def _refund(self, metered_ops, started):
+        index = 0
+
+        for index, (handler, operand, cost) in enumerate(metered_ops):
+            if handler is not None:
+                started -= 1
+
+                if started == 0:
+                    break
+
+        unused = metered_ops[index + 1:]
+
+        self.gas_used -= sum([cost for handler, operand, cost in unused])
+        self.steps -= len(unused)
+
+    # runs a segment one instruction at a time, stopping exactly at the first one over a limit
+    def _evaluate_metered(self, metered_ops):
+        for handler, operand, cost in metered_ops:
+            if self.gas_used + cost > self.gas_limit:
+                raise OutOfGas("out of gas: used {} of {}".format(self.gas_used, self.gas_limit), self.gas_used, self.steps)
+
+            if self.steps + 1 > self.step_limit:
+                raise OutOfGas("step limit reached: ran {} of {} steps".format(self.steps, self.step_limit), self.gas_used, self.steps)
+
+            self.gas_used += cost
+            self.steps += 1
+
+            if handler is not None:
+                handler(self.stack, operand)